@@ -0,0 +1,57 @@
+"""
+Benchmark of `libs.dataset.utils.format_pos` on a synthetic POS stack.
+
+    python benchmarks/bench_format_pos.py --tickers 1000 --days 2500
+
+The default size (1,000 tickers x 2,500 days x 4 variables x 2 smooths,
+with revisions) is about 24 million long rows, close to the production
+stack files. The equality with the reference is checked in
+tests/test_format_pos.py.
+"""
+import os
+import sys
+import time
+import argparse
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from libs.dataset.utils import format_pos
+from benchmarks.synthetic import make_pos_stack
+
+
+def format_pos_reference(df):
+    # format_pos before the vectorized rewrite
+    df['DATETIME'] = pd.to_datetime(df['DATETIME'])
+    df['RELEASE_TIMESTAMP'] = pd.to_datetime(df['RELEASE_TIMESTAMP'])
+    df.set_index(['TICKER', 'DATETIME', 'VARIABLE', 'SMOOTH', 'RELEASE_TIMESTAMP'], inplace=True)
+    df = df.xs(0, level='SMOOTH').drop(['BACKFILL'], axis=1)
+    df = df.sort_index()
+    df.reset_index('RELEASE_TIMESTAMP', drop=False, inplace=True)
+    df = df.loc[~df.index.duplicated(keep='last')]
+    df.drop(['RELEASE_TIMESTAMP'], axis=1, inplace=True)
+    return df.unstack('VARIABLE')['VALUE'].sort_index()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tickers', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=2500)
+    parser.add_argument('--skip-reference', action='store_true')
+    args = parser.parse_args()
+
+    df = make_pos_stack(args.tickers, args.days)
+    print(f'rows: {len(df):,}')
+
+    st = time.perf_counter()
+    out = format_pos(df)
+    print(f'format_pos: {time.perf_counter() - st:.2f}s -> {out.shape}')
+
+    if not args.skip_reference:
+        st = time.perf_counter()
+        ref = format_pos_reference(df.copy())
+        print(f'reference : {time.perf_counter() - st:.2f}s -> {ref.shape}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,406 @@
+"""
+Benchmarks of the `libs.dataset` hot paths on synthetic data.
+
+    python benchmarks/run.py --size medium --output results.json
+    python benchmarks/run.py --size medium --compare results.json --only register
+
+The DAL, the alternative data loaders and S3 are replaced by the in-memory
+stubs of `benchmarks/stubs.py`, so nothing leaves the machine. Each case is
+run `--warmup` times, timed `--repeat` times (the minimum is reported) and
+then run once more under tracemalloc for the peak of the Python / numpy
+allocations (memory of the arrow pool is not included).
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import tracemalloc
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from stubs import install_stubs, FakeHandler, LOADER_DATA, S3_OBJECTS
+install_stubs()
+
+import synthetic
+from libs.dataset import utils, common, reload
+from libs.dataset import aiq_pos_csmr_goods as csmr_goods
+from libs.dataset import aiq_pos_elec_goods as elec_goods
+from libs.dataset import aiq_pos_retailer as pos_retailer
+from libs.dataset import aiq_retailer_weekly as retailer_weekly
+from libs.dataset import aiq_geolocation as geolocation
+from libs.dataset.incremental import write_base
+from libs.dataset.universe import UNIVERSE_SUFFIX
+from libs.dataset.materialize import materialized_path
+from libs.analyze.grid_search import fit_lag_diff
+
+
+SIZES = {
+    'small': (50, 365),
+    'medium': (300, 1000),
+    'large': (1000, 2500),
+}
+
+
+@dataclass
+class Case:
+    run: Callable
+    rows_in: int
+    setup: Optional[Callable] = None
+
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str):
+    def register(f):
+        BENCHMARKS[name] = f
+        return f
+    return register
+
+
+class Context:
+    """Synthetic inputs shared by the benchmarks, built on first use."""
+
+    def __init__(self, n_tickers: int, n_days: int, tmp_dir: str):
+        self.n_tickers = n_tickers
+        self.n_days = n_days
+        self.tmp_dir = tmp_dir
+
+    def path(self, *names) -> str:
+        path = os.path.join(self.tmp_dir, *names)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    @cached_property
+    def pos_stack(self) -> pd.DataFrame:
+        return synthetic.make_pos_stack(self.n_tickers, self.n_days)
+
+    @cached_property
+    def pos_stack_gen2(self) -> pd.DataFrame:
+        return synthetic.make_pos_stack(self.n_tickers, self.n_days // 4, seed=1)
+
+    @cached_property
+    def retailer_weekly_stack(self) -> pd.DataFrame:
+        return synthetic.make_retailer_weekly_stack(self.n_tickers, self.n_days)
+
+    @cached_property
+    def geolocation_stack(self) -> pd.DataFrame:
+        return synthetic.make_geolocation_stack(max(self.n_tickers // 10, 1), n_days=self.n_days)
+
+    @cached_property
+    def factset_extract(self) -> pd.DataFrame:
+        return synthetic.make_factset_extract(self.n_tickers, self.n_days)
+
+    @cached_property
+    def lag_diff_datasets(self) -> dict:
+        return synthetic.make_lag_diff_datasets(self.n_tickers)
+
+    @cached_property
+    def alt_dir(self) -> str:
+        # get_alt_tickers 等が読む stack ファイル (universe index あり)
+        data_dir = self.path('alt', '')
+        write_base(self.pos_stack, os.path.join(data_dir, csmr_goods.FILE_NAME_GEN1))
+        write_base(self.pos_stack_gen2, os.path.join(data_dir, csmr_goods.FILE_NAME_GEN2))
+        write_base(self.pos_stack, os.path.join(data_dir, elec_goods.FILE_NAME))
+        write_base(self.pos_stack, os.path.join(data_dir, pos_retailer.FILE_NAME))
+        write_base(self.geolocation_stack, os.path.join(data_dir, geolocation.GEO_FILE_NAME))
+        return data_dir
+
+    @cached_property
+    def alt_dir_no_universe(self) -> str:
+        data_dir = self.path('alt_no_universe', '')
+        for f in os.listdir(self.alt_dir):
+            if not f.endswith(UNIVERSE_SUFFIX):
+                shutil.copy(os.path.join(self.alt_dir, f), data_dir)
+        return data_dir
+
+    @cached_property
+    def extract_dir(self) -> str:
+        # FactSet の extract ファイル (_cae_ を含むファイルは読み込まれない)
+        extract_dir = self.path('extract', '')
+        df = self.factset_extract
+        for i, part in enumerate(np.array_split(np.arange(len(df)), 4)):
+            df.iloc[part].to_parquet(os.path.join(extract_dir, f'px_{i}.parquet'))
+        df.iloc[:10].to_parquet(os.path.join(extract_dir, 'px_cae_0.parquet'))
+        return extract_dir
+
+
+def _n_rows(out) -> Optional[int]:
+    if isinstance(out, tuple):
+        out = out[-1]
+    if isinstance(out, FakeHandler):
+        out = out.data[max(out.data)]
+    return len(out) if hasattr(out, '__len__') else None
+
+
+def _register(f, **kwargs):
+    def run():
+        sdh = FakeHandler()
+        f(sdh, **kwargs)
+        return sdh
+    return run
+
+
+@benchmark('format_pos')
+def bench_format_pos(ctx: Context) -> Case:
+    df = ctx.pos_stack
+    return Case(lambda: utils.format_pos(df), len(df))
+
+
+@benchmark('register_elec_goods_data/file')
+def bench_register_elec_goods_file(ctx: Context) -> Case:
+    return Case(_register(elec_goods.register_elec_goods_data, data_dir=ctx.alt_dir), len(ctx.pos_stack))
+
+
+@benchmark('register_elec_goods_data/loader')
+def bench_register_elec_goods_loader(ctx: Context) -> Case:
+    LOADER_DATA['elec_goods'] = ctx.pos_stack
+    return Case(_register(elec_goods.register_elec_goods_data, data_dir=ctx.path('missing', '')), len(ctx.pos_stack))
+
+
+@benchmark('register_csmr_goods_data/file')
+def bench_register_csmr_goods_file(ctx: Context) -> Case:
+    rows_in = len(ctx.pos_stack) + len(ctx.pos_stack_gen2)
+    return Case(_register(csmr_goods.register_csmr_goods_data, data_dir=ctx.alt_dir), rows_in)
+
+
+@benchmark('register_pos_retailer_data/file')
+def bench_register_pos_retailer_file(ctx: Context) -> Case:
+    return Case(_register(pos_retailer.register_retailer_data, data_dir=ctx.alt_dir), len(ctx.pos_stack))
+
+
+@benchmark('register_retailer_weekly_data/loader')
+def bench_register_retailer_weekly_loader(ctx: Context) -> Case:
+    LOADER_DATA['retailer_weekly'] = ctx.retailer_weekly_stack
+    return Case(
+        _register(retailer_weekly.register_retailer_data, data_dir=ctx.path('missing', '')),
+        len(ctx.retailer_weekly_stack))
+
+
+@benchmark('aggregate_transform_dfsci')
+def bench_aggregate_transform_dfsci(ctx: Context) -> Case:
+    df = ctx.retailer_weekly_stack
+    df = df.loc[df['COMPANY_ID'].str.startswith('all_')].assign(DATETIME=lambda x: pd.to_datetime(x['DATETIME']))
+    return Case(lambda: retailer_weekly.transform_dfsci(retailer_weekly.aggregate_dfsci(df)), len(df))
+
+
+@benchmark('read_foot_traffic_place')
+def bench_read_foot_traffic_place(ctx: Context) -> Case:
+    tickers = sorted(ctx.geolocation_stack['TICKER'].unique())[:5]
+    return Case(
+        lambda: geolocation.read_foot_traffic_place(tickers, data_dir=ctx.alt_dir),
+        len(ctx.geolocation_stack))
+
+
+@benchmark('read_foot_traffic_place/cold')
+def bench_read_foot_traffic_place_cold(ctx: Context) -> Case:
+    tickers = sorted(ctx.geolocation_stack['TICKER'].unique())[:5]
+    agg_path = materialized_path(os.path.join(ctx.alt_dir, geolocation.GEO_FILE_NAME), geolocation.AGG_NAME)
+
+    def setup():
+        # 集計済みデータを作り直す場合
+        if os.path.exists(agg_path):
+            os.remove(agg_path)
+
+    return Case(
+        lambda: geolocation.read_foot_traffic_place(tickers, data_dir=ctx.alt_dir),
+        len(ctx.geolocation_stack), setup)
+
+
+@benchmark('register_market')
+def bench_register_market(ctx: Context) -> Case:
+    df = synthetic.make_wide_frame(ctx.n_tickers, ctx.n_days, columns=('returns', 'returns_oo', 'returns_id', 'returns_on'))
+    S3_OBJECTS[common.MKT_FILES_MAP['elec_goods']] = df
+    return Case(_register(common.register_market, target='elec_goods'), len(df))
+
+
+@benchmark('register_fundamental')
+def bench_register_fundamental(ctx: Context) -> Case:
+    df = synthetic.make_wide_frame(ctx.n_tickers, max(ctx.n_days // 63, 8), columns=('sales',), freq='3MS')
+    S3_OBJECTS['common/fundamental_yoy_on_mongo.parquet'] = df
+    return Case(_register(common.register_fundamental), len(df))
+
+
+@benchmark('get_adj_close')
+def bench_get_adj_close(ctx: Context) -> Case:
+    df = ctx.factset_extract
+    return Case(lambda: common.get_adj_close(df), len(df))
+
+
+@benchmark('reload_market_to_s3')
+def bench_reload_market_to_s3(ctx: Context) -> Case:
+    return Case(
+        lambda: common.reload_market_to_s3(ctx.extract_dir, upload_filename='common/market_return.parquet'),
+        len(ctx.factset_extract))
+
+
+@benchmark('reload/elec_goods/full')
+def bench_reload_elec_goods_full(ctx: Context) -> Case:
+    LOADER_DATA['elec_goods'] = ctx.pos_stack
+    data_dir = ctx.path('reload_full', '')
+    return Case(lambda: elec_goods.reload(data_dir), len(ctx.pos_stack))
+
+
+@benchmark('reload/elec_goods/incremental')
+def bench_reload_elec_goods_incremental(ctx: Context) -> Case:
+    df = ctx.pos_stack
+    data_dir = ctx.path('reload_incremental', '')
+    # 最後の 30 日分のリリースを差分として取り込む
+    cutoff = df['RELEASE_TIMESTAMP'].max() - pd.Timedelta(days=30)
+    base = df.loc[df['RELEASE_TIMESTAMP'] <= cutoff]
+
+    def setup():
+        LOADER_DATA['elec_goods'] = df
+        write_base(base, os.path.join(data_dir, elec_goods.FILE_NAME))
+
+    return Case(lambda: elec_goods.reload(data_dir, incremental=True), len(df) - len(base), setup)
+
+
+@benchmark('reload/csmr_goods/full')
+def bench_reload_csmr_goods_full(ctx: Context) -> Case:
+    LOADER_DATA['csmr_goods_gen1'] = ctx.pos_stack
+    LOADER_DATA['csmr_goods_gen2'] = ctx.pos_stack_gen2
+    data_dir = ctx.path('reload_full', '')
+    return Case(lambda: csmr_goods.reload(data_dir), len(ctx.pos_stack) + len(ctx.pos_stack_gen2))
+
+
+@benchmark('get_alt_tickers/universe')
+def bench_get_alt_tickers(ctx: Context) -> Case:
+    return Case(lambda: reload.get_alt_tickers(ctx.alt_dir), len(ctx.pos_stack) * 3 + len(ctx.pos_stack_gen2))
+
+
+@benchmark('get_alt_tickers/scan')
+def bench_get_alt_tickers_scan(ctx: Context) -> Case:
+    return Case(
+        lambda: reload.get_alt_tickers(ctx.alt_dir_no_universe),
+        len(ctx.pos_stack) * 3 + len(ctx.pos_stack_gen2))
+
+
+@benchmark('grid_search/fit/inline')
+def bench_grid_search_fit_inline(ctx: Context) -> Case:
+    datasets = ctx.lag_diff_datasets
+    return Case(lambda: fit_lag_diff(datasets, n_jobs=1), sum(len(d) for d in datasets.values()))
+
+
+@benchmark('grid_search/fit/pool')
+def bench_grid_search_fit_pool(ctx: Context) -> Case:
+    datasets = ctx.lag_diff_datasets
+    return Case(lambda: fit_lag_diff(datasets, n_jobs=4), sum(len(d) for d in datasets.values()))
+
+
+def _silent(f):
+    # register_* などの print を抑える
+    with open(os.devnull, 'w') as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            return f()
+        finally:
+            sys.stdout = stdout
+
+
+def run_case(case: Case, repeat: int, warmup: int = 1) -> dict:
+    # 初回の import やキャッシュの影響を除く
+    for _ in range(warmup):
+        if case.setup is not None:
+            case.setup()
+        _silent(case.run)
+
+    times = []
+    for _ in range(repeat):
+        if case.setup is not None:
+            case.setup()
+        st = time.perf_counter()
+        out = _silent(case.run)
+        times.append(time.perf_counter() - st)
+
+    if case.setup is not None:
+        case.setup()
+    del out
+    tracemalloc.start()
+    out = _silent(case.run)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'seconds': min(times),
+        'seconds_all': times,
+        'peak_mb': peak / 1024 ** 2,
+        'rows_in': case.rows_in,
+        'rows_out': _n_rows(out),
+    }
+
+
+def compare(results: list, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = {r['name']: r for r in json.load(f)['results']}
+    print(f'\n{"benchmark":<40}{"base s":>10}{"new s":>10}{"speedup":>9}{"base MB":>10}{"new MB":>10}')
+    for r in results:
+        b = baseline.get(r['name'])
+        if b is None:
+            continue
+        print(f'{r["name"]:<40}{b["seconds"]:>10.3f}{r["seconds"]:>10.3f}{b["seconds"] / r["seconds"]:>8.2f}x'
+              f'{b["peak_mb"]:>10.1f}{r["peak_mb"]:>10.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', choices=list(SIZES), default='medium')
+    parser.add_argument('--tickers', type=int, default=None)
+    parser.add_argument('--days', type=int, default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--only', nargs='*', default=None, help='substrings of the benchmark names to run')
+    parser.add_argument('--output', default=None, help='JSON file of the results')
+    parser.add_argument('--compare', default=None, help='JSON file of a previous run')
+    parser.add_argument('--list', action='store_true')
+    args = parser.parse_args()
+
+    if args.list:
+        print('\n'.join(BENCHMARKS))
+        return
+
+    n_tickers, n_days = SIZES[args.size]
+    n_tickers = args.tickers or n_tickers
+    n_days = args.days or n_days
+    names = [n for n in BENCHMARKS if not args.only or any(s in n for s in args.only)]
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='aiq_bench_') as tmp_dir:
+        ctx = Context(n_tickers, n_days, tmp_dir)
+        for name in names:
+            case = _silent(lambda: BENCHMARKS[name](ctx))
+            result = {'name': name, **run_case(case, args.repeat, args.warmup)}
+            results.append(result)
+            print(f'{name:<40}{result["seconds"]:>9.3f}s{result["peak_mb"]:>10.1f}MB'
+                  f'  rows {result["rows_in"]:,} -> {result["rows_out"]}')
+
+    report = {
+        'meta': {
+            'tickers': n_tickers, 'days': n_days, 'repeat': args.repeat, 'warmup': args.warmup,
+            'timestamp': pd.Timestamp.now().isoformat(),
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'pandas': pd.__version__, 'numpy': np.__version__, 'pyarrow': pa.__version__,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+In-memory stand-ins for the DAL, the alternative data loaders and S3.
+
+`install_stubs()` must run before `libs` is imported. The loaders return
+the frames put in `LOADER_DATA` and S3 is the `S3_OBJECTS` dict, so the
+benchmarks measure only the code of this repository.
+"""
+import os
+import sys
+import types
+import importlib
+import tempfile
+from itertools import count
+
+import pandas as pd
+
+
+# load_alternative_* の名前 -> 返す long frame
+LOADER_DATA = {}
+
+# S3 のキー -> DataFrame
+S3_OBJECTS = {}
+
+LOADERS = {
+    'load_alternative_aiq_pos_csmr_goods_data': 'csmr_goods',
+    'load_alternative_aiq_pos_elec_goods_data': 'elec_goods',
+    'load_alternative_aiq_pos_retailer_data': 'retailer',
+    'load_alternative_aiq_retailer_weekly_data': 'retailer_weekly',
+    'load_alternative_aiq_geolocation_data': 'geolocation',
+}
+
+
+class FakeHandler:
+    """Keeps the registered frames; enough of the StdDataHandler API for the register_* functions."""
+
+    def __init__(self):
+        self._ids = count(1)
+        self.data = {}
+        self.alias = {}
+
+    def set_raw_data(self, dfraw=None, data_source=None, source=None, **kwargs):
+        data_id = next(self._ids)
+        self.data[data_id] = dfraw
+        return data_id
+
+    def set_alias(self, alias: dict):
+        self.alias.update(alias)
+
+
+class _Retrieval:
+    def __init__(self, df: pd.DataFrame):
+        self._df = df
+
+    def retrieve(self) -> pd.DataFrame:
+        return self._df.copy()
+
+
+def _loader(key: str):
+    def load(sdh, generation=None, start_datetime=None, end_datetime=None, ticker=None, **kwargs):
+        df = LOADER_DATA[key if generation is None else f'{key}_gen{generation}']
+        if ticker:
+            df = df.loc[df['TICKER'].isin(ticker)]
+        if start_datetime is not None or end_datetime is not None:
+            dt = pd.to_datetime(df['DATETIME'])
+            mask = pd.Series(True, index=df.index)
+            if start_datetime is not None:
+                mask &= dt >= pd.Timestamp(start_datetime)
+            if end_datetime is not None:
+                mask &= dt <= pd.Timestamp(end_datetime)
+            df = df.loc[mask]
+        return _Retrieval(df)
+    return load
+
+
+def _read_s3_file(client, bucket, filename):
+    return S3_OBJECTS[filename].copy()
+
+
+def _output_df_to_s3(df, bucket=None, filename=None, pkeys=None):
+    S3_OBJECTS[filename] = df
+
+
+def _module(name: str, **attrs) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def _importable(name: str) -> bool:
+    try:
+        importlib.import_module(name)
+        return True
+    except ImportError:
+        return False
+
+
+def install_stubs():
+    """Replace the DAL, the loaders and S3 (and yfinance / tqdm when missing) in `sys.modules`."""
+    for name in ['aiq_strategy_robot', 'aiq_strategy_robot.data', 'asr_protected',
+                 'asr_protected.data_transformer', 'asr_protected.data_accessor',
+                 'asr_common', 'asr_common.strage']:
+        _module(name)
+    _module('aiq_strategy_robot.data.data_accessor', DAL=FakeHandler, StdDataHandler=FakeHandler)
+    alternative = _module('aiq_strategy_robot.data.ALTERNATIVE', **{n: _loader(k) for n, k in LOADERS.items()})
+    alternative.__all__ = list(LOADERS)
+    _module('asr_protected.data_transformer.variable_libs',
+            log_diff=lambda df, periods=1: df.groupby(level=0).diff(periods))
+    _module('asr_protected.data_accessor.s3_accessor', read_s3_file=_read_s3_file)
+    _module('asr_common.strage.output', output_df_to_s3=_output_df_to_s3)
+    _module('boto3', client=lambda *args, **kwargs: None)
+
+    if not _importable('yfinance'):
+        _module('yfinance', Ticker=None)
+    if not _importable('tqdm'):
+        identity = lambda it=None, *args, **kwargs: it
+        _module('tqdm', tqdm=identity)
+        _module('tqdm.auto', tqdm=identity)
+        _module('tqdm.notebook', tqdm=identity)
+
+    # S3 のディスクキャッシュは使わない
+    os.environ['AIQ_S3_CACHE'] = '0'
+    os.environ.setdefault('AIQ_S3_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'aiq_bench_cache'))
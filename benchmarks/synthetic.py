@@ -0,0 +1,168 @@
+"""
+Synthetic data with the schemas of the production sources, for the benchmarks.
+
+Every generator is deterministic for a given `seed`.
+"""
+import numpy as np
+import pandas as pd
+
+
+def _tickers(n_tickers: int) -> np.ndarray:
+    return np.array([str(1300 + i) for i in range(n_tickers)], dtype=object)
+
+
+def make_pos_stack(
+    n_tickers: int = 1000,
+    n_days: int = 2500,
+    variables=('sales', 'count', 'price', 'share'),
+    smooths=(0, 7),
+    revision_rate: float = 0.2,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Long POS stack (TICKER, DATETIME, VARIABLE, SMOOTH, RELEASE_TIMESTAMP, BACKFILL, VALUE)."""
+    rng = np.random.default_rng(seed)
+    tickers = _tickers(n_tickers)
+    dates = pd.date_range('2014-01-01', periods=n_days, freq='D')
+
+    n_base = n_tickers * n_days * len(variables) * len(smooths)
+    tk = np.repeat(np.arange(n_tickers), n_days * len(variables) * len(smooths))
+    dt = np.tile(np.repeat(np.arange(n_days), len(variables) * len(smooths)), n_tickers)
+    var = np.tile(np.repeat(np.arange(len(variables)), len(smooths)), n_tickers * n_days)
+    sm = np.tile(np.arange(len(smooths)), n_tickers * n_days * len(variables))
+
+    # 一部の行は後日改訂される
+    n_rev = int(n_base * revision_rate)
+    rev = rng.integers(0, n_base, n_rev)
+    idx = np.concatenate([np.arange(n_base), rev])
+    lag = np.concatenate([np.full(n_base, 3), 3 + rng.integers(1, 30, n_rev)])
+
+    release = dates.values[dt[idx]] + lag.astype('timedelta64[D]')
+    df = pd.DataFrame({
+        'TICKER': tickers[tk[idx]],
+        'DATETIME': dates.values[dt[idx]],
+        'VARIABLE': np.asarray(variables, dtype=object)[var[idx]],
+        'SMOOTH': np.asarray(smooths)[sm[idx]],
+        'RELEASE_TIMESTAMP': release,
+        'BACKFILL': False,
+        'VALUE': rng.lognormal(size=len(idx)),
+    })
+    return df.sample(frac=1.0, random_state=seed).reset_index(drop=True)
+
+
+def make_retailer_weekly_stack(
+    n_tickers: int = 100,
+    n_days: int = 1000,
+    n_companies: int = 3,
+    variables=('sales', 'share', 'customers'),
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Daily retailer stack with COMPANY_ID (the 'all_' rows are the ticker totals)."""
+    rng = np.random.default_rng(seed)
+    tickers = _tickers(n_tickers)
+    dates = pd.date_range('2019-11-03', periods=n_days, freq='D')
+
+    companies = np.array(['all_'] + [f'{i:010x}' for i in range(1, n_companies)], dtype=object)
+    shape = (n_tickers, len(companies), n_days, len(variables))
+    tk, co, dt, var = [a.ravel() for a in np.indices(shape)]
+    company_id = companies[co]
+    company_id = np.where(co == 0, 'all_' + tickers[tk], company_id)
+
+    return pd.DataFrame({
+        'TICKER': tickers[tk],
+        'FIGI': 'BBG' + tickers[tk],
+        'COMPANY_ID': company_id,
+        'DATETIME': dates.strftime('%Y-%m-%d').to_numpy()[dt],
+        'VARIABLE': np.asarray(variables, dtype=object)[var],
+        'SMOOTH': 0,
+        'VALUE': rng.lognormal(size=len(tk)),
+        'BACKFILL': 1,
+        'RELEASE_TIMESTAMP': dates.values[dt] + np.timedelta64(30, 'D'),
+    })
+
+
+def make_geolocation_stack(
+    n_tickers: int = 50,
+    n_places: int = 20,
+    n_days: int = 500,
+    variables=('geofence', 'geofence_ot'),
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Place-level foot traffic stack (several PLACE_IDs per ticker)."""
+    rng = np.random.default_rng(seed)
+    tickers = _tickers(n_tickers)
+    dates = pd.date_range('2014-07-01', periods=n_days, freq='D')
+
+    shape = (n_tickers, n_places, n_days, len(variables))
+    tk, pl, dt, var = [a.ravel() for a in np.indices(shape)]
+    return pd.DataFrame({
+        'TICKER': tickers[tk],
+        'PLACE_ID': pd.Index(pl).astype(str).to_numpy(dtype=object) + '_' + tickers[tk],
+        'DATETIME': dates.strftime('%Y-%m-%d').to_numpy()[dt],
+        'SMOOTH': 0,
+        'VARIABLE': np.asarray(variables, dtype=object)[var],
+        'VALUE': rng.lognormal(5, 1, size=len(tk)),
+        'BACKFILL': 1,
+        'RELEASE_TIMESTAMP': dates.values[dt] + np.timedelta64(9, 'D'),
+    })
+
+
+def make_factset_extract(
+    n_tickers: int = 500,
+    n_days: int = 1000,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """FactSet price extract with the columns read by `get_adj_close`."""
+    rng = np.random.default_rng(seed)
+    tickers = _tickers(n_tickers)
+    dates = pd.bdate_range('2015-01-05', periods=n_days)
+
+    tk = np.repeat(np.arange(n_tickers), n_days)
+    dt = np.tile(np.arange(n_days), n_tickers)
+    close = np.exp(np.cumsum(rng.normal(0, 0.01, (n_tickers, n_days)), axis=1)).ravel() * 1000
+    return pd.DataFrame({
+        'Ticker': tickers[tk] + '-JP',
+        'DATE': dates.values[dt],
+        'Open Price': close * (1 + rng.normal(0, 0.005, len(tk))),
+        'High Price': close * 1.01,
+        'Low Price': close * 0.99,
+        'Close Price': close,
+        'Volume': rng.integers(1000, 100000, len(tk)),
+        'Split Factor': 1.0,
+        'Div Factor': 1.0,
+    })
+
+
+def make_wide_frame(
+    n_tickers: int = 500,
+    n_days: int = 1000,
+    columns=('returns',),
+    freq: str = 'B',
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Wide frame indexed by lower-case (ticker, datetime), as stored on S3."""
+    rng = np.random.default_rng(seed)
+    index = pd.MultiIndex.from_product(
+        [_tickers(n_tickers), pd.date_range('2015-01-01', periods=n_days, freq=freq)],
+        names=['ticker', 'datetime'])
+    return pd.DataFrame(rng.normal(size=(len(index), len(columns))), index=index, columns=list(columns))
+
+
+def make_lag_diff_datasets(
+    n_tickers: int = 300,
+    n_quarters: int = 40,
+    lags=range(0, 27),
+    diffs=(True, False),
+    seed: int = 0,
+) -> dict:
+    """(lag, diff) -> (y, X) frames indexed by (TICKER, DATETIME), as from `build_lag_diff_data`."""
+    rng = np.random.default_rng(seed)
+    index = pd.MultiIndex.from_product(
+        [_tickers(n_tickers), pd.date_range('2014-03-31', periods=n_quarters, freq='QE')],
+        names=['TICKER', 'DATETIME'])
+    y = rng.normal(size=len(index))
+    datasets = {}
+    for lag in lags:
+        x = 0.3 * y + rng.normal(size=len(index))
+        for diff in diffs:
+            datasets[lag, diff] = pd.DataFrame({'y': y, 'X': x}, index=index)
+    return datasets
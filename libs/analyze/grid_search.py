@@ -0,0 +1,158 @@
+import os
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from tqdm.auto import tqdm
+
+from .ols import expanding_ols
+
+
+def _fit_shard(key, data: pd.DataFrame, min_periods: int):
+    return key, expanding_ols(data, y='y', x='X', min_periods=min_periods)[['t_val']]
+
+
+def build_lag_diff_data(sdh, alt_W_id, funda_Q_id, lags: Iterable[int], diffs: Iterable[bool]) -> dict:
+    """
+    (y, X) frames of every lag x diff combination.
+
+    The quarterly log_diff of the shifted POS data is built once per lag and
+    shared by both diff settings, and the sales side is built once in total.
+    """
+    lags, diffs = list(lags), list(diffs)
+    sales = {False: sdh.get_variables(funda_Q_id).iloc[:, 0]}
+    if any(diffs):
+        sales[True] = sdh.get_variables(sdh.transform.diff(fields=funda_Q_id, periods=1).variable_ids).iloc[:, 0]
+
+    datasets = {}
+    for lag in lags:
+        alt_shift_id = alt_W_id
+        if lag != 0:
+            alt_shift_id = sdh.transform.shift(fields=alt_shift_id, periods=lag).variable_ids[0]
+        alt_Q_shift_id = sdh.transform.resample_by(fields=alt_shift_id, label=funda_Q_id, func='mean').variable_ids[0]
+        alt_id = sdh.transform.log_diff(fields=alt_Q_shift_id, periods=4).variable_ids
+
+        alt = {False: sdh.get_variables(alt_id).iloc[:, 0]}
+        if any(diffs):
+            alt[True] = sdh.get_variables(sdh.transform.diff(fields=alt_id, periods=1).variable_ids).iloc[:, 0]
+
+        for diff in diffs:
+            datasets[lag, diff] = pd.concat({'y': sales[diff], 'X': alt[diff]}, axis=1).dropna()
+
+    # itertools.product(lags, diffs) の順に並べる
+    return {key: datasets[key] for key in itertools.product(lags, diffs)}
+
+
+def fit_lag_diff(
+    datasets: dict,
+    min_periods: int = 10,
+    n_jobs: int = 1,
+    n_shards: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Expanding-window t-values of every (lag, diff) frame of `build_lag_diff_data`.
+
+    `expanding_ols` is O(n) over all tickers, so inline (n_jobs=1) is
+    usually the fastest: a process pool only pays off when the frames are
+    large enough to amortize pickling them to the workers (see the
+    'grid_search/fit' benchmarks).
+
+    Parameters
+    ----------
+    datasets : dict
+        (lag, diff) -> frame with y and X indexed by (TICKER, DATETIME).
+    min_periods : int, optional
+        Minimum observations of a window, by default 10.
+    n_jobs : int, optional
+        Number of processes, by default 1 (inline). None uses every CPU.
+    n_shards : int, optional
+        Ticker shards per combination on the pool, by default `n_jobs`.
+
+    Returns
+    -------
+    pd.DataFrame
+        t_val indexed by (TICKER, datetime, lag, diff1).
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+
+    results = {key: [] for key in datasets}
+    if n_jobs == 1:
+        for key, data in tqdm(datasets.items()):
+            if len(data):
+                results[key].append(_fit_shard(key, data, min_periods)[1])
+    else:
+        n_shards = n_shards or n_jobs
+        tasks = []
+        for key, data in datasets.items():
+            tickers = data.index.get_level_values('TICKER')
+            codes, uniques = tickers.factorize()
+            shard_of = np.arange(len(uniques)) % n_shards
+            for shard in range(min(n_shards, len(uniques))):
+                tasks.append((key, data.loc[shard_of[codes] == shard]))
+
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(_fit_shard, key, data, min_periods) for key, data in tasks]
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                key, corr = future.result()
+                results[key].append(corr)
+
+    frames = {key: pd.concat(frames).sort_index() for key, frames in results.items() if frames}
+    if not frames:
+        index = pd.MultiIndex.from_arrays([[]] * 4, names=['TICKER', 'datetime', 'lag', 'diff1'])
+        return pd.DataFrame({'t_val': pd.Series(dtype=np.float64)}, index=index)
+    correlations = pd.concat(frames, names=['lag', 'diff1']).reorder_levels([2, 3, 0, 1])
+    correlations.index.names = ['TICKER', 'datetime', 'lag', 'diff1']
+    return correlations
+
+
+def search_lag_diff(
+    sdh,
+    alt_W_id,
+    funda_Q_id,
+    lags: Iterable[int],
+    diffs: Iterable[bool] = (True, False),
+    min_periods: int = 10,
+    n_jobs: int = 1,
+    n_shards: Optional[int] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Grid search of the POS lag and diff against sales.
+
+    The (y, X) frame of every lag x diff combination is built with the
+    handler and the expanding-window t-values are fitted by `fit_lag_diff`.
+
+    Parameters
+    ----------
+    sdh : StdDataHandler
+        Data handler holding the weekly POS and quarterly sales variables.
+    alt_W_id, funda_Q_id :
+        Variable IDs of the weekly POS data and of the quarterly sales YoY.
+    lags : Iterable[int]
+        Lags of the POS data in weeks.
+    diffs : Iterable[bool], optional
+        Whether to take diff(1) of both sides, by default (True, False).
+    min_periods : int, optional
+        Minimum observations of a window, by default 10.
+    n_jobs : int, optional
+        Number of processes of the fit, by default 1 (inline). None uses every CPU.
+    n_shards : int, optional
+        Ticker shards per combination on the pool, by default `n_jobs`.
+
+    Returns
+    -------
+    (pd.DataFrame, pd.DataFrame)
+        `correlations` indexed by (TICKER, datetime, lag, diff1) and
+        `pos_data` indexed by (lag, diff, TICKER, DATETIME).
+    """
+    datasets = build_lag_diff_data(sdh, alt_W_id, funda_Q_id, lags, diffs)
+    correlations = fit_lag_diff(datasets, min_periods=min_periods, n_jobs=n_jobs, n_shards=n_shards)
+
+    if datasets:
+        pos_data = pd.concat(datasets)
+    else:
+        index = pd.MultiIndex.from_arrays([[]] * 4)
+        pos_data = pd.DataFrame({'y': pd.Series(dtype=np.float64), 'X': pd.Series(dtype=np.float64)}, index=index)
+    pos_data.index.names = ['lag', 'diff', 'TICKER', 'DATETIME']
+    return correlations, pos_data
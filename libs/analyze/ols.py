@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+
+def expanding_ols(
+    data: pd.DataFrame,
+    y: str = 'y',
+    x: str = 'X',
+    group: str = 'TICKER',
+    min_periods: int = 10,
+) -> pd.DataFrame:
+    """
+    Expanding-window OLS of `y` on `x` (with a constant) for every group at once.
+
+    Equivalent to fitting `sm.OLS(d[y], sm.add_constant(d[x]), missing='drop')`
+    on each expanding window `d` of each group, but computed from cumulative
+    sums of x, y, x^2, xy and y^2, so all windows cost O(n) in total.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        Frame with a `group` index level (rows in time order within a group).
+    y : str, optional
+        Column of the dependent variable, by default 'y'.
+    x : str, optional
+        Column of the regressor, by default 'X'.
+    group : str, optional
+        Index level of the groups, by default 'TICKER'.
+    min_periods : int, optional
+        Windows with fewer complete observations are skipped, by default 10.
+
+    Returns
+    -------
+    pd.DataFrame
+        slope, stderr, t_val and nobs indexed like `data`, one row per window
+        (i.e. the last row of the window).
+    """
+    codes = data.index.get_level_values(group).factorize()[0]
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    xv = data[x].to_numpy(dtype=np.float64)[order]
+    yv = data[y].to_numpy(dtype=np.float64)[order]
+
+    valid = ~(np.isnan(xv) | np.isnan(yv))
+    n_groups = codes.max() + 1 if len(codes) else 0
+
+    # 桁落ちを避けるためグループ平均を引いてから累積する (OLS の結果は不変)
+    counts = np.bincount(codes, weights=valid, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = np.bincount(codes, weights=np.where(valid, xv, 0), minlength=n_groups) / counts
+        y_mean = np.bincount(codes, weights=np.where(valid, yv, 0), minlength=n_groups) / counts
+    xc = np.where(valid, xv - x_mean[codes], 0)
+    yc = np.where(valid, yv - y_mean[codes], 0)
+
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    lengths = np.diff(np.r_[starts, len(codes)])
+
+    def group_cumsum(v):
+        cs = np.cumsum(v)
+        offset = np.r_[0, cs[starts[1:] - 1]] if len(starts) else np.zeros(0)
+        return cs - np.repeat(offset, lengths)
+
+    n = group_cumsum(valid.astype(np.float64))
+    sx, sy = group_cumsum(xc), group_cumsum(yc)
+    sxx, sxy, syy = group_cumsum(xc * xc), group_cumsum(xc * yc), group_cumsum(yc * yc)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cxx = sxx - sx * sx / n
+        cxy = sxy - sx * sy / n
+        cyy = syy - sy * sy / n
+        slope = cxy / cxx
+        rss = np.maximum(cyy - slope * cxy, 0)
+        stderr = np.sqrt(rss / (n - 2) / cxx)
+        t_val = slope / stderr
+
+    keep = n >= min_periods
+    result = pd.DataFrame({
+        'slope': slope[keep],
+        'stderr': stderr[keep],
+        't_val': t_val[keep],
+        'nobs': n[keep].astype(np.int64),
+    }, index=data.index[order[keep]])
+    return result
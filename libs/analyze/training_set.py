@@ -0,0 +1,122 @@
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+INDEX_NAMES = ['PRED_DATETIME', 'TICKER', 'DATETIME']
+
+
+def _consensus_y(cons: pd.DataFrame, sales: pd.DataFrame) -> dict:
+    # 前年同期の売上に対するコンセンサスの log YoY (diff1=True はその1階差分)
+    pre = sales['sales'].groupby(level=0, sort=False).shift(4)
+    pre = pre.reindex(cons.index)
+    y = np.log(cons['consensus'] / pre.to_numpy())
+    return {False: y, True: y.groupby(level=0, sort=False).diff()}
+
+
+def build_training_sets(
+    best_correlations: pd.DataFrame,
+    pos_data: pd.DataFrame,
+    cons: Optional[pd.DataFrame] = None,
+    sales: Optional[pd.DataFrame] = None,
+    min_rows: int = 20,
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Point-in-time training sets of every (TICKER, datetime) of the best
+    lag / diff selection, built in one pass.
+
+    For each row of `best_correlations` the (y, X) data of the selected
+    lag and diff up to `datetime` plus the next quarter (the prediction
+    target, PRED_DATETIME) forms one block. Blocks whose target quarter has
+    a consensus get the consensus YoY as `con_y`. Rows with missing values
+    are dropped and blocks with `min_rows` rows or fewer are discarded.
+
+    Parameters
+    ----------
+    best_correlations : pd.DataFrame
+        Indexed by (TICKER, datetime) with `lag` and `diff1` columns.
+    pos_data : pd.DataFrame
+        (y, X) indexed by (lag, diff, TICKER, DATETIME), as returned by
+        `search_lag_diff`.
+    cons : pd.DataFrame, optional
+        `consensus` indexed by (TICKER, fiscal period end date).
+    sales : pd.DataFrame, optional
+        Realized `sales` indexed by (TICKER, DATETIME). Required with `cons`.
+    min_rows : int, optional
+        Blocks must have more rows than this, by default 20.
+
+    Returns
+    -------
+    (pd.DataFrame, pd.DataFrame, pd.DataFrame)
+        `dfbest_correlations` indexed by (TICKER, PRED_DATETIME), and the
+        datasets with and without consensus indexed by
+        (PRED_DATETIME, TICKER, DATETIME).
+    """
+    # pos_data を (lag, diff, TICKER) のブロック毎に連続した並びにする
+    block_codes = pos_data.index.droplevel(-1).factorize()[0]
+    order = np.argsort(block_codes, kind='stable')
+    n_blocks = block_codes.max() + 1 if len(block_codes) else 0
+    block_len = np.bincount(block_codes, minlength=n_blocks)
+    block_start = np.r_[0, np.cumsum(block_len)[:-1]].astype(np.int64)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - np.repeat(block_start, block_len)
+    pos_datetimes = pos_data.index.get_level_values(-1)
+
+    # best_correlations の各行の学習期間の末尾 (until) と予測対象 (その次の行)
+    tickers = best_correlations.index.get_level_values(0)
+    until = pos_data.index.get_indexer(pd.MultiIndex.from_arrays([
+        best_correlations['lag'].to_numpy(), best_correlations['diff1'].to_numpy(),
+        tickers, best_correlations.index.get_level_values(1)]))
+    found = until >= 0
+    blocks = np.where(found, block_codes[until], 0)
+    last = np.where(found, rank[until], 0) + 1
+    valid = found & (last < block_len[blocks])
+
+    pred = pd.Series(pd.NaT, index=best_correlations.index, dtype=pos_datetimes.dtype)
+    pred_rows = order[block_start[blocks[valid]] + last[valid]]
+    pred.iloc[np.flatnonzero(valid)] = pos_datetimes[pred_rows]
+
+    dfbest_correlations = best_correlations.copy()
+    dfbest_correlations['PRED_DATETIME'] = pred
+    dfbest_correlations = dfbest_correlations.reset_index().set_index(['TICKER', 'PRED_DATETIME'])
+
+    # 各ブロックの行 (先頭から予測対象まで) を一括で展開する
+    sel = np.flatnonzero(valid)
+    lengths = last[sel] + 1
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    rows = order[np.repeat(block_start[blocks[sel]], lengths) + np.arange(lengths.sum()) - offsets]
+    set_id = np.repeat(np.arange(len(sel)), lengths)
+
+    panel = pos_data.iloc[rows]
+    panel_tickers = tickers[sel].take(set_id)
+    panel_pred = pos_datetimes[pred_rows].take(set_id)
+    panel_datetimes = pos_datetimes.take(rows)
+    panel.index = pd.MultiIndex.from_arrays([panel_pred, panel_tickers, panel_datetimes], names=INDEX_NAMES)
+
+    has_cons = np.zeros(len(sel), dtype=bool)
+    if cons is not None:
+        has_cons = pd.MultiIndex.from_arrays([tickers[sel], pos_datetimes[pred_rows]]).isin(cons.index)
+
+    datasets = {}
+    for with_cons in (True, False):
+        mask = has_cons[set_id] == with_cons
+        ids = set_id[mask]
+        d = panel.loc[mask]
+        if with_cons:
+            values = np.full(len(ids), np.nan)
+            if len(ids):
+                con_y = _consensus_y(cons, sales)
+                loc = con_y[False].index.get_indexer(
+                    pd.MultiIndex.from_arrays([panel_tickers[mask], panel_datetimes[mask]]))
+                diff1 = best_correlations['diff1'].to_numpy(dtype=bool)[sel][ids]
+                values = np.where(diff1, con_y[True].to_numpy()[loc], con_y[False].to_numpy()[loc])
+                values[loc < 0] = np.nan
+            d = d.assign(con_y=values)
+
+        # 欠損を除いた行数が min_rows 以下のブロックは使わない
+        keep = d.notna().all(axis=1).to_numpy()
+        count = np.bincount(ids[keep], minlength=len(sel))
+        datasets[with_cons] = d.loc[keep & (count[ids] > min_rows)]
+
+    return dfbest_correlations, datasets[True], datasets[False]
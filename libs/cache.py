@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import pickle
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+ENV_CACHE_DIR = 'AIQ_S3_CACHE_DIR'
+ENV_CACHE_MAX_BYTES = 'AIQ_S3_CACHE_MAX_BYTES'
+ENV_CACHE_ENABLED = 'AIQ_S3_CACHE'
+
+DEFAULT_CACHE_DIR = os.path.join('~', '.cache', 'aiq_sample', 's3')
+DEFAULT_MAX_BYTES = 5 * 1024 ** 3
+
+INDEX_FILE_NAME = 'index.json'
+LOCK_FILE_NAME = 'index.lock'
+
+# DataFrame は parquet、それ以外 (parquet に書けないものを含む) は pickle で保存する
+FORMAT_EXTENSIONS = {'parquet': '.parquet', 'pickle': '.pkl'}
+
+
+class DiskCache:
+    """
+    Read-through disk cache for S3 objects.
+
+    Entries are validated against the ETag / Last-Modified of the object and
+    evicted in LRU order once the total size exceeds `max_bytes`. DataFrames
+    are stored as parquet. The index is updated under a lock file, so
+    several processes (e.g. notebook kernels) can share the directory.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory where cached objects and the index are stored.
+    max_bytes : int
+        Upper bound of the total size of the cached objects.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.cache_dir, INDEX_FILE_NAME)
+
+    @contextmanager
+    def _locked(self):
+        # スレッド間は threading.Lock、プロセス間は lock ファイルの flock で排他する
+        with self._lock:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.cache_dir, LOCK_FILE_NAME), 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self.index_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # 壊れている場合は空から作り直す
+            return {}
+
+    def _save_index(self, index: dict):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f'{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _object_path(self, key: str, fmt: str = 'pickle') -> str:
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + FORMAT_EXTENSIONS[fmt])
+
+    def _read(self, path: str, fmt: str):
+        try:
+            if fmt == 'parquet':
+                return pd.read_parquet(path)
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            # 他のプロセスに削除された・壊れている場合は取り直す
+            return None
+
+    def _write(self, obj, tmp_path: str) -> str:
+        if isinstance(obj, pd.DataFrame):
+            try:
+                obj.to_parquet(tmp_path)
+                return 'parquet'
+            except Exception:
+                pass
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return 'pickle'
+
+    def get(self, key: str, version: dict, loader: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        """
+        Return the object for `key`, calling `loader` only when the cached
+        copy is missing or its `version` does not match.
+        """
+        with self._locked():
+            entry = self._load_index().get(key)
+
+        if entry is not None and entry['version'] == version:
+            fmt = entry.get('format', 'pickle')
+            obj = self._read(self._object_path(key, fmt), fmt)
+            if obj is not None:
+                with self._locked():
+                    index = self._load_index()
+                    if key in index:
+                        index[key]['atime'] = time.time()
+                        self._save_index(index)
+                self.hits += 1
+                return obj
+
+        self.misses += 1
+        obj = loader()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f'{self._object_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            fmt = self._write(obj, tmp_path)
+            with self._locked():
+                path = self._object_path(key, fmt)
+                os.replace(tmp_path, path)
+                index = self._load_index()
+                old = index.get(key)
+                if old is not None and old.get('format', 'pickle') != fmt:
+                    self._remove(key, old)
+                index[key] = {
+                    'version': version,
+                    'format': fmt,
+                    'size': os.path.getsize(path),
+                    'atime': time.time(),
+                }
+                self._evict(index, keep=key)
+                self._save_index(index)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return obj
+
+    def _remove(self, key: str, entry: dict):
+        try:
+            os.remove(self._object_path(key, entry.get('format', 'pickle')))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, index: dict, keep: Optional[str] = None):
+        total = sum(e['size'] for e in index.values())
+        for key in sorted(index, key=lambda k: index[k]['atime']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= index[key]['size']
+            self._remove(key, index[key])
+            del index[key]
+            self.evictions += 1
+
+    def clear(self):
+        with self._locked():
+            for key, entry in self._load_index().items():
+                self._remove(key, entry)
+            self._save_index({})
+
+    def stats(self) -> dict:
+        index = self._load_index()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(index),
+            'bytes': sum(e['size'] for e in index.values()),
+            'max_bytes': self.max_bytes,
+        }
+
+
+def cache_enabled() -> bool:
+    return os.environ.get(ENV_CACHE_ENABLED, '1').lower() not in ('0', 'false', 'off', '')
+
+
+def default_cache() -> DiskCache:
+    return DiskCache(
+        cache_dir=os.environ.get(ENV_CACHE_DIR, DEFAULT_CACHE_DIR),
+        max_bytes=int(os.environ.get(ENV_CACHE_MAX_BYTES, DEFAULT_MAX_BYTES)),
+    )
@@ -7,6 +7,10 @@ from tqdm import tqdm
 from aiq_strategy_robot.data.ALTERNATIVE import *
 from aiq_strategy_robot.data.data_accessor import DAL
 from ..path import DEFAULT_DIR as DEFAULT_DIR_EFS
+from ..instrument import instrument, event
+from .utils import read_stack, filter_stack
+from .incremental import write_base
+from .materialize import materialize
 
 from ..s3 import read_s3, to_s3, DEFAULT_BUCKET
 
@@ -14,9 +18,13 @@ from ..s3 import read_s3, to_s3, DEFAULT_BUCKET
 GEO_FILE_NAME = 'pos_geolocation.parquet'
 ENV_DATABSE = 'TRIAL_SNOWFLAKE_DATABASE_AIQ_GEOLOCATION'
 
+# pos_geolocation.parquet.agg.parquet
+AGG_NAME = 'agg'
+
 FUNDA_FILE_NAME = 'dfsales_transportation.parquet'
 
 
+@instrument()
 def read_foot_traffic_place(
     tickers,
     data_dir=DEFAULT_DIR_EFS,
@@ -24,26 +32,51 @@ def read_foot_traffic_place(
     end_date=None,
     db_name: str = None,
     schema_name: str = None,
+    variables: list = None,
 ):
     try:
-        geo_car = pd.read_parquet(os.path.join(data_dir, GEO_FILE_NAME), engine='pyarrow')
-    except:
+        # 集計済みデータ (元ファイルが更新された場合のみ作り直す) から必要な銘柄のみ読む
+        agg = materialize(
+            os.path.join(data_dir, GEO_FILE_NAME), AGG_NAME, _read_and_aggregate,
+            sort_by=['TICKER', 'DATETIME', 'VARIABLE'])
+        if isinstance(agg, str):
+            dfgeo = read_stack(
+                agg, tickers=tickers or None, start_date=start_date, end_date=end_date,
+                variables=variables)
+        else:
+            # 集計済みデータを書き込めなかった場合はメモリ上で絞り込む
+            dfgeo = filter_stack(
+                agg, tickers=tickers or None, start_date=start_date, end_date=end_date,
+                variables=variables)
+        dfgeo = dfgeo.set_index(['TICKER', 'DATETIME', 'VARIABLE'])['VALUE']
+    except OSError:
         # ファイルが存在しない場合はloaderから取得
-        print('extract pos_geolocation by loader..')
+        event('loader_fallback', 'extract pos_geolocation by loader..', dataset='pos_geolocation')
         geo_car = read_geo_by_laoder(
             tickers=tickers, start_date=start_date, end_date=end_date,
             db_name=db_name, schema_name=schema_name
         )
+        geo_car = filter_stack(geo_car, variables=variables)
+        dfgeo = aggregate_places(geo_car)
 
-    # 集約
-    geo_car['DATETIME'] = pd.to_datetime(geo_car['DATETIME'])
-    dfgeo = geo_car.groupby(['TICKER', 'DATETIME', 'VARIABLE'])['VALUE'].sum()
     dfgeo = dfgeo.unstack('VARIABLE')
     if tickers:
         dfgeo = dfgeo.loc[dfgeo.index.get_level_values('TICKER').isin(tickers)]
     return dfgeo
 
 
+def aggregate_places(geo_car: pd.DataFrame) -> pd.Series:
+    """Sum of VALUE over the places of each (TICKER, DATETIME, VARIABLE)."""
+    geo_car['DATETIME'] = pd.to_datetime(geo_car['DATETIME'])
+    return geo_car.groupby(['TICKER', 'DATETIME', 'VARIABLE'])['VALUE'].sum()
+
+
+def _read_and_aggregate(files) -> pd.DataFrame:
+    geo_car = read_stack(files, columns=['TICKER', 'DATETIME', 'VARIABLE', 'VALUE'])
+    return aggregate_places(geo_car).reset_index()
+
+
+@instrument()
 def read_geo_by_laoder(
     tickers, 
     start_date=None, 
@@ -61,6 +94,7 @@ def read_geo_by_laoder(
     return dfdata
 
 
+@instrument()
 def reload_geolocation(
     tickers: list, 
     start_date=None,
@@ -73,7 +107,7 @@ def reload_geolocation(
         tickers=tickers, start_date=start_date, end_date=end_date,
         db_name=db_name, schema_name=schema_name
     )
-    dfdata.to_parquet(os.path.join(data_dir, GEO_FILE_NAME))
+    write_base(dfdata, os.path.join(data_dir, GEO_FILE_NAME))
     return dfdata
 
 
@@ -1,12 +1,16 @@
 import os
-from typing import Optional, Callable
+from typing import List, Optional, Callable, Union
 
 import pandas as pd
 from aiq_strategy_robot.data.data_accessor import DAL
 from aiq_strategy_robot.data.ALTERNATIVE import load_alternative_aiq_pos_csmr_goods_data
 
 from ..path import DEFAULT_DIR
-from .utils import format_pos
+from ..instrument import instrument, stage, event
+from ..storage import is_partitioned
+from .incremental import append_increment, write_base, stack_files, DEFAULT_LOOKBACK_DAYS, DEFAULT_RECONCILE_DAYS
+from .utils import format_pos, convert_tickers, read_stack, filter_stack, canonical_index
+from .compact import maybe_compact
 from ..s3 import to_s3, read_s3, DEFAULT_BUCKET
 
 FILE_NAME = 'pos_csmr_goods_stack.parquet'
@@ -16,22 +20,31 @@ ENV_DATABSE = 'TRIAL_SNOWFLAKE_DATABASE_AIQ_POS_CSMR_GOODS'
 
 
 # Load Alternative Data
+@instrument()
 def register_csmr_goods_data(
         sdh,
         data_dir=DEFAULT_DIR,
-        f_ticker_cvt: Optional[Callable[[str], str]] = None,
+        f_ticker_cvt: Optional[Union[Callable[[str], str], dict, pd.Series]] = None,
         db_name: str = None,
         schema_name: str = None,
         start_date=None,
         end_date=None,
+        tickers: Optional[List[str]] = None,
+        variables: Optional[List[str]] = None,
 ) -> int:
     try:
         # loading from csv to save time for this demo
-        df_inc1, df_inc2 = read_file(data_dir)
-    except:
+        df_inc1, df_inc2 = read_file(
+            data_dir, tickers=tickers, start_date=start_date, end_date=end_date,
+            variables=variables, smooth=0)
+    except OSError:
         # ファイルが存在しない場合はloaderから取得
-        print('extract pos_csmr_goods by loader..')
+        event('loader_fallback', 'extract pos_csmr_goods by loader..', dataset='pos_csmr_goods')
         df_inc1, df_inc2 = read_by_laoder(start_date, end_date, db_name=db_name, schema_name=schema_name)
+        df_inc1 = filter_stack(
+            df_inc1, tickers=tickers, start_date=start_date, end_date=end_date,
+            variables=variables, smooth=0)
+        df_inc2 = filter_stack(df_inc2, tickers=tickers, end_date=end_date, variables=variables, smooth=0)
 
     df_inc1 = format_pos(df_inc1)
     df_inc2 = format_pos(df_inc2)
@@ -39,55 +52,95 @@ def register_csmr_goods_data(
     df_pos.sort_index(inplace=True)
 
     if f_ticker_cvt is not None:
-        df_pos.index = pd.MultiIndex.from_tuples([(f_ticker_cvt(i[0]), i[1]) for i in df_pos.index], names=df_pos.index.names)
+        df_pos = convert_tickers(df_pos, f_ticker_cvt)
+    df_pos = canonical_index(df_pos)
+    df_pos = maybe_compact(df_pos, 'pos_csmr_goods')
 
-    data_id = sdh.set_raw_data(
-        data_source='external',
-        dfraw=df_pos,
-        source='sample'
-    )
+    with stage('set_raw_data', rows_in=len(df_pos)):
+        data_id = sdh.set_raw_data(
+            data_source='external',
+            dfraw=df_pos,
+            source='sample'
+        )
 
     sdh.set_alias({data_id: 'pos_csmr_goods'})
     return data_id
 
 
+@instrument()
 def read_by_laoder(start_date=None, end_date=None, db_name=None, schema_name=None) -> pd.DataFrame:
+    df_inc1 = load_generation(
+        1, start_date=start_date, end_date=end_date,
+        db_name=db_name, schema_name=schema_name)
+    df_inc2 = load_generation(
+        2, end_date=end_date,
+        db_name=db_name, schema_name=schema_name)
+    
+    return df_inc1, df_inc2
+
+
+@instrument()
+def load_generation(generation, start_date=None, end_date=None, db_name=None, schema_name=None) -> pd.DataFrame:
 
     if not db_name:
         db_name = os.environ.get(ENV_DATABSE)
 
-    temp_sdh = DAL()
-    df_inc1 = load_alternative_aiq_pos_csmr_goods_data(
-            temp_sdh, generation=1, 
+    return load_alternative_aiq_pos_csmr_goods_data(
+            DAL(), generation=generation, 
             start_datetime=start_date, end_datetime=end_date,
             db_name=db_name, load_all_tickers=True, 
             load_only_latest=False,
             schema_name=schema_name).retrieve()
-    df_inc2 = load_alternative_aiq_pos_csmr_goods_data(
-            temp_sdh, generation=2, end_datetime=end_date,
-            db_name=db_name, load_all_tickers=True,
-            load_only_latest=False,
-            schema_name=schema_name).retrieve()
-    
-    return df_inc1, df_inc2
 
 
-def reload(data_dir=DEFAULT_DIR, start_date=None, end_date=None, db_name=None, schema_name=None):
-    df_inc1, df_inc2 = read_by_laoder(
-        start_date, end_date, 
-        db_name=db_name, schema_name=schema_name
-    )
-    df_inc1.to_parquet(os.path.join(data_dir, FILE_NAME_GEN1))
-    df_inc2.to_parquet(os.path.join(data_dir, FILE_NAME_GEN2))
+@instrument()
+def reload(
+        data_dir=DEFAULT_DIR, start_date=None, end_date=None, db_name=None, schema_name=None,
+        incremental: bool = False, lookback_days: int = DEFAULT_LOOKBACK_DAYS,
+        reconcile_days: Optional[int] = DEFAULT_RECONCILE_DAYS,
+):
+    path_gen1 = os.path.join(data_dir, FILE_NAME_GEN1)
+    path_gen2 = os.path.join(data_dir, FILE_NAME_GEN2)
+    if incremental and all(os.path.exists(p) or is_partitioned(p) for p in [path_gen1, path_gen2]):
+        # 保存済みの RELEASE_TIMESTAMP より新しいリリースのみ追記する (reconcile_days 毎に全期間を再取得)
+        df_inc1, df_inc2 = [
+            append_increment(
+                path,
+                lambda start, end, gen=gen: load_generation(
+                    gen, start_date=start, end_date=end,
+                    db_name=db_name, schema_name=schema_name),
+                lookback_days=lookback_days, end_date=end_date, reconcile_days=reconcile_days)
+            for gen, path in [(1, path_gen1), (2, path_gen2)]
+        ]
+    else:
+        df_inc1, df_inc2 = read_by_laoder(
+            start_date, end_date, 
+            db_name=db_name, schema_name=schema_name
+        )
+        write_base(df_inc1, path_gen1)
+        write_base(df_inc2, path_gen2)
     dfpos_csmr = pd.concat([df_inc1, df_inc2], axis=0).reset_index(drop=True)
     dfpos_csmr.sort_index(inplace=True)
     return dfpos_csmr
 
 
-def read_file(data_dir=DEFAULT_DIR):
+@instrument()
+def read_file(
+        data_dir=DEFAULT_DIR,
+        tickers: Optional[List[str]] = None,
+        start_date=None,
+        end_date=None,
+        variables: Optional[List[str]] = None,
+        smooth: Optional[int] = None,
+        columns: Optional[List[str]] = None,
+):
     # loading from csv to save time for this demo
-    df_inc1 = pd.read_parquet(os.path.join(data_dir, FILE_NAME_GEN1), engine='pyarrow')
-    df_inc2 = pd.read_parquet(os.path.join(data_dir, FILE_NAME_GEN2), engine='pyarrow')
+    # gen2 は gen1 より前の期間を埋めるため start_date では絞らない (read_by_laoder と同じ)
+    filters = dict(variables=variables, smooth=smooth, columns=columns)
+    prune1 = dict(tickers=tickers, start_date=start_date, end_date=end_date)
+    prune2 = dict(tickers=tickers, end_date=end_date)
+    df_inc1 = read_stack(stack_files(os.path.join(data_dir, FILE_NAME_GEN1), **prune1), **prune1, **filters)
+    df_inc2 = read_stack(stack_files(os.path.join(data_dir, FILE_NAME_GEN2), **prune2), **prune2, **filters)
     return df_inc1, df_inc2
 
 
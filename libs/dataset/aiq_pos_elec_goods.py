@@ -1,5 +1,5 @@
 import os
-from typing import Optional, Callable
+from typing import List, Optional, Callable, Union
 from pathlib import Path
 
 import pandas as pd
@@ -7,46 +7,62 @@ import pandas as pd
 from aiq_strategy_robot.data.data_accessor import DAL
 from aiq_strategy_robot.data.ALTERNATIVE import load_alternative_aiq_pos_elec_goods_data
 
-from .utils import format_pos
+from .utils import format_pos, convert_tickers, read_stack, filter_stack, canonical_index
+from .compact import maybe_compact
+from .incremental import append_increment, write_base, stack_files, DEFAULT_LOOKBACK_DAYS, DEFAULT_RECONCILE_DAYS
 from ..path import DEFAULT_DIR
+from ..instrument import instrument, stage, event
+from ..storage import is_partitioned
 
 
 FILE_NAME = 'pos_elec_goods_stack.parquet'
 ENV_DATABSE = 'TRIAL_SNOWFLAKE_DATABASE_AIQ_POS_ELEC_GOODS'
 
 
+@instrument()
 def register_elec_goods_data(
         sdh,
         data_dir: str = DEFAULT_DIR,
-        f_ticker_cvt: Optional[Callable[[str], str]] = None,
+        f_ticker_cvt: Optional[Union[Callable[[str], str], dict, pd.Series]] = None,
         db_name: str = None,
         schema_name: str = None,
         start_date=None,
         end_date=None,
+        tickers: Optional[List[str]] = None,
+        variables: Optional[List[str]] = None,
 ) -> int:
     try:
         # loading from csv to save time for this demo
-        df_pos = read_file(data_dir)
-    except:
+        df_pos = read_file(
+            data_dir, tickers=tickers, start_date=start_date, end_date=end_date,
+            variables=variables, smooth=0)
+    except OSError:
         # ファイルが存在しない場合はloaderから取得
-        print('extract pos_elec_goods by loader..')
+        event('loader_fallback', 'extract pos_elec_goods by loader..', dataset='pos_elec_goods')
         df_pos = read_by_laoder(start_date=start_date, end_date=end_date, db_name=db_name, schema_name=schema_name)
+        df_pos = filter_stack(
+            df_pos, tickers=tickers, start_date=start_date, end_date=end_date,
+            variables=variables, smooth=0)
 
     df_pos = format_pos(df_pos)
 
     if f_ticker_cvt is not None:
-        df_pos.index = pd.MultiIndex.from_tuples([(f_ticker_cvt(i[0]), i[1]) for i in df_pos.index], names=df_pos.index.names)
+        df_pos = convert_tickers(df_pos, f_ticker_cvt)
+    df_pos = canonical_index(df_pos)
+    df_pos = maybe_compact(df_pos, 'pos_elec_goods')
 
-    data_id = sdh.set_raw_data(
-        data_source='external',
-        dfraw=df_pos,
-        source='sample'
-    )
+    with stage('set_raw_data', rows_in=len(df_pos)):
+        data_id = sdh.set_raw_data(
+            data_source='external',
+            dfraw=df_pos,
+            source='sample'
+        )
 
     sdh.set_alias({data_id: 'pos_elec_goods'})
     return data_id
 
 
+@instrument()
 def read_by_laoder(start_date=None, end_date=None, db_name=None, schema_name=None) -> pd.DataFrame:
 
     if not db_name:
@@ -63,14 +79,41 @@ def read_by_laoder(start_date=None, end_date=None, db_name=None, schema_name=Non
 
 
 
-def reload(data_dir=DEFAULT_DIR, start_date=None, end_date=None, db_name=None, schema_name=None):
+@instrument()
+def reload(
+        data_dir=DEFAULT_DIR, start_date=None, end_date=None, db_name=None, schema_name=None,
+        incremental: bool = False, lookback_days: int = DEFAULT_LOOKBACK_DAYS,
+        reconcile_days: Optional[int] = DEFAULT_RECONCILE_DAYS,
+):
+    path = os.path.join(data_dir, FILE_NAME)
+    if incremental and (os.path.exists(path) or is_partitioned(path)):
+        # 保存済みの RELEASE_TIMESTAMP より新しいリリースのみ追記する (reconcile_days 毎に全期間を再取得)
+        return append_increment(
+            path,
+            lambda start, end: read_by_laoder(start, end, db_name=db_name, schema_name=schema_name),
+            lookback_days=lookback_days, end_date=end_date, reconcile_days=reconcile_days)
+
     df_pos = read_by_laoder(
         start_date, end_date, 
         db_name=db_name, schema_name=schema_name
     )
-    df_pos.to_parquet(os.path.join(data_dir, FILE_NAME))
+    write_base(df_pos, path)
     return df_pos
 
-def read_file(data_dir=DEFAULT_DIR):
+@instrument()
+def read_file(
+        data_dir=DEFAULT_DIR,
+        tickers: Optional[List[str]] = None,
+        start_date=None,
+        end_date=None,
+        variables: Optional[List[str]] = None,
+        smooth: Optional[int] = None,
+        columns: Optional[List[str]] = None,
+):
     # loading from csv to save time for this demo
-    return pd.read_parquet(os.path.join(data_dir, FILE_NAME), engine='pyarrow')
\ No newline at end of file
+    files = stack_files(
+        os.path.join(data_dir, FILE_NAME), tickers=tickers, start_date=start_date, end_date=end_date)
+    return read_stack(
+        files, tickers=tickers,
+        start_date=start_date, end_date=end_date,
+        variables=variables, smooth=smooth, columns=columns)
@@ -1,6 +1,6 @@
 import os
 from glob import glob
-from typing import List, Optional, Callable
+from typing import List, Optional, Callable, Union
 
 import numpy as np
 import pandas as pd
@@ -10,16 +10,21 @@ from aiq_strategy_robot.data.data_accessor import DAL
 from aiq_strategy_robot.data.ALTERNATIVE import load_alternative_aiq_retailer_weekly_data
 
 from ..path import DEFAULT_DIR
+from ..instrument import instrument, stage, event
+from .utils import convert_tickers, read_stack, canonical_index, resample_weekly
+from .compact import maybe_compact
+from ..storage import is_partitioned, partitioned_root, partition_files
 
 ENV_DATABSE = 'TRIAL_SNOWFLAKE_DATABASE_AIQ_RETAILER_WEEKLY'
 
 FILE_NAME = 'retailer_weekly_stack.parquet'
 
 # Load Alternative Data
+@instrument()
 def register_retailer_data(
     sdh,
     data_dir: str = DEFAULT_DIR,
-    f_ticker_cvt: Optional[Callable[[str], str]] = None,
+    f_ticker_cvt: Optional[Union[Callable[[str], str], dict, pd.Series]] = None,
     db_name: str = None,
     schema_name: str = None,
     start_date=None,
@@ -31,21 +36,25 @@ def register_retailer_data(
         df_pos = read_file(data_dir)
     except:
 
-        print('extract retailer weekly by loader..')
+        event('loader_fallback', 'extract retailer weekly by loader..', dataset='retailer_weekly')
         df_pos = read_by_laoder(start_date, end_date, db_name=db_name, schema_name=schema_name)
 
     if f_ticker_cvt is not None:
-        df_pos.index = pd.MultiIndex.from_tuples([(f_ticker_cvt(i[0]), i[1]) for i in df_pos.index], names=df_pos.index.names)
+        df_pos = convert_tickers(df_pos, f_ticker_cvt)
+    df_pos = canonical_index(df_pos)
+    df_pos = maybe_compact(df_pos, 'retailer_weekly')
 
-    data_id = sdh.set_raw_data(
-        data_source='external',
-        dfraw=df_pos,
-        source='sample'
-    )
+    with stage('set_raw_data', rows_in=len(df_pos)):
+        data_id = sdh.set_raw_data(
+            data_source='external',
+            dfraw=df_pos,
+            source='sample'
+        )
 
     sdh.set_alias({data_id: 'retailer_weekly'})
     return data_id
 
+@instrument()
 def read_by_laoder(start_date=None, end_date=None, db_name=None, schema_name=None):
 
     if not db_name:
@@ -70,18 +79,24 @@ def read_by_laoder(start_date=None, end_date=None, db_name=None, schema_name=Non
 
     colfunc = {'sales': 'sum'}
     colfunc.update({cl: 'mean' for cl in dfpos.columns.drop('sales')})
-    dfpos = dfpos.groupby('TICKER').resample('W', level='DATETIME').apply(colfunc)
+    dfpos = resample_weekly(dfpos, colfunc, rule='W')
     return dfpos
 
 
+@instrument()
 def aggregate_dfsci(dfsci):
     return dfsci.groupby(['TICKER', 'DATETIME', 'SMOOTH', 'VARIABLE'])[['VALUE']].sum()
 
+@instrument()
 def transform_dfsci(dfsci):
     dftx = dfsci['VALUE'].unstack(['VARIABLE', 'SMOOTH'])
     return dftx
 
 
-def read_file(data_dir=DEFAULT_DIR):
+@instrument()
+def read_file(data_dir=DEFAULT_DIR, tickers: Optional[List[str]] = None):
     # loading from csv to save time for this demo
-    return pd.read_parquet(os.path.join(data_dir, FILE_NAME), engine='pyarrow')
\ No newline at end of file
+    path = os.path.join(data_dir, FILE_NAME)
+    if is_partitioned(path):
+        return read_stack(partition_files(partitioned_root(path), tickers=tickers), tickers=tickers)
+    return pd.read_parquet(path, engine='pyarrow')
\ No newline at end of file
@@ -0,0 +1,150 @@
+from typing import Iterable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from .utils import read_stack
+
+
+ASOF_COLUMNS = ['TICKER', 'DATETIME', 'VARIABLE', 'RELEASE_TIMESTAMP', 'VALUE']
+
+_LATEST = np.iinfo(np.int64).max
+
+
+def _as_of_ns(as_of) -> int:
+    return _LATEST if as_of is None else pd.Timestamp(as_of).as_unit('ns').value
+
+
+class AsOfStore:
+    """
+    Release history of a POS stack for point-in-time queries.
+
+    Every (TICKER, DATETIME, VARIABLE) cell keeps all of its releases as a
+    sorted array, so the values known at any time T are found by binary
+    search, for many T at once. `snapshot(None)` equals `format_pos` of the
+    same data; rows without RELEASE_TIMESTAMP are treated as the latest
+    release as in `format_pos`, so they only appear in that snapshot.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Long POS stack with TICKER, DATETIME, VARIABLE, RELEASE_TIMESTAMP,
+        VALUE (and SMOOTH) columns.
+    smooth : int, optional
+        SMOOTH to keep, by default 0. None keeps every row.
+    """
+
+    def __init__(self, df: pd.DataFrame, smooth: Optional[int] = 0):
+        if smooth is not None and 'SMOOTH' in df.columns:
+            df = df.loc[(df['SMOOTH'] == smooth).to_numpy(), ASOF_COLUMNS]
+        else:
+            df = df[ASOF_COLUMNS]
+
+        tk_codes, self.tickers = pd.factorize(df['TICKER'], sort=True)
+        dt_codes, self.datetimes = pd.factorize(pd.to_datetime(df['DATETIME']), sort=True)
+        var_codes, self.variables = pd.factorize(df['VARIABLE'], sort=True)
+        valid = (tk_codes >= 0) & (dt_codes >= 0) & (var_codes >= 0)
+
+        n_dt, n_var = len(self.datetimes), len(self.variables)
+        cell = (tk_codes.astype(np.int64) * n_dt + dt_codes) * n_var + var_codes
+        release = pd.to_datetime(df['RELEASE_TIMESTAMP']).to_numpy(dtype='datetime64[ns]').view(np.int64).copy()
+        release[release == np.iinfo(np.int64).min] = _LATEST
+        values = df['VALUE'].to_numpy()
+
+        # cell, RELEASE_TIMESTAMP の順に並べ、同一リリース内では最後の行を残す (format_pos と同じ)
+        order = np.flatnonzero(valid)
+        order = order[np.lexsort((release[order], cell[order]))]
+        cell, release, values = cell[order], release[order], values[order]
+        last = np.r_[(cell[1:] != cell[:-1]) | (release[1:] != release[:-1]), True]
+        self._cell, self._release, self._values = cell[last], release[last], values[last]
+
+        # 各リリースは同じ cell の次のリリースまで有効
+        self._is_last = np.r_[self._cell[1:] != self._cell[:-1], True]
+        self._next_release = np.r_[self._release[1:], _LATEST]
+        self._n_dt, self._n_var = n_dt, n_var
+
+    @classmethod
+    def from_stack(
+        cls,
+        path_or_list: Union[str, List[str]],
+        tickers: Optional[List[str]] = None,
+        start_date=None,
+        end_date=None,
+        variables: Optional[List[str]] = None,
+        smooth: Optional[int] = 0,
+    ) -> 'AsOfStore':
+        """Build the store from stack files (see `read_stack`), reading the needed columns only."""
+        df = read_stack(
+            path_or_list, tickers=tickers, start_date=start_date, end_date=end_date,
+            variables=variables, smooth=smooth, columns=ASOF_COLUMNS)
+        return cls(df, smooth=None)
+
+    def __len__(self) -> int:
+        return len(self._cell)
+
+    def _wide(self, rows: tuple, keys: List[pd.Index], names: List[str]) -> pd.DataFrame:
+        # rows: (keys の codes を結合した行キー, VARIABLE の code, 値)
+        row_codes, uniq_rows = pd.factorize(rows[0], sort=True)
+        var_codes, var_uniques = pd.factorize(rows[1], sort=True)
+        values = rows[2]
+        if len(values) == len(uniq_rows) * len(var_uniques):
+            out = np.empty((len(uniq_rows), len(var_uniques)), dtype=values.dtype)
+        else:
+            dtype = values.dtype if values.dtype.kind in 'fc' else np.float64 if values.dtype.kind in 'iub' else object
+            out = np.full((len(uniq_rows), len(var_uniques)), np.nan, dtype=dtype)
+        out[row_codes, var_codes] = values
+
+        codes, rest = [], uniq_rows
+        for level in reversed(keys):
+            codes.append(rest % len(level))
+            rest = rest // len(level)
+        index = pd.MultiIndex(levels=keys, codes=codes[::-1], names=names, verify_integrity=False)
+        columns = pd.Index(self.variables.take(var_uniques), name='VARIABLE')
+        return pd.DataFrame(out, index=index, columns=columns)
+
+    def snapshot(self, as_of=None) -> pd.DataFrame:
+        """
+        Wide TICKER x DATETIME frame of the values known at `as_of`
+        (releases at or before it), in the format of `format_pos`.
+        None returns the latest values.
+        """
+        t = _as_of_ns(as_of)
+        known = np.flatnonzero((self._release <= t) & (self._is_last | (t < self._next_release)))
+        cell = self._cell[known]
+        row_key, var_codes = cell // self._n_var, cell % self._n_var
+        tk_used, tk_codes = np.unique(row_key // self._n_dt, return_inverse=True)
+        dt_used, dt_codes = np.unique(row_key % self._n_dt, return_inverse=True)
+        return self._wide(
+            (tk_codes.astype(np.int64) * len(dt_used) + dt_codes, var_codes, self._values[known]),
+            [self.tickers.take(tk_used), self.datetimes.take(dt_used)],
+            ['TICKER', 'DATETIME'])
+
+    def snapshots(self, as_ofs: Iterable) -> pd.DataFrame:
+        """
+        Values known at each of `as_ofs`, indexed by (AS_OF, TICKER, DATETIME).
+
+        Each release is mapped with one binary search to the range of as-of
+        times at which it is the latest known one, so the cost is that of
+        the output rows rather than one scan per as-of time.
+        """
+        as_ofs = pd.DatetimeIndex(pd.to_datetime(list(as_ofs))).unique().sort_values()
+        t = as_ofs.as_unit('ns').asi8
+
+        lo = np.searchsorted(t, self._release, side='left')
+        hi = np.searchsorted(t, self._next_release, side='left')
+        hi[self._is_last] = len(t)
+        counts = np.maximum(hi - lo, 0)
+
+        rec = np.repeat(np.arange(len(counts)), counts)
+        t_idx = lo[rec] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        cell = self._cell[rec]
+        row_key = cell // self._n_var
+        # 出現する TICKER / DATETIME のみを levels にする
+        tk_used, tk_codes = np.unique(row_key // self._n_dt, return_inverse=True)
+        dt_used, dt_codes = np.unique(row_key % self._n_dt, return_inverse=True)
+        rows = (t_idx.astype(np.int64) * len(tk_used) + tk_codes) * len(dt_used) + dt_codes
+        return self._wide(
+            (rows, cell % self._n_var, self._values[rec]),
+            [pd.DatetimeIndex(as_ofs), self.tickers.take(tk_used), self.datetimes.take(dt_used)],
+            ['AS_OF', 'TICKER', 'DATETIME'])
@@ -1,3 +1,5 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Optional, Union, List
 from pathlib import Path
 
@@ -10,8 +12,10 @@ from aiq_strategy_robot.data.data_accessor import StdDataHandler
 from asr_protected.data_transformer.variable_libs import log_diff
 
 from ..downloader.fundamental import download_fundamental
-from ..utils import index_to_upper
+from .utils import grouped_shift, canonical_index
+from .compact import maybe_compact
 from ..path import DEFAULT_DIR
+from ..instrument import instrument, stage, event
 from ..s3 import to_s3, read_s3, DEFAULT_BUCKET
 
 
@@ -24,6 +28,7 @@ MKT_FILES_MAP = {
 }
 
 
+@instrument()
 def register_market(
     sdh: StdDataHandler,
     target: str
@@ -55,25 +60,80 @@ def register_market(
     # print('extract mkt data from s3..')
     df_mkt = read_s3(DEFAULT_BUCKET, filename)
 
-    df_mkt = index_to_upper(df_mkt)
+    df_mkt = canonical_index(df_mkt)
+    df_mkt = maybe_compact(df_mkt, alias)
 
-    df_mkt = df_mkt.reset_index()
-
-    df_mkt['DATETIME'] = pd.to_datetime(df_mkt['DATETIME']).astype('datetime64[ns]')
-    df_mkt = df_mkt.set_index(['TICKER', 'DATETIME'])
-
-    data_id = sdh.set_raw_data(df_mkt)
+    with stage('set_raw_data', rows_in=len(df_mkt)):
+        data_id = sdh.set_raw_data(df_mkt)
         
     sdh.set_alias({data_id: alias})
     return data_id
 
-def read_market_data_from_yfinance(tickers, start_date):
-    dfstock = pd.DataFrame()
-    not_list = []
-    for ticker in tqdm(tickers):
-        stock = yf.Ticker(ticker + '.T')
-        hist = stock.history(start=start_date)
-        if len(hist) > 0:
+# yf.Ticker.history の列
+YFINANCE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits']
+
+
+def _fetch_yfinance(ticker, start_date, retries=3, backoff=1.0):
+    # 一時的なエラーは指数バックオフで再試行する
+    for attempt in range(retries + 1):
+        try:
+            return yf.Ticker(ticker + '.T').history(start=start_date)
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+def read_market_data_from_yfinance(
+    tickers,
+    start_date,
+    max_workers: int = 8,
+    retries: int = 3,
+    backoff: float = 1.0,
+    return_failures: bool = False,
+):
+    """
+    Download daily prices of TSE tickers from yfinance.
+
+    Parameters
+    ----------
+    tickers : list
+        Tickers without the '.T' suffix.
+    start_date : str
+        Start date of the prices.
+    max_workers : int, optional
+        Number of concurrent downloads, by default 8.
+    retries : int, optional
+        Retries per ticker on errors, by default 3.
+    backoff : float, optional
+        Base seconds of the exponential backoff between retries, by default 1.0.
+    return_failures : bool, optional
+        If True, also return a dict of ticker -> reason for the tickers
+        without data, by default False.
+
+    Returns
+    -------
+    pd.DataFrame or (pd.DataFrame, dict)
+        Prices indexed by (TICKER, DATETIME), empty when no ticker could be
+        downloaded.
+    """
+    list_hist = []
+    failures = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_fetch_yfinance, ticker, start_date, retries, backoff): ticker
+            for ticker in tickers
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            ticker = futures[future]
+            try:
+                hist = future.result()
+            except Exception as e:
+                failures[ticker] = f'{type(e).__name__}: {e}'
+                continue
+            if len(hist) == 0:
+                failures[ticker] = 'no data'
+                continue
             hist['TICKER'] = ticker
             hist.index = hist.index.tz_localize(None)
             hist.index.name = 'DATETIME'
@@ -81,16 +141,27 @@ def read_market_data_from_yfinance(tickers, start_date):
             if ticker == '2651':
                 hist = hist[hist.index < '2024-07-23']
             hist.set_index('TICKER', append=True, inplace=True)
-            dfstock = pd.concat([dfstock, hist], axis=0)
-        else:
-            not_list.append(ticker)
-
-    print('no: ', ','.join(not_list))
-    dfstock = dfstock.swaplevel().sort_index()
+            list_hist.append(hist)
+
+    print('no: ', ','.join(t for t, reason in failures.items() if reason == 'no data'))
+    errors = {t: reason for t, reason in failures.items() if reason != 'no data'}
+    if errors:
+        print('failed: ', ', '.join(f'{t} ({reason})' for t, reason in errors.items()))
+
+    if list_hist:
+        dfstock = pd.concat(list_hist, axis=0).swaplevel().sort_index()
+    else:
+        # 全銘柄が取得できなかった場合は空のデータを返す
+        index = pd.MultiIndex.from_arrays(
+            [pd.Index([], dtype=object), pd.DatetimeIndex([])], names=['TICKER', 'DATETIME'])
+        dfstock = pd.DataFrame(index=index, columns=YFINANCE_COLUMNS, dtype='float64')
     dfstock.columns = [c.lower() for c in dfstock.columns]
+    if return_failures:
+        return dfstock, failures
     return dfstock
 
 
+@instrument()
 def register_fundamental(
     sdh: StdDataHandler, 
     filename="common/fundamental_yoy_on_mongo.parquet", 
@@ -115,12 +186,11 @@ def register_fundamental(
 
     dfsales = read_s3(DEFAULT_BUCKET, filename)
 
-    dfsales = index_to_upper(dfsales)
-    dfsales = dfsales.reset_index()
-    dfsales['DATETIME'] = pd.to_datetime(dfsales['DATETIME']).astype('datetime64[ns]')
-    dfsales = dfsales.set_index(['TICKER', 'DATETIME'])
+    dfsales = canonical_index(dfsales)
+    dfsales = maybe_compact(dfsales, 'funda')
 
-    data_id = sdh.set_raw_data(dfsales)
+    with stage('set_raw_data', rows_in=len(dfsales)):
+        data_id = sdh.set_raw_data(dfsales)
     sdh.set_alias({data_id: 'funda'})
     return data_id
 
@@ -133,6 +203,11 @@ import pandas as pd
 from os import listdir
 from os.path import isfile, join
 
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
 def get_matching_files(directory, pattern):
     # パターンに基づいて条件に一致するファイルを取得
     search_pattern = os.path.join(directory, pattern)
@@ -140,21 +215,24 @@ def get_matching_files(directory, pattern):
     return matching_files
 
 
+EXTRACT_COLUMNS = {
+    'Ticker': 'ticker',
+    'DATE': 'datetime',
+    'Open Price': 'open',
+    'High Price': 'high',
+    'Low Price': 'low',
+    'Close Price': 'close',
+    'Split Factor': 'split_ratio',
+    'Div Factor': 'div_ratio'
+}
+
+
 def get_adj_close(
     dfinput: pd.DataFrame,
 ) -> pd.DataFrame:
-    dfclose = dfinput[['Ticker', 'DATE', 'Open Price', 'High Price', 'Low Price', 'Close Price', 'Split Factor', 'Div Factor']].copy()
-    dfclose = dfclose.rename(columns={
-        'Ticker': 'ticker',
-        'DATE': 'datetime',
-        'Open Price': 'open',
-        'High Price': 'high',
-        'Low Price': 'low',
-        'Close Price': 'close',
-        'Split Factor': 'split_ratio',
-        'Div Factor': 'div_ratio'
-    })
-    dfclose['ticker'] = dfclose['ticker'].apply(lambda x: x[:4])
+    dfclose = dfinput[list(EXTRACT_COLUMNS)].copy()
+    dfclose = dfclose.rename(columns=EXTRACT_COLUMNS)
+    dfclose['ticker'] = dfclose['ticker'].str.slice(0, 4)
     # dfclose = dfclose.loc[dfclose['ticker'].isin(list_tickers)]
     dfclose = dfclose.set_index(['ticker', 'datetime'])
     dfclose['adj_open'] = dfclose['open'] * dfclose['split_ratio'] * dfclose['div_ratio']
@@ -164,16 +242,100 @@ def get_adj_close(
     return dfclose[['adj_open', 'adj_high', 'adj_low', 'adj_close']]
 
 
+@instrument()
+def compute_market_returns(df_mkt_raw: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compute the log returns of the adjusted prices in one pass.
+
+    Rows are sorted by (TICKER, DATETIME) once and the previous row of the
+    same ticker is taken from the contiguous ticker blocks, which gives the
+    same values as the log / shift / log_diff / sub transforms of the DAL.
+
+    Parameters
+    ----------
+    df_mkt_raw : pd.DataFrame
+        Output of `get_adj_close` indexed by (TICKER, DATETIME).
+
+    Returns
+    -------
+    pd.DataFrame
+        returns    : close(t) / close(t-1)
+        returns_oo : open(t) / open(t-1)
+        returns_id : close(t) / open(t)
+        returns_on : open(t) / close(t-1)
+        all in log, indexed by (TICKER, DATETIME).
+    """
+    tk_codes = df_mkt_raw.index.get_level_values(0).factorize(sort=True)[0]
+    dt_values = df_mkt_raw.index.get_level_values(1).to_numpy()
+    order = np.lexsort((dt_values, tk_codes))
+    if (order == np.arange(len(order))).all():
+        order = slice(None)
+
+    codes = tk_codes[order]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_close = np.log(df_mkt_raw['adj_close'].to_numpy(dtype=np.float64)[order])
+        log_open = np.log(df_mkt_raw['adj_open'].to_numpy(dtype=np.float64)[order])
+    log_close_prev = grouped_shift(log_close, codes, 1)
+    log_open_prev = grouped_shift(log_open, codes, 1)
+
+    df_ret = pd.DataFrame({
+        'returns': log_close - log_close_prev,
+        'returns_oo': log_open - log_open_prev,
+        'returns_id': log_close - log_open,
+        'returns_on': log_open - log_close_prev,
+    }, index=df_mkt_raw.index[order])
+    df_ret.index.names = ['TICKER', 'DATETIME']
+    return df_ret
+
+
+def scan_adj_close(
+    list_files: List[str],
+    tickers: Optional[List[str]] = None,
+    batch_size: int = 1_000_000,
+    list_raw: Optional[list] = None,
+) -> pd.DataFrame:
+    """
+    Compute adjusted prices from the extract files batch by batch.
+
+    Only the columns used by `get_adj_close` are decoded and rows of other
+    tickers are dropped before the conversion to pandas, so peak memory is
+    bounded by `batch_size` plus the (much smaller) adjusted output.
+    If `list_raw` is given, the raw batches (all columns and all tickers,
+    as the whole extract was returned before) are appended to it.
+    """
+    columns = None if list_raw is not None else list(EXTRACT_COLUMNS)
+    value_set = pa.array(list(tickers)) if tickers else None
+
+    list_adj = []
+    for fl in list_files:
+        for batch in pq.ParquetFile(fl).iter_batches(batch_size=batch_size, columns=columns):
+            if list_raw is not None:
+                list_raw.append(batch.to_pandas())
+            if value_set is not None:
+                batch = batch.filter(pc.is_in(
+                    pc.utf8_slice_codeunits(batch.column('Ticker'), 0, 4), value_set=value_set))
+            list_adj.append(get_adj_close(batch.to_pandas()))
+    return pd.concat(list_adj, axis=0)
+
+
+MARKET_RETURN_ENGINES = ('native', 'dal')
+
+
+@instrument()
 def reload_market_to_s3(
     extract_dir = '/efs/share/data/extract/',
     tickers: list[str] = None,
     upload_filename: bool = True,
+    return_raw: bool = False,
+    batch_size: int = 1_000_000,
+    engine: str = 'native',
 ):
-
+    # engine: 'native' (compute_market_returns) または 'dal' (DAL の transform)
+    if engine not in MARKET_RETURN_ENGINES:
+        raise ValueError(f'engine must be one of {MARKET_RETURN_ENGINES}, got {engine!r}')
     
     list_extracts = [join(extract_dir, f) for f in listdir(extract_dir) if isfile(join(extract_dir, f))]
     list_extracts.sort()
-    list_extracts
 
     # files with market data are only required.
     list_data_extracts = [x for x in list_extracts if '_cae_' not in x]
@@ -182,41 +344,42 @@ def reload_market_to_s3(
     # list_data_sci = [x for x in list_data_extracts if target_file_str in x]
     # list_data_sci
 
-    list_data = []
-    for fl in list_data_extracts:
-        dftmp = pd.read_parquet(fl, engine='pyarrow')
-        list_data.append(dftmp)
-    dfdata = pd.concat(list_data, axis=0, sort=False)
-    dfdata.head() 
+    # 必要な列・銘柄のみを batch ごとに読み込む (raw データは return_raw=True の場合のみ保持)
+    list_raw = [] if return_raw else None
+    with stage('scan_adj_close') as st:
+        df_mkt_raw = scan_adj_close(list_data_extracts, tickers=tickers, batch_size=batch_size, list_raw=list_raw)
+        st.update(rows_out=len(df_mkt_raw))
+        st.files_read(list_data_extracts)
+    dfdata = pd.concat(list_raw, axis=0, sort=False) if return_raw else None
 
-    df_mkt_raw = get_adj_close(dfdata)
     df_mkt_raw.index.names = ['TICKER', 'DATETIME']
     df_mkt_raw = df_mkt_raw.loc[~df_mkt_raw.index.duplicated()]
     df_mkt_raw = df_mkt_raw.loc[~df_mkt_raw.index.get_level_values('DATETIME').isnull()]
 
-    if tickers:
-        df_mkt_raw = df_mkt_raw.loc[df_mkt_raw.index.get_level_values('TICKER').isin(tickers)]
-
     # transformation to returns
-    tmpsdh = DAL()
-    tmp_data_id = tmpsdh.set_raw_data(df_mkt_raw)
-
-    logs = tmpsdh.transform.log(data_id=tmp_data_id, fields=['adj_close', 'adj_open'], names=['log_close', 'log_open']).variable_ids
-    logs_prev = tmpsdh.transform.shift(1, fields=['log_close', 'log_open'], names=['log_close_prev', 'log_open_prev']).variable_ids
-
-    returns = tmpsdh.transform.log_diff(1, data_id=tmp_data_id, fields='adj_close', names='returns').variable_ids[0]  # close(t2) - close(t1) 
-    returns_oo = tmpsdh.transform.log_diff(1, data_id=tmp_data_id, fields='adj_open', names='returns_oo').variable_ids[0] # open(t2) - open(t1) 
-    returns_id = tmpsdh.transform.sub(x1field='log_close', x2field='log_open', name='returns_id').variable_ids[0] # close(t1) - open(t1) 
-    return_on = tmpsdh.transform.sub(x1field='log_open', x2field='log_close_prev', name='returns_on').variable_ids[0] # open(t2) - close(t1) 
-
-    df_ret = tmpsdh.get_variables([returns, returns_oo, returns_id, return_on])
-    # df_mkt = tmpsdh.get_variables([returns])
+    if engine == 'native':
+        df_ret = compute_market_returns(df_mkt_raw)
+    elif engine == 'dal':
+        tmpsdh = DAL()
+        tmp_data_id = tmpsdh.set_raw_data(df_mkt_raw)
+
+        logs = tmpsdh.transform.log(data_id=tmp_data_id, fields=['adj_close', 'adj_open'], names=['log_close', 'log_open']).variable_ids
+        logs_prev = tmpsdh.transform.shift(1, fields=['log_close', 'log_open'], names=['log_close_prev', 'log_open_prev']).variable_ids
+
+        returns = tmpsdh.transform.log_diff(1, data_id=tmp_data_id, fields='adj_close', names='returns').variable_ids[0]  # close(t2) - close(t1) 
+        returns_oo = tmpsdh.transform.log_diff(1, data_id=tmp_data_id, fields='adj_open', names='returns_oo').variable_ids[0] # open(t2) - open(t1) 
+        returns_id = tmpsdh.transform.sub(x1field='log_close', x2field='log_open', name='returns_id').variable_ids[0] # close(t1) - open(t1) 
+        return_on = tmpsdh.transform.sub(x1field='log_open', x2field='log_close_prev', name='returns_on').variable_ids[0] # open(t2) - close(t1) 
+
+        df_ret = tmpsdh.get_variables([returns, returns_oo, returns_id, return_on])
+        # df_mkt = tmpsdh.get_variables([returns])
     if upload_filename:
         to_s3(df_ret, DEFAULT_BUCKET, upload_filename)
 
     return dfdata, df_mkt_raw, df_ret
 
 
+@instrument()
 def reload_fundamental_to_s3(
     mongo_conn_str,
     tickers: list,
@@ -225,7 +388,7 @@ def reload_fundamental_to_s3(
     fields: List[str] = ['sales'],
     filename="common/fundamental_yoy_on_mongo.parquet"
 ):
-    print('extract fundamental from monogo db..')
+    event('download_fundamental', 'extract fundamental from monogo db..')
     dfsales = download_fundamental(
         mongo_conn_str, tickers, from_year, fields
     )
@@ -0,0 +1,121 @@
+import os
+import threading
+from collections import deque
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ..instrument import event
+
+
+ENV_COMPACT = 'AIQ_COMPACT_DTYPES'
+ENV_COMPACT_TOLERANCE = 'AIQ_COMPACT_TOLERANCE'
+
+# 0 は float32 にしても値が変わらない列だけを変換する
+DEFAULT_TOLERANCE = 0.0
+
+# compact_frame の実行結果 (データセット毎のメモリ使用量)。古いものから捨てる
+MAX_REPORTS = 1000
+_REPORTS = deque(maxlen=MAX_REPORTS)
+_LOCK = threading.Lock()
+
+
+def compact_enabled() -> bool:
+    return os.environ.get(ENV_COMPACT, '0').lower() not in ('0', 'false', 'off', '')
+
+
+def compact_tolerance() -> float:
+    return float(os.environ.get(ENV_COMPACT_TOLERANCE, DEFAULT_TOLERANCE))
+
+
+def _fits_float32(values: np.ndarray, tolerance: float) -> bool:
+    with np.errstate(over='ignore', invalid='ignore'):
+        values32 = values.astype(np.float32).astype(np.float64)
+        if tolerance <= 0:
+            return bool(np.array_equal(values32, values, equal_nan=True))
+        return bool(np.isclose(values32, values, rtol=tolerance, atol=0, equal_nan=True).all())
+
+
+def compact_frame(df: pd.DataFrame, tolerance: float = DEFAULT_TOLERANCE, name: Optional[str] = None) -> pd.DataFrame:
+    """
+    Shrink the dtypes of a frame.
+
+    A TICKER column becomes categorical (a TICKER index level is already
+    stored as codes) and float64 columns become float32 when every value
+    round-trips within the relative `tolerance`. The memory before and
+    after is kept for `compact_report`.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+    tolerance : float, optional
+        Max relative error allowed by the float32 conversion. By default 0,
+        i.e. only columns whose values are exactly representable in float32
+        are converted.
+    name : str, optional
+        Dataset name used in the report.
+
+    Returns
+    -------
+    pd.DataFrame
+        New frame; `df` is not modified.
+    """
+    return _compact(df, tolerance, name)[0]
+
+
+def _compact(df: pd.DataFrame, tolerance: float, name: Optional[str]) -> Tuple[pd.DataFrame, dict]:
+    before = int(df.memory_usage(index=True, deep=True).sum())
+
+    out = df.copy(deep=False)
+    n_float32 = n_category = 0
+    for i, (column, dtype) in enumerate(df.dtypes.items()):
+        if column == 'TICKER' and not isinstance(dtype, pd.CategoricalDtype):
+            out.isetitem(i, df.iloc[:, i].astype('category'))
+            n_category += 1
+        elif dtype == np.float64:
+            values = df.iloc[:, i].to_numpy()
+            if _fits_float32(values, tolerance):
+                out.isetitem(i, df.iloc[:, i].astype(np.float32))
+                n_float32 += 1
+
+    after = int(out.memory_usage(index=True, deep=True).sum())
+    report = {
+        'name': name, 'rows': len(df), 'columns': df.shape[1],
+        'float32': n_float32, 'category': n_category,
+        'bytes_before': before, 'bytes_after': after,
+    }
+    with _LOCK:
+        _REPORTS.append(report)
+    return out, report
+
+
+def maybe_compact(df: pd.DataFrame, name: Optional[str] = None) -> pd.DataFrame:
+    """
+    `compact_frame` when enabled with AIQ_COMPACT_DTYPES=1, otherwise `df` as is.
+    The memory before and after is printed and recorded as a 'compact' event.
+    """
+    if not compact_enabled():
+        return df
+    out, report = _compact(df, compact_tolerance(), name)
+    message = (f'{name or "frame"}: {report["bytes_before"] / 1024 ** 2:,.1f}MB -> '
+               f'{report["bytes_after"] / 1024 ** 2:,.1f}MB '
+               f'({report["float32"]}/{report["columns"]} columns to float32)')
+    fields = {k: v for k, v in report.items() if k != 'name'}
+    event('compact', message, dataset=name, **fields)
+    return out
+
+
+def compact_report() -> pd.DataFrame:
+    """Memory before / after of the frames compacted in this session (the last MAX_REPORTS)."""
+    with _LOCK:
+        reports = list(_REPORTS)
+    report = pd.DataFrame(reports, columns=[
+        'name', 'rows', 'columns', 'float32', 'category', 'bytes_before', 'bytes_after'])
+    report['saved_ratio'] = 1 - report['bytes_after'] / report['bytes_before']
+    return report
+
+
+def clear_compact_report():
+    with _LOCK:
+        _REPORTS.clear()
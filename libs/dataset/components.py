@@ -1,6 +1,7 @@
 
 from .aiq_pos_csmr_goods import register_csmr_goods_data
 from .common import register_market
+from .lag_features import build_lag_features
 from ..path import DEFAULT_DIR
 
 
@@ -8,26 +9,9 @@ from ..path import DEFAULT_DIR
 def transform_mkt_vs_alt(sdh, data_id_mkt, data_id_alt):
 
     mkt_W_close_id = sdh.transform.fillna(0, data_id=data_id_mkt, fields='returns').cumsum().exp().resample(rule='W', func='last').variable_ids[-1]
-    alt_W_shift_0_ids = sdh.transform.resample(data_id=data_id_alt, rule='W', func='mean').variable_ids
-
-    alt_W_shift_1_ids = sdh.transform.shift(data_id=data_id_alt, periods=1).resample(rule='W', func='mean').sma(periods=12).variable_ids
-    alt_W_shift_2_ids = sdh.transform.shift(data_id=data_id_alt, periods=2).resample(rule='W', func='mean').sma(periods=12).variable_ids
-    alt_W_shift_3_ids = sdh.transform.shift(data_id=data_id_alt, periods=3).resample(rule='W', func='mean').sma(periods=12).variable_ids
-    alt_W_shift_4_ids = sdh.transform.shift(data_id=data_id_alt, periods=4).resample(rule='W', func='mean').sma(periods=12).variable_ids
-    alt_W_shift_5_ids = sdh.transform.shift(data_id=data_id_alt, periods=5).resample(rule='W', func='mean').sma(periods=12).variable_ids
-    alt_W_shift_6_ids = sdh.transform.shift(data_id=data_id_alt, periods=6).resample(rule='W', func='mean').sma(periods=12).variable_ids
-    alt_W_shift_7_ids = sdh.transform.shift(data_id=data_id_alt, periods=7).resample(rule='W', func='mean').sma(periods=12).variable_ids
-    alt_W_shift_8_ids = sdh.transform.shift(data_id=data_id_alt, periods=8).resample(rule='W', func='mean').sma(periods=12).variable_ids
-    
-    alt_W_shift_0_sma12_logdiff_ids = sdh.transform.log_diff(fields=alt_W_shift_0_ids, periods=52).variable_ids
-    alt_W_shift_1_sma12_logdiff_ids = sdh.transform.log_diff(fields=alt_W_shift_1_ids, periods=52).variable_ids
-    alt_W_shift_2_sma12_logdiff_ids = sdh.transform.log_diff(fields=alt_W_shift_2_ids, periods=52).variable_ids
-    alt_W_shift_3_sma12_logdiff_ids = sdh.transform.log_diff(fields=alt_W_shift_3_ids, periods=52).variable_ids
-    alt_W_shift_4_sma12_logdiff_ids = sdh.transform.log_diff(fields=alt_W_shift_4_ids, periods=52).variable_ids
-    alt_W_shift_5_sma12_logdiff_ids = sdh.transform.log_diff(fields=alt_W_shift_5_ids, periods=52).variable_ids
-    alt_W_shift_6_sma12_logdiff_ids = sdh.transform.log_diff(fields=alt_W_shift_6_ids, periods=52).variable_ids
-    alt_W_shift_7_sma12_logdiff_ids = sdh.transform.log_diff(fields=alt_W_shift_7_ids, periods=52).variable_ids
-    alt_W_shift_8_sma12_logdiff_ids = sdh.transform.log_diff(fields=alt_W_shift_8_ids, periods=52).variable_ids
+
+    alt_W_shift_ids, alt_W_shift_sma12_logdiff_ids = build_lag_features(
+        sdh, data_id_alt, lags=range(0, 9), rule='W', func='mean', sma_periods=12, diff_periods=52)
     
     close_ret = sdh.transform.dropna(fields=mkt_W_close_id, how='all').calc_return(name='ret').variable_ids[-1]
     return sdh
@@ -46,4 +30,4 @@ def load_and_transform_for_alt_data_evaluator(sdh, data_dir=DEFAULT_DIR):
         data_id_mkt: 'market'
     })
 
-    transform_mkt_vs_alt(sdh, data_id_mkt, data_id_alt)
\ No newline at end of file
+    transform_mkt_vs_alt(sdh, data_id_mkt, data_id_alt)
@@ -0,0 +1,136 @@
+import weakref
+import functools
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+Step = Tuple[str, tuple]
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def step(name: str, **kwargs) -> Step:
+    """One transform of a chain, e.g. step('resample', rule='W-FRI', func='last')."""
+    return (name, _freeze(kwargs))
+
+
+# handler 毎の generation (set_raw_data / transform.clear の呼び出し回数)
+_GENERATIONS = weakref.WeakKeyDictionary()
+
+
+def _bump(ref: weakref.ref, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        handler = ref()
+        if handler is not None:
+            _GENERATIONS[handler] = _GENERATIONS.get(handler, 0) + 1
+        return method(*args, **kwargs)
+    wrapper._bumps_generation = True
+    return wrapper
+
+
+def watch_handler(sdh) -> bool:
+    """
+    Count the calls of `sdh.set_raw_data` and `sdh.transform.clear` in the
+    generation of `sdh` (see `handler_generation`). False if the handler
+    cannot be watched.
+    """
+    try:
+        ref = weakref.ref(sdh)
+        _GENERATIONS.setdefault(sdh, 0)
+        if not getattr(sdh.set_raw_data, '_bumps_generation', False):
+            sdh.set_raw_data = _bump(ref, sdh.set_raw_data)
+        transform = getattr(sdh, 'transform', None)
+        # transform が毎回作られる場合は clear を差し替えられない
+        if transform is not None and transform is sdh.transform and hasattr(transform, 'clear') \
+                and not getattr(transform.clear, '_bumps_generation', False):
+            transform.clear = _bump(ref, transform.clear)
+    except (TypeError, AttributeError):
+        return False
+    return True
+
+
+def handler_generation(sdh) -> Optional[int]:
+    """Generation of a watched handler, None if it is not watched."""
+    try:
+        return _GENERATIONS.get(sdh)
+    except TypeError:
+        return None
+
+
+class FeatureGraph:
+    """
+    Evaluate transform chains on a data handler, computing identical
+    prefixes only once.
+
+    A chain starts from (data_id, fields) and is a sequence of `step`s,
+    each of which is a method of `sdh.transform`. The variable IDs of every
+    prefix are memoized, so chains sharing e.g. the same resample reuse it.
+    The special step 'select' picks variables of the previous step by
+    position (`index`).
+
+    The memo is dropped whenever data is registered on the handler
+    (`set_raw_data`) or its transforms are cleared, so replaced data is
+    never answered with the variable IDs of the old one. Handlers that
+    cannot be watched are evaluated without the memo.
+    """
+
+    def __init__(self, sdh):
+        self.sdh = sdh
+        self._memo: Dict[tuple, List] = {}
+        self._generation = None
+        self.hits = 0
+        self.misses = 0
+        watch_handler(sdh)
+
+    def _apply(self, ids: Optional[List], data_id: int, fields, name: str, kwargs: tuple) -> List:
+        kwargs = dict(kwargs)
+        if name == 'select':
+            return [ids[i] for i in kwargs['index']]
+        if ids is None:
+            if fields is not None:
+                kwargs['fields'] = list(fields) if isinstance(fields, tuple) else fields
+            return list(getattr(self.sdh.transform, name)(data_id=data_id, **kwargs).variable_ids)
+        return list(getattr(self.sdh.transform, name)(fields=ids, **kwargs).variable_ids)
+
+    def evaluate(self, data_id: int, fields, chain: Sequence[Step]) -> List:
+        """Variable IDs of the last step of `chain` applied to (data_id, fields)."""
+        generation = handler_generation(self.sdh)
+        if generation is None or generation != self._generation:
+            self._memo.clear()
+            self._generation = generation
+
+        key = (data_id, _freeze(fields))
+        ids = None
+        for name, kwargs in chain:
+            key = key + ((name, kwargs),)
+            if generation is not None and key in self._memo:
+                self.hits += 1
+                ids = self._memo[key]
+                continue
+            self.misses += 1
+            ids = self._apply(ids, data_id, _freeze(fields), name, kwargs)
+            self._memo[key] = ids
+        return list(ids)
+
+    def clear(self):
+        self._memo.clear()
+
+
+_GRAPHS = weakref.WeakKeyDictionary()
+
+
+def feature_graph(sdh) -> FeatureGraph:
+    """Session-wide graph of `sdh` (memoized results are shared across calls)."""
+    try:
+        graph = _GRAPHS.get(sdh)
+        if graph is None:
+            graph = _GRAPHS[sdh] = FeatureGraph(sdh)
+        return graph
+    except TypeError:
+        return FeatureGraph(sdh)
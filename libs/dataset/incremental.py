@@ -0,0 +1,281 @@
+import os
+import json
+import shutil
+from typing import Callable, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from ..storage import (
+    is_partitioned, partitioned_root, partition_files, read_layout, write_partitioned, replace_dir
+)
+from .universe import update_universe, write_universe
+
+
+MANIFEST_SUFFIX = '.manifest.json'
+PARTS_SUFFIX = '.parts'
+
+DEFAULT_LOOKBACK_DAYS = 31
+DEFAULT_RECONCILE_DAYS = 7
+DEFAULT_WINDOW_DAYS = 366
+
+
+# *_stack.parquet 本体に対して、差分は <file>.parts/ 以下に追記し、
+# 取り込み済みの差分と RELEASE_TIMESTAMP の watermark、最後に全期間を取得した日時 (reconciled) を
+# <file>.manifest.json で管理する。
+
+def manifest_path(path: str) -> str:
+    return os.path.expanduser(path) + MANIFEST_SUFFIX
+
+
+def parts_dir(path: str) -> str:
+    return os.path.expanduser(path) + PARTS_SUFFIX
+
+
+def load_manifest(path: str) -> dict:
+    try:
+        with open(manifest_path(path), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'watermark': None, 'parts': [], 'pending': None, 'reconciled': None}
+
+
+def _save_manifest(path: str, manifest: dict):
+    tmp_path = manifest_path(path) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, manifest_path(path))
+
+
+def stack_files(path: str, tickers: Optional[List[str]] = None, start_date=None, end_date=None) -> List[str]:
+    """
+    Base data followed by the committed increments. When the file was
+    migrated to the partitioned layout, only the partitions that can hold
+    `tickers` and the DATETIME range are listed.
+    """
+    if is_partitioned(path):
+        base = partition_files(partitioned_root(path), tickers=tickers, start_date=start_date, end_date=end_date)
+    else:
+        base = [os.path.expanduser(path)]
+    manifest = load_manifest(path)
+    return base + [os.path.join(parts_dir(path), p) for p in manifest['parts']]
+
+
+def write_base(df: pd.DataFrame, path: str):
+    """
+    Rewrite the base data of `path` (in its current layout), drop the
+    increments and rebuild the universe index.
+
+    The new data is written next to the base data and swapped in, so
+    readers and an interrupted rewrite never see a half-written file.
+    """
+    if is_partitioned(path):
+        root = partitioned_root(path)
+        tmp_root = root + '.tmp'
+        write_partitioned(df, tmp_root, n_buckets=read_layout(root)['n_buckets'])
+        replace_dir(tmp_root, root)
+    else:
+        tmp_path = os.path.expanduser(path) + '.tmp'
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, os.path.expanduser(path))
+    reset_increments(path)
+    # 全期間を書き直したので、次の全期間の再取得は reconcile_days 後
+    mark_reconciled(path)
+    write_universe(df, path)
+
+
+def reset_increments(path: str):
+    """Drop the increments, e.g. after the base file was fully rewritten."""
+    shutil.rmtree(parts_dir(path), ignore_errors=True)
+    try:
+        os.remove(manifest_path(path))
+    except FileNotFoundError:
+        pass
+
+
+def mark_reconciled(path: str, when=None):
+    """Record `when` (now by default) as the last time the whole DATETIME range of `path` was queried."""
+    manifest = load_manifest(path)
+    manifest['reconciled'] = str(pd.Timestamp.now() if when is None else pd.Timestamp(when))
+    _save_manifest(path, manifest)
+
+
+def read_watermark(files: List[str]) -> Optional[pd.Timestamp]:
+    """Max RELEASE_TIMESTAMP of `files`, reading that column only."""
+    table = ds.dataset(files, format='parquet').to_table(columns=['RELEASE_TIMESTAMP'])
+    if table.num_rows == 0:
+        return None
+    column = table.column('RELEASE_TIMESTAMP')
+    if not (pa.types.is_timestamp(column.type) or pa.types.is_date(column.type)):
+        return pd.to_datetime(column.to_pandas()).max()
+    value = pc.max(column).as_py()
+    return None if value is None else pd.Timestamp(value)
+
+
+def _write_part(df: pd.DataFrame, base_files: List[str], part_path: str):
+    # 本体と同じスキーマで書き出す
+    schema = ds.dataset(base_files[0], format='parquet').schema
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    fields = [f for f in schema if f.name in table.column_names]
+    table = table.select([f.name for f in fields]).cast(pa.schema(fields))
+
+    tmp_path = part_path + '.tmp'
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, part_path)
+
+
+def _min_datetime(files: List[str]) -> Optional[pd.Timestamp]:
+    table = ds.dataset(files, format='parquet').to_table(columns=['DATETIME'])
+    if table.num_rows == 0:
+        return None
+    return pd.to_datetime(table.column('DATETIME').to_pandas()).min()
+
+
+def reconcile_due(path: str, reconcile_days: Optional[int] = DEFAULT_RECONCILE_DAYS) -> bool:
+    """
+    Whether the next `append_increment` of `path` re-queries the whole
+    DATETIME range: the last full query (write_base or reconcile) is
+    `reconcile_days` old or more, or unknown. Never with None.
+    """
+    if reconcile_days is None:
+        return False
+    reconciled = load_manifest(path).get('reconciled')
+    if reconciled is None:
+        return True
+    return pd.Timestamp.now() - pd.Timestamp(reconciled) >= pd.Timedelta(days=reconcile_days)
+
+
+def _windows(start: Optional[pd.Timestamp], end, first: Optional[pd.Timestamp], window_days: int) -> list:
+    # [start, end] を window_days 日毎の [lo, hi) に区切る (None は下限・上限なし)
+    if first is None:
+        return [[None if start is None else str(start), None if end is None else str(end)]]
+    until = pd.Timestamp.now().normalize() if end is None else pd.Timestamp(end)
+    bounds = [str(b) for b in pd.date_range(first, until, freq=f'{window_days}D')[1:]]
+    lows = [None if start is None else str(start)] + bounds
+    return [list(w) for w in zip(lows, bounds + [None if end is None else str(end)])]
+
+
+def append_increment(
+    path: str,
+    fetch: Callable[[Optional[pd.Timestamp], Optional[pd.Timestamp]], pd.DataFrame],
+    lookback_days: int = DEFAULT_LOOKBACK_DAYS,
+    end_date=None,
+    reconcile_days: Optional[int] = DEFAULT_RECONCILE_DAYS,
+    window_days: int = DEFAULT_WINDOW_DAYS,
+) -> pd.DataFrame:
+    """
+    Fetch the releases newer than the stored watermark and append them to `path`.
+
+    The loaders filter on DATETIME, not on release time, so the query
+    starts `lookback_days` before the watermark and the rows already on
+    disk (released at or before the watermark) are dropped afterwards.
+    Revisions of older DATETIMEs are not in that range: every
+    `reconcile_days` the whole DATETIME range is queried instead (see
+    `reconcile_due`).
+
+    The range is fetched in windows of `window_days` days of DATETIME, each
+    written as its own increment as soon as it arrives. An interrupted run
+    resumes from the first window that was not written.
+
+    Parameters
+    ----------
+    path : str
+        Base stack parquet file. It must already exist, either as is or
+        migrated to the partitioned layout.
+    fetch : Callable
+        Called with the start and end DATETIME of a window (None for no
+        bound, the end is inclusive) and returns the long frame from the loader.
+    lookback_days : int, optional
+        Days of DATETIME to re-query before the watermark, by default 31.
+    end_date : optional
+        Last DATETIME to query. No bound by default.
+    reconcile_days : int, optional
+        Days between the full queries, by default 7. None never runs them.
+    window_days : int, optional
+        Days of DATETIME per fetch, by default 366.
+
+    Returns
+    -------
+    pd.DataFrame
+        Rows appended by this run.
+    """
+    manifest = load_manifest(path)
+    os.makedirs(parts_dir(path), exist_ok=True)
+
+    # 前回の実行が中断されていた場合は、書き終えていない window から再開する
+    pending = manifest.get('pending')
+    if pending and 'windows' not in pending:
+        pending = None
+    if pending is None:
+        watermark = manifest.get('watermark')
+        if watermark is None:
+            watermark = read_watermark(stack_files(path))
+        else:
+            watermark = pd.Timestamp(watermark)
+
+        reconcile = reconcile_due(path, reconcile_days) or watermark is None
+        start_date = None
+        if not reconcile:
+            start_date = (watermark - pd.Timedelta(days=lookback_days)).normalize()
+        first = start_date if start_date is not None else _min_datetime(stack_files(path))
+        pending = {
+            'watermark': None if watermark is None else str(watermark),
+            'reconcile': reconcile,
+            'started': str(pd.Timestamp.now()),
+            'windows': _windows(start_date, end_date, first, window_days),
+            'done': 0,
+        }
+        manifest['pending'] = pending
+        _save_manifest(path, manifest)
+
+    watermark = None if pending['watermark'] is None else pd.Timestamp(pending['watermark'])
+    latest = pending.get('latest')
+    list_new, dfempty = [], None
+    for i in range(pending['done'], len(pending['windows'])):
+        lo, hi = [None if b is None else pd.Timestamp(b) for b in pending['windows'][i]]
+        dfnew = fetch(lo, hi)
+
+        mask = np.ones(len(dfnew), dtype=bool)
+        release = pd.to_datetime(dfnew['RELEASE_TIMESTAMP'])
+        if watermark is not None:
+            mask &= (release > watermark).to_numpy()
+        if hi is not None and i < len(pending['windows']) - 1:
+            # 次の window と重ならないように、境界の日は次の window に入れる
+            dt = pd.to_datetime(dfnew['DATETIME'])
+            mask &= (dt < (hi if dt.dt.tz is None else hi.tz_localize(dt.dt.tz))).to_numpy()
+        dfnew, release = dfnew.loc[mask], release.loc[mask]
+        if dfempty is None:
+            dfempty = dfnew.iloc[:0]
+
+        if not dfnew.empty:
+            # 名前は manifest に登録済みの数で決まるので、登録前に中断されても同じ part を上書きする
+            part = f'part-{len(manifest["parts"]):05d}.parquet'
+            part_path = os.path.join(parts_dir(path), part)
+            _write_part(dfnew, stack_files(path), part_path)
+            manifest['parts'].append(part)
+            latest = str(max(pd.Timestamp(latest), release.max()) if latest else release.max())
+            list_new.append(dfnew)
+
+        # part の登録と window の完了は同じ保存で記録する (再開時に同じ window を再取得して重複させない)
+        pending['done'] = i + 1
+        pending['latest'] = latest
+        _save_manifest(path, manifest)
+        if not dfnew.empty:
+            # ここで中断されても universe は signature が合わなくなり、次の読込・追記で作り直される
+            update_universe(dfnew, path, [part_path])
+
+    if latest is not None:
+        manifest['watermark'] = latest
+    elif watermark is not None:
+        manifest['watermark'] = str(watermark)
+    if pending['reconcile']:
+        manifest['reconciled'] = pending['started']
+    manifest['pending'] = None
+    _save_manifest(path, manifest)
+    if not list_new:
+        return pd.DataFrame() if dfempty is None else dfempty
+    return pd.concat(list_new, axis=0)
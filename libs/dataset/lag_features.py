@@ -0,0 +1,96 @@
+from typing import Iterable, Optional
+
+import pandas as pd
+
+from .utils import shifted_resample_weekly
+
+
+def _is_weekly(rule: str) -> bool:
+    offset = pd.tseries.frequencies.to_offset(rule)
+    return isinstance(offset, pd.offsets.Week) and offset.weekday is not None and offset.n == 1
+
+
+def build_lag_features(
+    sdh,
+    data_id_alt: int,
+    lags: Iterable[int] = range(0, 9),
+    rule: str = 'W',
+    func: str = 'mean',
+    sma_periods: int = 12,
+    diff_periods: int = 52,
+    fields: Optional[list] = None,
+):
+    """
+    Build lagged, smoothed and log-differenced variants of the alt data.
+
+    Same features as the chains
+    ``shift(lag).resample(rule, func).sma(sma_periods).log_diff(diff_periods)``
+    (lag 0 is ``resample(rule, func).log_diff(diff_periods)``, not smoothed):
+    the shift is in raw rows of the alt data, before resampling. For a weekly
+    `rule` and a mean / sum `func`, the shifted weekly values of every lag are
+    computed in one pass from the cumulative sums of the raw rows
+    (`shifted_resample_weekly`) and registered as one dataset, and the
+    moving average and the log difference are applied by the handler.
+    Otherwise (another rule or func, or a negative lag) each lag runs its
+    own chain.
+
+    The one-pass path registers that dataset with `sdh.set_raw_data`
+    (aliased 'shift(...).resample(...) of <data_id_alt>'), so the data IDs
+    assigned afterwards are one higher than with the chains. Do not rely on
+    hard-coded data IDs after calling this function.
+
+    Parameters
+    ----------
+    sdh : StdDataHandler
+        Data handler for managing the dataset.
+    data_id_alt : int
+        Data ID of the alt data.
+    lags : Iterable[int], optional
+        Lags in rows of the alt data, by default 0 to 8.
+    rule : str, optional
+        Resample rule, by default 'W'.
+    func : str, optional
+        Resample function, by default 'mean'.
+    sma_periods : int, optional
+        Window of the moving average of the lagged series, by default 12.
+    diff_periods : int, optional
+        Periods of the log difference, by default 52.
+    fields : list, optional
+        Fields of the alt data. All fields by default.
+
+    Returns
+    -------
+    (dict, dict)
+        Variable IDs of the lagged series and of their log differences,
+        keyed by lag.
+    """
+    lags = list(lags)
+    shifted = [lag for lag in lags if lag != 0]
+    shift_ids = {}
+    if 0 in lags:
+        shift_ids[0] = sdh.transform.resample(data_id=data_id_alt, fields=fields, rule=rule, func=func).variable_ids
+
+    if shifted and func in ('mean', 'sum') and _is_weekly(rule) and min(shifted) > 0:
+        dfalt = sdh.get_variables(sdh.transform.raw(data_id=data_id_alt, fields=fields).variable_ids)
+        by, level = dfalt.index.names[:2]
+        dfshift = shifted_resample_weekly(dfalt, shifted, how=func, rule=rule, level=level, by=by)
+        dfshift.columns = [f'{c}_shift{lag}' for lag, c in dfshift.columns]
+
+        # shift(lag).resample(rule, func) を 1 つのデータとして登録し、sma は handler で計算する
+        data_id = sdh.set_raw_data(dfshift)
+        sdh.set_alias({data_id: f'shift({",".join(map(str, shifted))}).resample({rule}, {func}) of {data_id_alt}'})
+        sma_ids = sdh.transform.sma(data_id=data_id, periods=sma_periods).variable_ids
+        n = len(dfalt.columns)
+        for i, lag in enumerate(shifted):
+            shift_ids[lag] = sma_ids[i * n:(i + 1) * n]
+    else:
+        for lag in shifted:
+            shift_ids[lag] = sdh.transform.shift(data_id=data_id_alt, fields=fields, periods=lag).resample(
+                rule=rule, func=func).sma(periods=sma_periods).variable_ids
+
+    shift_ids = {lag: shift_ids[lag] for lag in lags}
+    logdiff_ids = {
+        lag: sdh.transform.log_diff(fields=ids, periods=diff_periods).variable_ids
+        for lag, ids in shift_ids.items()
+    }
+    return shift_ids, logdiff_ids
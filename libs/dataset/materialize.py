@@ -0,0 +1,83 @@
+import os
+import json
+import threading
+from typing import Callable, List, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ..storage import DEFAULT_ROW_GROUP_SIZE
+from ..instrument import event
+from .universe import SIGNATURE_KEY, source_signature, read_signature
+
+
+# 集計済みデータ (<file>.<name>.parquet)。
+# 元ファイル (stack_files) のパス・サイズ・更新時刻を signature として metadata に持ち、変わっていれば作り直す。
+
+def materialized_path(path: str, name: str) -> str:
+    return f'{os.path.expanduser(path)}.{name}.parquet'
+
+
+def materialize(
+    path: str,
+    name: str,
+    build: Callable[[List[str]], pd.DataFrame],
+    sort_by: Optional[List[str]] = None,
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+) -> Union[str, pd.DataFrame]:
+    """
+    Path of an up-to-date materialized view of the stack data of `path`.
+
+    The view is rebuilt with `build(files)` when it does not exist or when
+    the base file or an increment of `path` was added, removed, resized or
+    modified since it was written. It is written sorted by `sort_by`, so
+    filters on the leading column (e.g. TICKER) read only the matching
+    row groups.
+
+    Parameters
+    ----------
+    path : str
+        Base stack parquet file (see `stack_files`).
+    name : str
+        Name of the view, the file is <path>.<name>.parquet.
+    build : Callable
+        Called with the source files and returns the long frame to store.
+    sort_by : list of str, optional
+        Columns to sort the rows by before writing.
+    row_group_size : int, optional
+        Rows per row group, by default 256K.
+
+    Returns
+    -------
+    str or pd.DataFrame
+        Path of the view, or the built frame itself when the view could
+        not be written (e.g. read-only directory, disk full).
+    """
+    from .incremental import stack_files
+
+    files = stack_files(path)
+    signature = source_signature(files)
+    mpath = materialized_path(path, name)
+    if read_signature(mpath) == signature:
+        return mpath
+
+    df = build(files)
+    if sort_by:
+        df = df.sort_values(sort_by, kind='stable', ignore_index=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = {**(table.schema.metadata or {}), SIGNATURE_KEY: json.dumps(signature).encode()}
+    table = table.replace_schema_metadata(metadata)
+
+    tmp_path = f'{mpath}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        pq.write_table(table, tmp_path, row_group_size=row_group_size)
+        os.replace(tmp_path, mpath)
+    except (OSError, pa.ArrowException) as e:
+        # 書き込めない場合は集計結果をそのまま使う
+        event('materialize_failed', f'could not write {mpath}: {e}', path=mpath)
+        return df
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return mpath
@@ -0,0 +1,84 @@
+import os
+import argparse
+
+import pyarrow.dataset as ds
+
+from . import aiq_pos_csmr_goods as csmr_goods
+from . import aiq_pos_elec_goods as elec_goods
+from . import aiq_pos_retailer as retailer
+from . import aiq_retailer_weekly as retailer_weekly
+from . import aiq_geolocation as geolocation
+from .incremental import stack_files, reset_increments, load_manifest, mark_reconciled
+from .universe import write_universe
+from ..path import DEFAULT_DIR
+from ..storage import (
+    partitioned_root, is_partitioned, write_partitioned, replace_dir,
+    DEFAULT_N_BUCKETS, DEFAULT_ROW_GROUP_SIZE
+)
+
+
+STACK_FILES = [
+    csmr_goods.FILE_NAME_GEN1,
+    csmr_goods.FILE_NAME_GEN2,
+    elec_goods.FILE_NAME,
+    retailer.FILE_NAME,
+    retailer_weekly.FILE_NAME,
+    geolocation.GEO_FILE_NAME,
+]
+
+
+def migrate_file(
+    path: str,
+    n_buckets: int = DEFAULT_N_BUCKETS,
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    remove_source: bool = False,
+):
+    """
+    Rewrite a single-file dataset (and its increments) into the partitioned layout.
+
+    The new dataset is written next to the final location and swapped in,
+    so readers never see a half-written dataset.
+    """
+    table = ds.dataset(stack_files(path), format='parquet').to_table()
+
+    root = partitioned_root(path)
+    tmp_root = root + '.tmp'
+    write_partitioned(table, tmp_root, n_buckets=n_buckets, row_group_size=row_group_size)
+    replace_dir(tmp_root, root)
+
+    # 差分は本体に取り込んだので消すが、最後に全期間を取得した日時は引き継ぐ
+    reconciled = load_manifest(path).get('reconciled')
+    reset_increments(path)
+    if reconciled is not None:
+        mark_reconciled(path, reconciled)
+    write_universe(table, path)
+    if remove_source and os.path.exists(path):
+        os.remove(path)
+    return root
+
+
+def migrate(
+    data_dir: str = DEFAULT_DIR,
+    n_buckets: int = DEFAULT_N_BUCKETS,
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    remove_source: bool = False,
+):
+    data_dir = os.path.expanduser(data_dir)
+    for file_name in STACK_FILES:
+        path = os.path.join(data_dir, file_name)
+        if not (os.path.exists(path) or is_partitioned(path)):
+            print(f'skip {file_name} (not found)')
+            continue
+        root = migrate_file(path, n_buckets=n_buckets, row_group_size=row_group_size, remove_source=remove_source)
+        print(f'{file_name} -> {root}')
+
+
+if __name__ == '__main__':
+    # python -m libs.dataset.migrate --data-dir /efs/share/factset/pattaya/sample/jupyter/
+    parser = argparse.ArgumentParser(description='Migrate the *_stack.parquet files to the partitioned layout.')
+    parser.add_argument('--data-dir', default=DEFAULT_DIR)
+    parser.add_argument('--n-buckets', type=int, default=DEFAULT_N_BUCKETS)
+    parser.add_argument('--row-group-size', type=int, default=DEFAULT_ROW_GROUP_SIZE)
+    parser.add_argument('--remove-source', action='store_true')
+    args = parser.parse_args()
+    migrate(args.data_dir, args.n_buckets, args.row_group_size, args.remove_source)
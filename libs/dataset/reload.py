@@ -1,24 +1,28 @@
+import os
 from functools import reduce, partial
 import pandas as pd
 
 from . import aiq_pos_csmr_goods as csmr_goods
 from . import aiq_pos_elec_goods as elec_goods
 from . import aiq_pos_retailer as retailer
+from .universe import universe_tickers
+from ..path import DEFAULT_DIR
 
 def cmr_goods_read_file():
     a, b = csmr_goods.read_file()
     return pd.concat([a, b], axis=0)
 
-def get_alt_tickers():
-    f_alt_l = [
-        cmr_goods_read_file,
-        elec_goods.read_file,
-        retailer.read_file,
+def get_alt_tickers(data_dir=DEFAULT_DIR):
+    # 各データセットの銘柄一覧 (universe index) の和集合。index がなければ TICKER 列のみ読む
+    file_names = [
+        csmr_goods.FILE_NAME_GEN1,
+        csmr_goods.FILE_NAME_GEN2,
+        elec_goods.FILE_NAME,
+        retailer.FILE_NAME,
     ]
-    alt_result_g = map(lambda f: set(f()['TICKER'].unique()), f_alt_l)
+    alt_result_g = map(lambda f: set(universe_tickers(os.path.join(data_dir, f))), file_names)
     all_ticker = reduce(
         lambda a, b: a | b,
         alt_result_g
     )
     return sorted(all_ticker)
-
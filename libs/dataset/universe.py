@@ -0,0 +1,152 @@
+import os
+import json
+from typing import List, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+UNIVERSE_SUFFIX = '.universe.parquet'
+UNIVERSE_COLUMNS = ['FIRST_DATETIME', 'LAST_DATETIME', 'ROWS', 'LAST_RELEASE_TIMESTAMP']
+SIGNATURE_KEY = b'aiq_source_signature'
+
+
+# *_stack.parquet 毎の銘柄一覧 (<file>.universe.parquet)。
+# 銘柄毎の DATETIME の範囲・行数・最新の RELEASE_TIMESTAMP を持ち、write_base / append_increment で更新する。
+# 作成時の元ファイル (stack_files) の signature を metadata に持ち、元ファイルと合わない index は使わない。
+
+def universe_path(path: str) -> str:
+    return os.path.expanduser(path) + UNIVERSE_SUFFIX
+
+
+def summarize_universe(df: Union[pd.DataFrame, pa.Table]) -> pd.DataFrame:
+    """Per-ticker summary of a long frame with TICKER / DATETIME (/ RELEASE_TIMESTAMP)."""
+    if isinstance(df, pa.Table):
+        names = [c for c in ['TICKER', 'DATETIME', 'RELEASE_TIMESTAMP'] if c in df.column_names]
+        df = df.select(names).to_pandas(ignore_metadata=True)
+    elif 'TICKER' not in df.columns:
+        df = df.reset_index()
+
+    data = pd.DataFrame({'TICKER': df['TICKER'].to_numpy()})
+    for src in ['DATETIME', 'RELEASE_TIMESTAMP']:
+        data[src] = pd.to_datetime(df[src].to_numpy()) if src in df.columns else pd.NaT
+
+    summary = data.groupby('TICKER').agg(
+        FIRST_DATETIME=('DATETIME', 'min'),
+        LAST_DATETIME=('DATETIME', 'max'),
+        ROWS=('TICKER', 'size'),
+        LAST_RELEASE_TIMESTAMP=('RELEASE_TIMESTAMP', 'max'),
+    )
+    return summary
+
+
+def _merge_universe(*summaries: pd.DataFrame) -> pd.DataFrame:
+    merged = pd.concat(summaries).groupby(level='TICKER').agg({
+        'FIRST_DATETIME': 'min',
+        'LAST_DATETIME': 'max',
+        'ROWS': 'sum',
+        'LAST_RELEASE_TIMESTAMP': 'max',
+    })
+    return merged[UNIVERSE_COLUMNS]
+
+
+def source_signature(files: List[str]) -> list:
+    """(path, size, mtime) of each source file; raises OSError if one is missing."""
+    signature = []
+    for f in files:
+        st = os.stat(os.path.expanduser(f))
+        signature.append([f, st.st_size, st.st_mtime_ns])
+    return signature
+
+
+def read_signature(upath: str) -> Optional[list]:
+    """Signature the parquet file `upath` was built from, or None."""
+    try:
+        metadata = pq.read_schema(upath).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    value = metadata.get(SIGNATURE_KEY)
+    return None if value is None else json.loads(value)
+
+
+def _signature(path: str) -> Optional[list]:
+    from .incremental import stack_files
+
+    try:
+        return source_signature(stack_files(path))
+    except OSError:
+        return None
+
+
+def _save_universe(summary: pd.DataFrame, path: str, signature: Optional[list] = None):
+    table = pa.Table.from_pandas(summary)
+    signature = _signature(path) if signature is None else signature
+    metadata = {**(table.schema.metadata or {}), SIGNATURE_KEY: json.dumps(signature).encode()}
+    tmp_path = universe_path(path) + '.tmp'
+    pq.write_table(table.replace_schema_metadata(metadata), tmp_path)
+    os.replace(tmp_path, universe_path(path))
+
+
+def read_universe(path: str) -> Optional[pd.DataFrame]:
+    """
+    Universe index of `path`, or None when it has not been written or when
+    the files of `path` were added, removed, resized or modified since.
+    """
+    upath = universe_path(path)
+    if not os.path.exists(upath):
+        return None
+    signature = read_signature(upath)
+    if signature is None or signature != _signature(path):
+        return None
+    return pd.read_parquet(upath)
+
+
+def write_universe(df: Union[pd.DataFrame, pa.Table], path: str) -> pd.DataFrame:
+    """Replace the universe index of `path` with the summary of its full data `df`."""
+    summary = summarize_universe(df)
+    _save_universe(summary, path)
+    return summary
+
+
+def update_universe(dfnew: pd.DataFrame, path: str, added_files: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Add the rows `dfnew` just appended to `path` (as the files `added_files`)
+    to its universe index. When the index does not exist or was not made
+    from the other files, it is built from the files (which already hold `dfnew`).
+    """
+    upath = universe_path(path)
+    signature = _signature(path)
+    added = set(added_files or [])
+    before = None if signature is None else [s for s in signature if s[0] not in added]
+    if not os.path.exists(upath) or before is None or read_signature(upath) != before:
+        return build_universe(path)
+    summary = _merge_universe(pd.read_parquet(upath), summarize_universe(dfnew))
+    _save_universe(summary, path, signature)
+    return summary
+
+
+def build_universe(path: str) -> pd.DataFrame:
+    """Build the universe index of `path` reading only its key columns."""
+    from .incremental import stack_files
+
+    dataset = ds.dataset(stack_files(path), format='parquet')
+    columns = [c for c in ['TICKER', 'DATETIME', 'RELEASE_TIMESTAMP'] if c in dataset.schema.names]
+    return write_universe(dataset.to_table(columns=columns), path)
+
+
+def universe_tickers(path: str) -> List[str]:
+    """
+    Tickers of `path` from its universe index, falling back to a scan of
+    the TICKER column when the index does not exist or is stale.
+    """
+    summary = read_universe(path)
+    if summary is not None:
+        return summary.index.tolist()
+
+    from .incremental import stack_files
+
+    column = ds.dataset(stack_files(path), format='parquet').to_table(columns=['TICKER']).column('TICKER')
+    return pc.unique(column).to_pylist()
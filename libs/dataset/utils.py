@@ -1,14 +1,508 @@
+from typing import Callable, List, Optional, Union
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from ..instrument import instrument, stage
 
 
 # For formatting data taken from Snowflake database
-def format_pos(df):
-    df['DATETIME'] = pd.to_datetime(df['DATETIME'])
-    df['RELEASE_TIMESTAMP'] = pd.to_datetime(df['RELEASE_TIMESTAMP'])
-    df.set_index(['TICKER', 'DATETIME', 'VARIABLE', 'SMOOTH', 'RELEASE_TIMESTAMP'], inplace=True)
-    df = df.xs(0, level='SMOOTH').drop(['BACKFILL'], axis=1)
-    df = df.sort_index()
-    df.reset_index('RELEASE_TIMESTAMP', drop=False, inplace=True)
-    df = df.loc[~df.index.duplicated(keep='last')]
-    df.drop(['RELEASE_TIMESTAMP'], axis=1, inplace=True)
-    return df.unstack('VARIABLE')['VALUE'].sort_index()
+@instrument()
+def format_pos(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert the long POS stack into a wide TICKER x DATETIME frame.
+
+    Only SMOOTH == 0 rows are used, and for each (TICKER, DATETIME, VARIABLE)
+    the value with the latest RELEASE_TIMESTAMP is kept. The input frame is
+    not modified.
+    """
+    df = df.loc[(df['SMOOTH'] == 0).to_numpy(), ['TICKER', 'DATETIME', 'VARIABLE', 'RELEASE_TIMESTAMP', 'VALUE']]
+
+    tk_codes, tk_uniques = pd.factorize(df['TICKER'], sort=True)
+    dt_codes, dt_uniques = pd.factorize(pd.to_datetime(df['DATETIME']), sort=True)
+    var_codes, var_uniques = pd.factorize(df['VARIABLE'], sort=True)
+    valid = (tk_codes >= 0) & (dt_codes >= 0) & (var_codes >= 0)
+
+    n_dt, n_var = len(dt_uniques), len(var_uniques)
+    row_key = tk_codes.astype(np.int64) * n_dt + dt_codes
+    key = row_key * n_var + var_codes
+
+    # 同一キー内で最新の RELEASE_TIMESTAMP (NaT は最後に並ぶため最新扱い) の最後の行を残す
+    release = pd.to_datetime(df['RELEASE_TIMESTAMP']).to_numpy(dtype='datetime64[ns]').view(np.int64).copy()
+    release[release == np.iinfo(np.int64).min] = np.iinfo(np.int64).max
+    latest = pd.Series(release).groupby(key, sort=False).transform('max').to_numpy()
+    candidates = np.flatnonzero((release == latest) & valid)
+    keep = candidates[~pd.Series(key[candidates]).duplicated(keep='last').to_numpy()]
+
+    row_codes, rows = pd.factorize(row_key[keep], sort=True)
+    values = df['VALUE'].to_numpy()[keep]
+    if len(keep) == len(rows) * n_var:
+        out = np.empty((len(rows), n_var), dtype=values.dtype)
+    else:
+        dtype = values.dtype if values.dtype.kind in 'fc' else np.float64 if values.dtype.kind in 'iub' else object
+        out = np.full((len(rows), n_var), np.nan, dtype=dtype)
+    out[row_codes, var_codes[keep]] = values
+
+    index = pd.MultiIndex(
+        levels=[tk_uniques, dt_uniques],
+        codes=[rows // n_dt, rows % n_dt],
+        names=['TICKER', 'DATETIME'],
+        verify_integrity=False,
+    )
+    columns = pd.Index(var_uniques, name='VARIABLE')
+    return pd.DataFrame(out, index=index, columns=columns)
+
+
+def _convert_values(values: pd.Index, f_ticker_cvt) -> list:
+    if isinstance(f_ticker_cvt, (dict, pd.Series)):
+        converted = values.map(f_ticker_cvt)
+        # 対応表にないティッカーはそのまま残す
+        return list(converted.where(converted.notna(), values))
+    # 呼び出し間ではキャッシュしない (対応表を参照する関数は結果が変わり得る)
+    return [f_ticker_cvt(v) for v in values]
+
+
+@instrument()
+def convert_tickers(
+    df: pd.DataFrame,
+    f_ticker_cvt: Union[Callable[[str], str], dict, pd.Series],
+    level: str = 'TICKER',
+) -> pd.DataFrame:
+    """
+    Convert the tickers of the `level` index level.
+
+    The converter is applied only to the unique level values and the index
+    is rebuilt from the level codes, so the cost scales with the number of
+    tickers rather than the number of rows. `f_ticker_cvt` is either a
+    callable, called once per unique ticker on every call, or a dict /
+    Series mapping, e.g. built from the symbol lookup table. Tickers missing
+    from a mapping are left unchanged. Returns a new frame sharing the data
+    of `df`; `df` is not modified.
+    """
+    index = df.index
+    i = index.names.index(level)
+    out = df.copy(deep=False)
+    if not isinstance(index, pd.MultiIndex):
+        out.index = pd.Index(_convert_values(index, f_ticker_cvt), name=index.name)
+        return out
+
+    new_codes, new_level = pd.factorize(
+        pd.Index(_convert_values(index.levels[i], f_ticker_cvt)), sort=True)
+    old_codes = index.codes[i]
+    codes = list(index.codes)
+    codes[i] = np.where(old_codes < 0, -1, new_codes[old_codes])
+    levels = list(index.levels)
+    levels[i] = new_level
+
+    out.index = pd.MultiIndex(levels=levels, codes=codes, names=index.names, verify_integrity=False)
+    return out
+
+
+# 空の週に入る値 (それ以外の集計は NaN)
+_EMPTY_BIN_FILL = {'sum': 0, 'count': 0, 'size': 0}
+
+
+def _week_bins(dt: pd.DatetimeIndex, weekday: int, closed: str, label: str) -> np.ndarray:
+    # 各行が属する週のラベル (1970-01-01 からの日数)
+    days = dt.normalize().as_unit('s').asi8 // 86400
+    dayofweek = (days + 3) % 7   # 1970-01-01 は木曜日
+    if closed == 'right':
+        # (前のアンカー日, アンカー日] : アンカー日中の時刻もその週に入る
+        bins = days + (weekday - dayofweek) % 7
+        return bins - 7 if label == 'left' else bins
+    bins = days - (dayofweek - weekday) % 7
+    return bins + 7 if label == 'right' else bins
+
+
+@instrument()
+def resample_weekly(
+    df: pd.DataFrame,
+    how: Union[str, dict] = 'mean',
+    rule: str = 'W',
+    level: str = 'DATETIME',
+    by: str = 'TICKER',
+    closed: str = 'right',
+    label: str = 'right',
+) -> pd.DataFrame:
+    """
+    Weekly resample of every ticker in one grouped reduction.
+
+    Same output as ``df.groupby(by).resample(rule, level=level, closed=closed,
+    label=label).agg(how)``, including the empty weeks between the first and
+    last week of each ticker (0 for sum / count, NaN otherwise), but the week
+    of each row is computed once with integer arithmetic and all tickers are
+    aggregated together instead of resampling ticker by ticker.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Frame indexed by (`by`, `level`) with a datetime `level`.
+    how : str or dict, optional
+        Aggregation of every column, or a dict of column -> aggregation
+        (only these columns are returned, in this order), by default 'mean'.
+    rule : str, optional
+        Anchored weekly frequency, by default 'W' (weeks ending on Sunday).
+    closed, label : str, optional
+        Side of the bins that is closed / used as label, by default 'right'.
+
+    Returns
+    -------
+    pd.DataFrame
+        Indexed by (`by`, `level`) with the week labels.
+    """
+    how = dict(how) if isinstance(how, dict) else {c: how for c in df.columns}
+    rows, pos, n_weeks, index = _weekly_layout(df, rule, level, by, closed, label)
+    data = df.iloc[rows][list(how)]
+    data.index = pos
+    grouped = data.groupby(level=0, sort=True)
+
+    n_out = int(n_weeks.sum())
+    out = {}
+    for func in dict.fromkeys(how.values()):
+        columns = [c for c, f in how.items() if f == func]
+        agg = grouped[columns].agg(func)
+        fill = _EMPTY_BIN_FILL.get(func, np.nan)
+        for c in columns:
+            values = agg[c].to_numpy()
+            dtype = values.dtype if fill == 0 or values.dtype.kind in 'fcmM' else np.float64
+            filled = np.full(n_out, fill, dtype=dtype)
+            filled[agg.index.to_numpy()] = values
+            out[c] = filled
+    return pd.DataFrame(out, index=index, columns=pd.Index(list(how), name=df.columns.name))
+
+
+def _weekly_layout(df: pd.DataFrame, rule: str, level: str, by: str, closed: str, label: str):
+    # resample_weekly の出力の並び:
+    # (ティッカー・時刻順の行番号, 各行の出力週の位置, ティッカー毎の週数, 出力の index)
+    offset = pd.tseries.frequencies.to_offset(rule)
+    if not isinstance(offset, pd.offsets.Week) or offset.weekday is None or offset.n != 1:
+        raise ValueError(f'rule must be an anchored weekly frequency such as W-SUN, got {rule}')
+
+    dt = pd.DatetimeIndex(df.index.get_level_values(level))
+    tz = dt.tz
+    if tz is not None:
+        dt = dt.tz_localize(None)
+    tk_values = df.index.get_level_values(by)
+    valid = ~(dt.isna() | tk_values.isna())
+    tk_codes, tickers = pd.factorize(tk_values[valid], sort=True)
+    bins = _week_bins(dt[valid], offset.weekday, closed, label)
+
+    # ティッカー毎の最初の週から最後の週までを出力する
+    first = np.full(len(tickers), np.iinfo(np.int64).max)
+    last = np.full(len(tickers), np.iinfo(np.int64).min)
+    np.minimum.at(first, tk_codes, bins)
+    np.maximum.at(last, tk_codes, bins)
+    n_weeks = (last - first) // 7 + 1
+    starts = np.cumsum(n_weeks) - n_weeks
+    pos = starts[tk_codes] + (bins - first[tk_codes]) // 7
+
+    # resample と同じくティッカー内では時刻順に集計する
+    rows = np.flatnonzero(valid)
+    order = np.lexsort((dt[valid].asi8, tk_codes))
+    if not (order == np.arange(len(order))).all():
+        rows, pos = rows[order], pos[order]
+
+    n_out = int(n_weeks.sum())
+    out_tk = np.repeat(np.arange(len(tickers)), n_weeks)
+    out_days = first[out_tk] + 7 * (np.arange(n_out) - starts[out_tk])
+    dt_codes, weeks = pd.factorize(out_days, sort=True)
+    weeks = pd.DatetimeIndex(weeks.astype('datetime64[D]')).as_unit(dt.unit)
+    if tz is not None:
+        weeks = weeks.tz_localize(tz)
+    index = pd.MultiIndex(
+        levels=[tickers, weeks], codes=[out_tk, dt_codes], names=[by, level], verify_integrity=False)
+    return rows, pos, n_weeks, index
+
+
+@instrument()
+def shifted_resample_weekly(
+    df: pd.DataFrame,
+    lags,
+    how: str = 'mean',
+    rule: str = 'W',
+    level: str = 'DATETIME',
+    by: str = 'TICKER',
+    closed: str = 'right',
+    label: str = 'right',
+) -> pd.DataFrame:
+    """
+    Weekly mean (or sum) of every column shifted by each of `lags` rows.
+
+    Same output as ``df.groupby(by).shift(lag)`` followed by
+    ``resample_weekly(..., how)`` for every lag, but all lags are computed
+    in one pass from the per-ticker cumulative sums and counts of the raw
+    rows: the shifted sum of a week [a, b) is cumsum[b - lag] - cumsum[a - lag]
+    (clipped at the first row of the ticker).
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Frame indexed by (`by`, `level`) with a datetime `level`.
+    lags : Iterable[int]
+        Non-negative shifts in rows of `df`.
+    how : str, optional
+        'mean' or 'sum', by default 'mean'.
+    rule, closed, label : str, optional
+        As in `resample_weekly`.
+
+    Returns
+    -------
+    pd.DataFrame
+        Indexed by (`by`, `level`) with the week labels, with one column per
+        (lag, column of `df`), lag first.
+    """
+    if how not in ('mean', 'sum'):
+        raise ValueError(f'how must be mean or sum, got {how}')
+    lags = list(lags)
+    if any(lag < 0 for lag in lags):
+        raise ValueError('lags must be non-negative')
+    rows, pos, n_weeks, index = _weekly_layout(df, rule, level, by, closed, label)
+
+    values = df.iloc[rows].to_numpy(dtype=np.float64)
+    notna = ~np.isnan(values)
+    zeros = np.zeros((1, values.shape[1]))
+    csum = np.vstack([zeros, np.cumsum(np.where(notna, values, 0.0), axis=0)])
+    ccount = np.vstack([zeros, np.cumsum(notna, axis=0)])
+
+    # 各週の行範囲 [a, b) と、その週のティッカーの先頭行 g
+    n_out = int(n_weeks.sum())
+    a = np.searchsorted(pos, np.arange(n_out), side='left')
+    b = np.searchsorted(pos, np.arange(n_out), side='right')
+    tk_rows = np.searchsorted(pos, np.cumsum(n_weeks) - n_weeks, side='left')
+    g = np.repeat(tk_rows, n_weeks)
+
+    blocks = []
+    for lag in lags:
+        lo = np.maximum(a - lag, g)
+        hi = np.maximum(b - lag, g)
+        total = csum[hi] - csum[lo]
+        if how == 'sum':
+            blocks.append(total)
+            continue
+        count = ccount[hi] - ccount[lo]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            blocks.append(np.where(count > 0, total / np.maximum(count, 1), np.nan))
+    columns = pd.MultiIndex.from_product([lags, df.columns], names=['lag', df.columns.name])
+    return pd.DataFrame(np.hstack(blocks) if blocks else np.empty((n_out, 0)), index=index, columns=columns)
+
+
+@instrument()
+def canonical_index(
+    df: pd.DataFrame,
+    names: List[str] = ['TICKER', 'DATETIME'],
+    drop_null_tickers: bool = True,
+    sort: bool = True,
+) -> pd.DataFrame:
+    """
+    Normalize a (ticker, datetime) indexed frame to the layout the handler expects.
+
+    The index levels are renamed to `names` (and reordered when they already
+    have these names in another case or order), the datetime level is converted
+    to naive datetime64[ns] (tz-aware values keep their local time), rows with
+    a null ticker are dropped and the index is sorted. Only the level values
+    and codes are rewritten; the data columns are copied solely when rows have
+    to be dropped or reordered. The input frame is not modified.
+
+    Tickers that `convert_tickers` mapped to None become null and are
+    dropped here; pass `drop_null_tickers=False` to keep them.
+    """
+    upper = {str(c).upper(): c for c in df.columns}
+    if not isinstance(df.index, pd.MultiIndex) and all(n in upper for n in names):
+        df = df.set_index([upper[n] for n in names])
+
+    index = df.index
+    if index.nlevels != len(names):
+        raise ValueError(f'expected {len(names)} index levels, got {index.names}')
+    level_names = [str(n).upper() for n in index.names]
+    if level_names != list(names) and sorted(level_names) == sorted(names):
+        index = index.reorder_levels([level_names.index(n) for n in names])
+
+    levels = list(index.levels)
+    codes = list(index.codes)
+    dt_level = levels[-1]
+    if dt_level.dtype != 'datetime64[ns]':
+        # 変換で同じ値になる要素があり得るため levels を作り直す
+        dt_level = pd.DatetimeIndex(pd.to_datetime(dt_level))
+        if dt_level.tz is not None:
+            dt_level = dt_level.tz_localize(None)
+        new_codes, new_level = pd.factorize(dt_level.as_unit('ns'), sort=True)
+        codes[-1] = np.where(codes[-1] < 0, -1, new_codes[codes[-1]])
+        levels[-1] = new_level
+
+    out = df.copy(deep=False)
+    out.index = pd.MultiIndex(levels=levels, codes=codes, names=names, verify_integrity=False)
+
+    if drop_null_tickers:
+        valid = codes[0] >= 0
+        if not valid.all():
+            out = out.iloc[np.flatnonzero(valid)]
+    if sort and not out.index.is_monotonic_increasing:
+        out = out.sort_index()
+    return out
+
+
+def group_starts(codes: np.ndarray) -> np.ndarray:
+    """Positions where a new group begins in an array of contiguous group codes."""
+    return np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+
+
+def grouped_shift(values: np.ndarray, codes: np.ndarray, periods: int = 1) -> np.ndarray:
+    """
+    Shift `values` (1d, or 2d with one column per series) by `periods` rows
+    within each contiguous group of `codes` (same as groupby(codes).shift(periods)
+    for rows sorted by group).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full_like(values, np.nan)
+    if periods == 0:
+        return values.copy()
+    n = abs(periods)
+    if n >= len(values):
+        return out
+    if periods > 0:
+        same = codes[n:] == codes[:-n]
+        if values.ndim == 2:
+            same = same[:, None]
+        out[n:] = np.where(same, values[:-n], np.nan)
+    else:
+        same = codes[:-n] == codes[n:]
+        if values.ndim == 2:
+            same = same[:, None]
+        out[:-n] = np.where(same, values[n:], np.nan)
+    return out
+
+
+def _as_list(values) -> Optional[list]:
+    if values is None:
+        return None
+    if isinstance(values, (str, int)):
+        return [values]
+    return list(values)
+
+
+def _is_temporal(pa_type) -> bool:
+    return pa.types.is_timestamp(pa_type) or pa.types.is_date(pa_type)
+
+
+def _datetime_scalar(value, pa_type):
+    value = pd.Timestamp(value)
+    if pa.types.is_date(pa_type):
+        return pa.scalar(value.date(), type=pa_type)
+    if pa_type.tz is not None and value.tz is None:
+        value = value.tz_localize(pa_type.tz)
+    return pa.scalar(value.to_pydatetime(), type=pa.timestamp('us', tz=pa_type.tz)).cast(pa_type)
+
+
+def filter_stack(
+    df: pd.DataFrame,
+    tickers: Optional[List[str]] = None,
+    start_date=None,
+    end_date=None,
+    variables: Optional[List[str]] = None,
+    smooth: Optional[Union[int, List[int]]] = None,
+) -> pd.DataFrame:
+    """
+    Filter a long (stack) frame in memory. Same conditions as `read_stack`,
+    used when the data did not come from a parquet file.
+    """
+    mask = pd.Series(True, index=df.index)
+    if tickers is not None:
+        mask &= df['TICKER'].isin(_as_list(tickers))
+    if variables is not None and 'VARIABLE' in df.columns:
+        mask &= df['VARIABLE'].isin(_as_list(variables))
+    if smooth is not None and 'SMOOTH' in df.columns:
+        mask &= df['SMOOTH'].isin(_as_list(smooth))
+    if start_date is not None or end_date is not None:
+        dt = pd.to_datetime(df['DATETIME'])
+        if start_date is not None:
+            mask &= dt >= pd.Timestamp(start_date)
+        if end_date is not None:
+            mask &= dt <= pd.Timestamp(end_date)
+    if mask.all():
+        return df
+    return df.loc[mask]
+
+
+@instrument()
+def read_stack(
+    path: Union[str, List[str]],
+    tickers: Optional[List[str]] = None,
+    start_date=None,
+    end_date=None,
+    variables: Optional[List[str]] = None,
+    smooth: Optional[Union[int, List[int]]] = None,
+    columns: Optional[List[str]] = None,
+    partitioning: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Read a long (stack) parquet dataset with the filters pushed into the scan.
+
+    Row groups whose statistics do not match `tickers`, the DATETIME range,
+    `variables` or `smooth` are skipped, and only `columns` are decoded.
+
+    Parameters
+    ----------
+    path : str or list of str
+        Parquet file, directory, or list of files.
+    tickers : list of str, optional
+        Values of the TICKER column to keep.
+    start_date, end_date : optional
+        Inclusive range of the DATETIME column.
+    variables : list of str, optional
+        Values of the VARIABLE column to keep.
+    smooth : int or list of int, optional
+        Values of the SMOOTH column to keep.
+    columns : list of str, optional
+        Columns to read. All columns are read by default.
+    partitioning : str, optional
+        Partitioning flavor of a directory dataset, e.g. 'hive'.
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    dataset = ds.dataset(path, format='parquet', partitioning=partitioning)
+    schema = dataset.schema
+
+    conditions = []
+    if tickers is not None:
+        conditions.append(pc.field('TICKER').isin(_as_list(tickers)))
+    if variables is not None and 'VARIABLE' in schema.names:
+        conditions.append(pc.field('VARIABLE').isin(_as_list(variables)))
+    if smooth is not None and 'SMOOTH' in schema.names:
+        conditions.append(pc.field('SMOOTH').isin(_as_list(smooth)))
+
+    # 文字列で保存されている場合は読込後に絞り込む
+    post_dates = False
+    if start_date is not None or end_date is not None:
+        dt_type = schema.field('DATETIME').type
+        if _is_temporal(dt_type):
+            if start_date is not None:
+                conditions.append(pc.field('DATETIME') >= _datetime_scalar(start_date, dt_type))
+            if end_date is not None:
+                conditions.append(pc.field('DATETIME') <= _datetime_scalar(end_date, dt_type))
+        else:
+            post_dates = True
+
+    expr = None
+    for cond in conditions:
+        expr = cond if expr is None else expr & cond
+
+    read_columns = columns
+    if columns is not None and post_dates and 'DATETIME' not in columns:
+        read_columns = list(columns) + ['DATETIME']
+
+    with stage('scan') as st:
+        table = dataset.to_table(columns=read_columns, filter=expr)
+        st.update(rows_out=table.num_rows)
+        st.files_read(dataset.files)
+    df = table.to_pandas()
+
+    if post_dates:
+        df = filter_stack(df, start_date=start_date, end_date=end_date)
+        if read_columns is not columns:
+            df = df.drop(columns=['DATETIME'])
+    return df
@@ -1,39 +1,224 @@
+import logging
+import itertools
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
 import pandas as pd
-from typing import List
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ..instrument import instrument, event
+
+
+DEFAULT_CHUNK_SIZE = 200
+DEFAULT_BATCH_SIZE = 10_000
+
+DATE_FIELD = 'fiscal_quarter_last_date'
+
+# 変換できない値の割合がこれを超えるフィールドはエラーにする (型の指定漏れ)
+DEFAULT_MAX_COERCED_RATIO = 0.05
+
+logger = logging.getLogger(__name__)
+
+
+def _query(tickers: List[str], from_year: int) -> dict:
+    return {
+        'seccode': {'$in': tickers},
+        'fiscal_year': {'$gte': from_year},
+        'is_latest': 1,
+        'num_month': 3,
+        'consolidated_flag': 1
+    }
+
+
+def _projection(fields: List[str]) -> dict:
+    proj = {'_id': 0, 'seccode': 1, 'fiscal_quarter_last_date': 1}
+    for fld in fields:
+        proj[fld] = 1
+    return proj
+
+
+def fundamental_schema(fields: List[str], field_types: Optional[Dict[str, pa.DataType]] = None) -> pa.Schema:
+    """Schema of the download; fields are float64 unless given in `field_types`."""
+    field_types = field_types or {}
+    return pa.schema(
+        [('ticker', pa.string()), ('datetime', pa.timestamp('ns'))]
+        + [(fld, field_types.get(fld, pa.float64())) for fld in fields])
+
+
+def _to_record_batch(
+        docs: List[dict],
+        schema: pa.Schema,
+        coerced: Optional[Counter] = None,
+        seen: Optional[Counter] = None,
+) -> pa.RecordBatch:
+    # ドキュメントを列毎の配列に変換する (dict のリストは batch_size 件までしか保持しない)
+    # 日付・数値に変換できない値は NaT / NaN になり、フィールド毎に `coerced` に数える
+    raw = pd.Series([d.get(DATE_FIELD) for d in docs], dtype=object)
+    dates = pd.to_datetime(raw.astype(str), format='%Y%m%d', errors='coerce')
+    counts = {DATE_FIELD: int((raw.notna() & dates.isna()).sum())}
+    totals = {DATE_FIELD: int(raw.notna().sum())}
+    arrays = [
+        pa.array([d.get('seccode') for d in docs], type=pa.string()),
+        pa.array(dates.to_numpy(dtype='datetime64[ns]'), type=pa.timestamp('ns')),
+    ]
+    for field in list(schema)[2:]:
+        fld = field.name
+        raw = pd.Series([d.get(fld) for d in docs], dtype=object)
+        totals[fld] = int(raw.notna().sum())
+        if pa.types.is_string(field.type):
+            # コード・フラグ等はそのまま文字列で持つ
+            arrays.append(pa.array([None if v is None else str(v) for v in raw], type=field.type))
+        elif pa.types.is_floating(field.type):
+            values = pd.to_numeric(raw, errors='coerce')
+            counts[fld] = int((raw.notna() & values.isna()).sum())
+            arrays.append(pa.array(values.to_numpy(dtype='float64'), type=field.type, from_pandas=True))
+        else:
+            # その他の型は変換できなければエラーにする
+            arrays.append(pa.array(raw.tolist(), type=field.type))
+    if coerced is not None:
+        coerced.update({fld: n for fld, n in counts.items() if n})
+    if seen is not None:
+        seen.update(totals)
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
 
-from asr_protected.utils.myfunctools import compose
 
+def iter_fundamental_batches(
+        col,
+        tickers: List[str],
+        from_year: int = 2008,
+        fields: List[str] = ['sales'],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        coerced: Optional[Counter] = None,
+        field_types: Optional[Dict[str, pa.DataType]] = None,
+        seen: Optional[Counter] = None,
+) -> Iterator[pa.RecordBatch]:
+    """
+    Stream the quarterly statements of `tickers` as Arrow record batches.
+
+    The fields are stored as float64 (or their type in `field_types`) and
+    the quarter end as a timestamp; values that cannot be converted to
+    float64 / timestamp become NaN / NaT and are counted per field in
+    `coerced` when given. `seen` counts the non-null values per field.
+    """
+    schema = fundamental_schema(fields, field_types)
+    cursor = col.find(_query(list(tickers), from_year), _projection(fields), batch_size=batch_size)
+    while True:
+        docs = list(itertools.islice(cursor, batch_size))
+        if not docs:
+            break
+        yield _to_record_batch(docs, schema, coerced, seen)
+
+
+@instrument()
 def download_fundamental(
         mongo_conn_str: str,    # e.g. xxxxx.com:1234
         tickers: List[str],
         from_year: int = 2008,
         fields: List[str] = ['sales'],
-) -> pd.DataFrame:
-    from pymongo import MongoClient
-    
-    conn = MongoClient(mongo_conn_str)
-    col = conn['TRDB']['QUARTERLY_FIN_STMT']
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        max_workers: int = 4,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        output_path: Optional[str] = None,
+        client=None,
+        field_types: Optional[Dict[str, pa.DataType]] = None,
+        max_coerced_ratio: Optional[float] = DEFAULT_MAX_COERCED_RATIO,
+) -> Optional[pd.DataFrame]:
+    """
+    Download the quarterly statements of `tickers` from TRDB.
 
-    proj = {'_id': 0, 'seccode': 1, 'fiscal_quarter_last_date': 1}
-    for fld in fields:
-        proj[fld] = 1
+    Tickers are queried in chunks of `chunk_size` over a pooled client with
+    `max_workers` threads, and each cursor is consumed `batch_size` documents
+    at a time and converted to Arrow record batches. Fields are float64
+    unless typed in `field_types` (e.g. pa.string() for codes and flags).
+    Values of float64 fields that are not numbers (or dates for
+    fiscal_quarter_last_date) are stored as NaN / NaT and their number per
+    field is logged as a warning; when they are more than
+    `max_coerced_ratio` of the values of a field, ValueError is raised.
+
+    Parameters
+    ----------
+    mongo_conn_str : str
+        Connection string of the MongoDB server.
+    tickers : List[str]
+    from_year : int, optional
+        First fiscal year, by default 2008.
+    fields : List[str], optional
+        Numeric fields to download, by default ['sales'].
+    chunk_size : int, optional
+        Tickers per query, by default 200.
+    max_workers : int, optional
+        Concurrent queries, by default 4.
+    batch_size : int, optional
+        Documents per record batch, by default 10,000.
+    output_path : str, optional
+        When given, the batches are written to this parquet file as they
+        arrive and nothing is returned.
+    client : optional
+        MongoClient compatible object used instead of connecting to
+        `mongo_conn_str`.
+    field_types : dict, optional
+        Arrow type of the fields that are not float64, e.g.
+        {'accounting_standard': pa.string()}.
+    max_coerced_ratio : float, optional
+        Largest share of the values of a field that may be coerced to
+        NaN / NaT, by default 0.05. None never raises.
+
+    Returns
+    -------
+    pd.DataFrame or None
+        `fields` indexed by (ticker, datetime), or None with `output_path`.
+    """
+    if client is None:
+        from pymongo import MongoClient
+        client = MongoClient(mongo_conn_str, maxPoolSize=max_workers)
+    col = client['TRDB']['QUARTERLY_FIN_STMT']
+
+    tickers = list(tickers)
+    chunks = [tickers[i:i + chunk_size] for i in range(0, len(tickers), chunk_size)]
+    schema = fundamental_schema(fields, field_types)
+
+    writer = pq.ParquetWriter(output_path, schema) if output_path else None
+    lock = threading.Lock()
+
+    def fetch(chunk):
+        batches, coerced, seen = [], Counter(), Counter()
+        for batch in iter_fundamental_batches(
+                col, chunk, from_year, fields, batch_size, coerced, field_types, seen):
+            if writer is None:
+                batches.append(batch)
+                continue
+            with lock:
+                writer.write_batch(batch)
+        return batches, coerced, seen
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(fetch, chunks))
+    finally:
+        if writer is not None:
+            writer.close()
+
+    coerced = sum((c for _, c, _ in results), Counter())
+    seen = sum((s for _, _, s in results), Counter())
+    if coerced:
+        logger.warning(
+            'values not convertible to the column type were stored as NaN/NaT: '
+            + ', '.join(f'{fld}={n}' for fld, n in coerced.items()))
+        event('fundamental_coerced', **{f'coerced_{fld}': n for fld, n in coerced.items()})
+        if max_coerced_ratio is not None:
+            too_many = [fld for fld, n in coerced.items() if n > max_coerced_ratio * seen[fld]]
+            if too_many:
+                raise ValueError(
+                    f'more than {max_coerced_ratio:.0%} of the values of {", ".join(too_many)} '
+                    'are not numbers; give their type in field_types')
+
+    if writer is not None:
+        return None
 
-    df = compose(pd.DataFrame, list, col.find)(
-        {
-            'seccode': {'$in': tickers},
-            'fiscal_year': {'$gte': from_year},
-            'is_latest': 1,
-            'num_month': 3,
-            'consolidated_flag': 1
-        },
-        proj
-    )
-    if not df.empty:
-        df.rename(
-            columns={
-                'fiscal_quarter_last_date': 'datetime',
-                'seccode': 'ticker'},
-            inplace=True)
-        df['datetime'] = pd.to_datetime(df['datetime'], format='%Y%m%d')
+    table = pa.Table.from_batches(list(itertools.chain.from_iterable(b for b, _, _ in results)), schema=schema)
+    df = table.to_pandas()
     df = df.set_index(['ticker', 'datetime'])
     return df
@@ -1,43 +1,154 @@
 import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
-from typing import List
+import pyarrow.parquet as pq
+from typing import List, Optional
+
+from ..instrument import instrument, event
 
 
 current_file_path = os.path.abspath(__file__)
 current_dir, filename = os.path.split(current_file_path)
 
 
-def download_market_from_mongo(
-        mongo_conn_str: str,    # e.g. xxxxx.com:1234,
-        tickers: List[str]) -> pd.DataFrame:
-
-    from pymongo import MongoClient
-    conn = MongoClient(mongo_conn_str)
-    col = conn['plugatrade']['market_data']
-    df = pd.DataFrame(col.find(
-            {'seccode': {'$in': tickers}},
-            {'_id': 0, 'seccode': 1, 'datetime': 1, 'close': 1}
-        ))
+def _to_utc(value) -> pd.Timestamp:
+    # 日本時間の日時を DB 上の UTC (naive) に変換する
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize('Japan')
+    return ts.tz_convert('UTC').tz_localize(None)
+
+
+def _end_of_day(value) -> pd.Timestamp:
+    # 日付のみの end_date はその日の終わりまで (15:00 の日足を含める)
+    ts = pd.Timestamp(value)
+    if ts == ts.normalize():
+        ts = ts + pd.Timedelta(days=1) - pd.Timedelta(microseconds=1)
+    return ts
+
+
+def _datetime_filter(start_date=None, end_date=None) -> dict:
+    cond = {}
+    if start_date is not None:
+        cond['$gte'] = _to_utc(start_date).to_pydatetime()
+    if end_date is not None:
+        cond['$lte'] = _to_utc(_end_of_day(end_date)).to_pydatetime()
+    return cond
+
+
+def _market_collection(mongo_conn_str: str, client=None):
+    if client is None:
+        from pymongo import MongoClient
+        client = MongoClient(mongo_conn_str)
+    return client['plugatrade']['market_data']
+
+
+def _find_market(col, query: dict) -> pd.DataFrame:
+    df = pd.DataFrame(
+        list(col.find(query, {'_id': 0, 'seccode': 1, 'datetime': 1, 'close': 1})),
+        columns=['seccode', 'datetime', 'close'])
     df = df.rename({'seccode': 'ticker'}, axis=1)
-    df['datetime'] = df['datetime'].apply(
-        lambda x: x.tz_localize('UTC').tz_convert('Japan').tz_localize(None))
+    df['datetime'] = pd.DatetimeIndex(pd.to_datetime(df['datetime'])) \
+        .tz_localize('UTC').tz_convert('Japan').tz_localize(None)
     df = df.set_index(["ticker", "datetime"])
     return df
 
 
+@instrument()
+def download_market_from_mongo(
+        mongo_conn_str: str,    # e.g. xxxxx.com:1234,
+        tickers: List[str],
+        start_date=None,
+        end_date=None,
+        client=None) -> pd.DataFrame:
+    """
+    Close prices of `tickers`, indexed by (ticker, datetime) in Japan time.
+    `start_date` / `end_date` (Japan time, inclusive) are pushed into the query;
+    a date-only `end_date` includes the bar of that day.
+    """
+    col = _market_collection(mongo_conn_str, client)
+    query = {'seccode': {'$in': list(tickers)}}
+    cond = _datetime_filter(start_date, end_date)
+    if cond:
+        query['datetime'] = cond
+    return _find_market(col, query)
 
 
-def download_market_from_influx(
-        conf_path: str, 
-        tickers: list, 
-        start_date=None, 
-        end_date=None, 
-):
+def last_market_dates(path: str) -> pd.Series:
+    """Last stored datetime of each ticker in the local store at `path`."""
+    if not os.path.exists(path):
+        return pd.Series(dtype='datetime64[ns]')
+    df = pq.read_table(path, columns=['ticker', 'datetime']).to_pandas(ignore_metadata=True)
+    return df.groupby('ticker')['datetime'].max()
+
+
+@instrument()
+def sync_market_from_mongo(
+        mongo_conn_str: str,
+        tickers: List[str],
+        path: str,
+        start_date=None,
+        end_date=None,
+        client=None) -> pd.DataFrame:
+    """
+    Download only the new close prices of `tickers` and merge them into the
+    local parquet store at `path`.
+
+    Without `start_date`, each ticker is queried from its last stored
+    datetime (tickers not in the store from the beginning), so a daily
+    refresh only moves the latest day. Rows already stored are overwritten
+    by the downloaded ones.
+
+    Returns
+    -------
+    pd.DataFrame
+        Downloaded rows, indexed by (ticker, datetime).
+    """
+    col = _market_collection(mongo_conn_str, client)
+    tickers = list(tickers)
+
+    if start_date is not None:
+        query = {'seccode': {'$in': tickers}, 'datetime': _datetime_filter(start_date, end_date)}
+    else:
+        # 最終日付が同じ銘柄をまとめて、銘柄毎の日付条件を1クエリにする
+        last = last_market_dates(path).reindex(tickers)
+        conds = []
+        new_tickers = list(last.index[last.isna()])
+        if new_tickers:
+            conds.append({'seccode': {'$in': new_tickers}})
+        stored = last.dropna()
+        for last_date, group in stored.groupby(stored):
+            conds.append({'seccode': {'$in': list(group.index)}, 'datetime': _datetime_filter(last_date)})
+        if end_date is not None:
+            for cond in conds:
+                cond.setdefault('datetime', {}).update(_datetime_filter(end_date=end_date))
+        query = {'$or': conds} if conds else {'seccode': {'$in': []}}
+
+    dfnew = _find_market(col, query)
+
+    if os.path.exists(path):
+        dfold = pd.read_parquet(path)
+        dfold = dfold[~dfold.index.isin(dfnew.index)]
+        dfall = pd.concat([dfold, dfnew]).sort_index()
+    else:
+        dfall = dfnew.sort_index()
+
+    tmp_path = path + '.tmp'
+    dfall.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+    return dfnew
+
+
+INFLUX_FIELDS = ['open', 'high', 'low', 'close', 'volume']
+
+
+@instrument()
+def _download_influx_batch(conf_path: str, tickers: list, start_date=None, end_date=None):
     # 価格データの更新を行う場合は、README
     from load_data_from_influxdb.TRIN_price_data_handler import TRINPriceLoader as TRIN
 
-    list_tickers = list(tickers)
     sample_instance = TRIN({
             'config_file' : os.path.join(conf_path, 'influx_config.yml'),
             'start': start_date,
@@ -47,25 +158,141 @@ def download_market_from_influx(
             'market_hour_definition': os.path.join(conf_path, 'market_hours.yml')
         })
 
-    sample_instance.run(list_tickers, ['open', 'high', 'low', 'close', 'volume'], switch_split=True)
+    sample_instance.run(list(tickers), INFLUX_FIELDS, switch_split=True)
     retval = sample_instance.retrieve('all', start_date, end_date, 'raw')
 
+    empty_list = [tk for tk, df in retval.items() if df.empty]
+    frames = {tk: df for tk, df in retval.items() if not df.empty}
+    if not frames:
+        return None, empty_list
+
+    # 銘柄毎のループをせず、まとめて (TICKER, DATETIME) の index にする
+    dfout = pd.concat(frames, names=['TICKER'], sort=False)
+    datetimes = dfout.index.get_level_values(1)
+    if datetimes.tz is not None:
+        datetimes = datetimes.tz_localize(None)
+    dfout.index = pd.MultiIndex.from_arrays(
+        [dfout.index.get_level_values(0), datetimes], names=['TICKER', 'DATETIME'])
+    return dfout, empty_list
+
+
+def _download_influx_tickers(conf_path: str, tickers: list, start_date=None, end_date=None):
+    # バッチ全体が失敗した場合は1銘柄ずつ取り直し、失敗した銘柄のみを failed にする
+    try:
+        df, empty_list = _download_influx_batch(conf_path, tickers, start_date, end_date)
+        return df, empty_list, {}
+    except Exception as e:
+        if len(tickers) == 1:
+            return None, [], {tickers[0]: f'{type(e).__name__}: {e}'}
+
+    frames, empty_list, failed = [], [], {}
+    for tk in tickers:
+        df, empty, failed_tk = _download_influx_tickers(conf_path, [tk], start_date, end_date)
+        if df is not None:
+            frames.append(df)
+        empty_list.extend(empty)
+        failed.update(failed_tk)
+    dfout = pd.concat(frames, axis=0, sort=False) if frames else None
+    return dfout, empty_list, failed
+
+
+@instrument()
+def download_market_from_influx(
+        conf_path: str, 
+        tickers: list, 
+        start_date=None, 
+        end_date=None, 
+        batch_size: int = 200,
+        max_workers: int = 4,
+        output_dir: Optional[str] = None,
+        return_summary: bool = False,
+):
+    """
+    Download daily OHLCV of `tickers` from InfluxDB.
+
+    Tickers are split into batches of `batch_size`, each loaded by its own
+    TRINPriceLoader on `max_workers` threads. The batches are collected in
+    the order of `tickers`, so the output does not depend on which thread
+    ends first. A batch that fails is retried one ticker at a time and
+    only the tickers that fail again are reported as failed.
+
+    Parameters
+    ----------
+    conf_path : str
+        Directory of influx_config.yml and market_hours.yml.
+    tickers : list
+    start_date, end_date : optional
+    batch_size : int, optional
+        Tickers per loader, by default 200.
+    max_workers : int, optional
+        Concurrent loaders, by default 4.
+    output_dir : str, optional
+        When given, each batch is written to a partitioned dataset (see
+        `libs.storage.write_partitioned`) as soon as it arrives and no frame
+        is returned, so memory is bounded by the running batches. The
+        dataset is staged next to `output_dir` and replaces it only when
+        the download ends; a non-empty `output_dir` that is not a
+        partitioned dataset raises ValueError.
+    return_summary : bool, optional
+        Also return a dict with the `empty` tickers, the `failed` tickers
+        (ticker -> reason), and the number of `rows` and `batches`.
+
+    Returns
+    -------
+    pd.DataFrame or None, or (pd.DataFrame or None, dict)
+    """
+    from ..storage import write_partitioned, replace_dir, check_replaceable
+
+    tmp_dir = None
+    if output_dir is not None:
+        output_dir = os.path.expanduser(output_dir).rstrip(os.sep)
+        check_replaceable(output_dir)
+        tmp_dir = f'{output_dir}.{os.getpid()}.tmp'
+
+    list_tickers = list(tickers)
+    batches = [list_tickers[i:i + batch_size] for i in range(0, len(list_tickers), batch_size)]
+
     list_outputs = []
-    empty_list = []
-    for tk, df in retval.items():
-
-        if df.empty:
-            empty_list.append(tk)
-            continue
-
-        df.index = df.index.tz_localize(None)
-        df.index.names = ['DATETIME']
-        df['TICKER'] = tk
-        df = df.set_index('TICKER', append=True).swaplevel(0, 1)
-        list_outputs.append(df)
-    dfout = pd.concat(list_outputs, axis=0, sort=False)
-
-    if empty_list:
-        print(f'empty list is {", ".join(empty_list)}.')
-    
-    return dfout
\ No newline at end of file
+    summary = {'empty': [], 'failed': {}, 'rows': 0, 'batches': len(batches)}
+    written = False
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_download_influx_tickers, conf_path, batch, start_date, end_date)
+                for batch in batches
+            ]
+            # 投入順に受け取る (完了順だと実行毎に行の並びが変わる)
+            for future in futures:
+                df, empty_list, failed = future.result()
+                summary['failed'].update(failed)
+                summary['empty'].extend(empty_list)
+                if df is None:
+                    continue
+
+                summary['rows'] += len(df)
+                if output_dir is None:
+                    list_outputs.append(df)
+                else:
+                    write_partitioned(df, tmp_dir, append=written)
+                    written = True
+        # 全バッチを書き終えてから差し替える (何も取れなければ既存のデータを残す)
+        if written:
+            replace_dir(tmp_dir, output_dir)
+    finally:
+        if tmp_dir is not None and os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    dfout = None
+    if output_dir is None:
+        dfout = pd.concat(list_outputs, axis=0, sort=False) if list_outputs else pd.DataFrame()
+
+    event('influx_summary', rows=summary['rows'], batches=summary['batches'],
+          empty=len(summary['empty']), failed=len(summary['failed']))
+    if summary['empty']:
+        print(f'empty list is {", ".join(summary["empty"])}.')
+    if summary['failed']:
+        print(f'failed list is {", ".join(summary["failed"])}.')
+
+    if return_summary:
+        return dfout, summary
+    return dfout
@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import time
+import threading
+import functools
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+ENV_INSTRUMENT = 'AIQ_INSTRUMENT'
+ENV_INSTRUMENT_PATH = 'AIQ_INSTRUMENT_PATH'
+
+RECORD_COLUMNS = [
+    'kind', 'stage', 'name', 'parent', 'start', 'seconds', 'peak_rss_delta',
+    'rows_in', 'rows_out', 'bytes_read', 'error', 'message', 'thread',
+]
+
+# 記録済みのレコード (instrumented() / AIQ_INSTRUMENT=1 の間のみ追加される)。
+# 長いセッションで増え続けないよう直近の MAX_RECORDS 件のみ保持する
+MAX_RECORDS = 10_000
+_RECORDS = deque(maxlen=MAX_RECORDS)
+_LOCK = threading.Lock()
+
+# instrumented() の各ブロックが集めるレコードと出力先
+_COLLECTORS = []
+_local = threading.local()
+
+
+def instrument_enabled() -> bool:
+    if _COLLECTORS:
+        return True
+    return os.environ.get(ENV_INSTRUMENT, '0').lower() not in ('0', 'false', 'off', '')
+
+
+def _max_rss() -> Optional[int]:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS は byte
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _stack() -> list:
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _emit(record: dict):
+    with _LOCK:
+        _RECORDS.append(record)
+        paths = [c['path'] for c in _COLLECTORS if c['path']]
+        for c in _COLLECTORS:
+            c['records'].append(record)
+        env_path = os.environ.get(ENV_INSTRUMENT_PATH)
+        if env_path:
+            paths.append(env_path)
+        if paths:
+            line = json.dumps(record, default=str)
+            for path in dict.fromkeys(os.path.expanduser(p) for p in paths):
+                with open(path, 'a') as f:
+                    f.write(line + '\n')
+
+
+class Stage:
+    """Counters of a running stage; set them with `update`."""
+
+    def __init__(self, name: str, fields: dict):
+        self.name = name
+        self.fields = {'rows_in': None, 'rows_out': None, 'bytes_read': None, **fields}
+
+    def update(self, **fields):
+        self.fields.update(fields)
+
+    def files_read(self, paths):
+        """Add the size of the local files `paths` to bytes_read."""
+        size = file_size(paths)
+        if size is not None:
+            self.fields['bytes_read'] = (self.fields['bytes_read'] or 0) + size
+
+    def __enter__(self) -> 'Stage':
+        stack = _stack()
+        self.parent = stack[-1] if stack else None
+        self.path = f'{self.parent.path}/{self.name}' if self.parent else self.name
+        stack.append(self)
+        self._start = time.time()
+        self._st = time.perf_counter()
+        self._rss = _max_rss()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._st
+        rss = _max_rss()
+        _stack().pop()
+        _emit({
+            'kind': 'stage',
+            'stage': self.path,
+            'name': self.name,
+            'parent': self.parent.path if self.parent else None,
+            'start': pd.Timestamp(self._start, unit='s').isoformat(),
+            'seconds': seconds,
+            'peak_rss_delta': None if rss is None else rss - self._rss,
+            'error': None if exc_type is None else f'{exc_type.__name__}: {exc}',
+            'thread': threading.current_thread().name,
+            **self.fields,
+        })
+        return False
+
+
+class _NullStage:
+    # 無効時に使う何もしない Stage
+    def update(self, **fields):
+        pass
+
+    def files_read(self, paths):
+        pass
+
+    def __enter__(self) -> '_NullStage':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name: str, **fields):
+    """
+    Context manager that records one stage of a loader.
+
+    When instrumentation is enabled, the wall time, the growth of the peak
+    RSS of the process, the counters set with `update` or `files_read`
+    (rows_in, rows_out, bytes_read, or any other field) and the error, if
+    any, are recorded on exit. Stages opened inside another one are
+    recorded with the path of their parents, e.g.
+    'aiq_pos_elec_goods.register_elec_goods_data/set_raw_data'. When it is disabled, a shared
+    no-op object is returned.
+
+        with stage('read') as st:
+            df = pd.read_parquet(path)
+            st.update(rows_out=len(df))
+            st.files_read(path)
+    """
+    if not instrument_enabled():
+        return _NULL_STAGE
+    return Stage(name, fields)
+
+
+def _n_rows(value) -> Optional[int]:
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, tuple):
+        sizes = [_n_rows(v) for v in value]
+        sizes = [n for n in sizes if n is not None]
+        return sum(sizes) if sizes else None
+    return None
+
+
+def instrument(name: Optional[str] = None):
+    """
+    Decorator recording each call of the function as a stage, named
+    '<module>.<function>' by default (e.g. 'aiq_pos_elec_goods.reload').
+    rows_in is the length of the first argument and rows_out that of the
+    result when they are frames.
+    """
+    def decorator(f: Callable):
+        stage_name = name or f'{f.__module__.rsplit(".", 1)[-1]}.{f.__qualname__}'
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not instrument_enabled():
+                return f(*args, **kwargs)
+            with Stage(stage_name, {'rows_in': _n_rows(args[0]) if args else None}) as st:
+                result = f(*args, **kwargs)
+                st.update(rows_out=_n_rows(result))
+                return result
+        return wrapper
+    return decorator
+
+
+def event(name: str, message: Optional[str] = None, **fields):
+    """
+    Record a point event (e.g. a fallback to the loader) in the current stage.
+    The message is printed as before, whether or not the instrumentation is enabled.
+    """
+    if message:
+        print(message)
+    if not instrument_enabled():
+        return
+    stack = _stack()
+    _emit({
+        'kind': 'event',
+        'stage': stack[-1].path if stack else None,
+        'name': name,
+        'start': pd.Timestamp.now().isoformat(),
+        'message': message,
+        'thread': threading.current_thread().name,
+        **fields,
+    })
+
+
+@contextmanager
+def instrumented(path: Optional[str] = None):
+    """
+    Enable the instrumentation in the block (without AIQ_INSTRUMENT=1).
+
+    Yields the list of the records made in the block; they are also
+    appended to `path` as JSON lines when given.
+
+        with instrumented() as recs:
+            register_elec_goods_data(sdh)
+        records_frame(recs)
+    """
+    collector = {'path': path, 'records': []}
+    with _LOCK:
+        _COLLECTORS.append(collector)
+    try:
+        yield collector['records']
+    finally:
+        with _LOCK:
+            _COLLECTORS.remove(collector)
+
+
+def records() -> List[dict]:
+    """Records of this session (the last MAX_RECORDS; use a path or `instrumented()` to keep all)."""
+    with _LOCK:
+        return list(_RECORDS)
+
+
+def records_frame(recs: Optional[List[dict]] = None) -> pd.DataFrame:
+    """Records (those of `records()` by default) as a DataFrame."""
+    recs = records() if recs is None else recs
+    df = pd.DataFrame(recs)
+    columns = [c for c in RECORD_COLUMNS if c in df.columns]
+    return df[columns + [c for c in df.columns if c not in columns]]
+
+
+def write_records(path: str, recs: Optional[List[dict]] = None):
+    """Write records (those of `records()` by default) as JSON lines."""
+    recs = records() if recs is None else recs
+    with open(os.path.expanduser(path), 'w') as f:
+        for record in recs:
+            f.write(json.dumps(record, default=str) + '\n')
+
+
+def clear_records():
+    with _LOCK:
+        _RECORDS.clear()
+
+
+def file_size(paths) -> Optional[int]:
+    """Total size of the local files `paths` (for bytes_read); None if one is missing."""
+    if isinstance(paths, str):
+        paths = [paths]
+    try:
+        return sum(os.path.getsize(os.path.expanduser(p)) for p in paths)
+    except OSError:
+        return None
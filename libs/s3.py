@@ -6,16 +6,51 @@ from io import BytesIO
 from asr_protected.data_accessor.s3_accessor import read_s3_file
 from asr_common.strage.output import output_df_to_s3
 
+from .cache import DiskCache, cache_enabled, default_cache
+from .instrument import instrument
+
 
 s3 = boto3.client('s3')
 
-def read_s3(bucket, filename):
-    return read_s3_file(s3, bucket, filename)
+# ローカルディスク上のキャッシュ (AIQ_S3_CACHE=0 で無効化)。最初に使う時に作る
+_s3_cache = None
+
+
+def get_s3_cache() -> DiskCache:
+    global _s3_cache
+    if _s3_cache is None:
+        _s3_cache = default_cache()
+    return _s3_cache
+
+
+@instrument()
+def read_s3(bucket, filename, use_cache: bool = True):
+    if not (use_cache and cache_enabled()):
+        return read_s3_file(s3, bucket, filename)
+
+    try:
+        head = s3.head_object(Bucket=bucket, Key=filename)
+    except Exception:
+        # メタデータが取得できない場合はキャッシュを使わない
+        return read_s3_file(s3, bucket, filename)
+
+    version = {
+        'etag': head.get('ETag'),
+        'last_modified': str(head.get('LastModified')),
+    }
+    return get_s3_cache().get(
+        f's3://{bucket}/{filename}', version,
+        lambda: read_s3_file(s3, bucket, filename))
+
+
+def s3_cache_stats() -> dict:
+    return get_s3_cache().stats()
 
 
+@instrument()
 def to_s3(df, bucket, filename):
     output_df_to_s3(df, bucket=bucket, filename=filename, pkeys=['TICKER', 'DATETIME'])
 
 
 DEFAULT_BUCKET = 'aiq-trial-data'
-DEFAULT_DIR = ''
\ No newline at end of file
+DEFAULT_DIR = ''
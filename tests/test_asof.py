@@ -0,0 +1,56 @@
+import pandas as pd
+
+from libs.dataset.asof import AsOfStore
+from libs.dataset.utils import format_pos
+
+
+def _stack():
+    # 1301 sales は 01-03 に公表され 01-05 に改訂、7203 は 01-04 に初公表
+    return pd.DataFrame({
+        'TICKER': ['1301', '1301', '1301', '7203', '1301'],
+        'DATETIME': pd.to_datetime(['2024-01-01', '2024-01-01', '2024-01-01', '2024-01-01', '2024-01-02']),
+        'VARIABLE': ['sales', 'sales', 'count', 'sales', 'sales'],
+        'SMOOTH': [0, 0, 0, 0, 7],
+        'RELEASE_TIMESTAMP': pd.to_datetime(['2024-01-03', '2024-01-05', '2024-01-03', '2024-01-04', '2024-01-03']),
+        'VALUE': [1.0, 2.0, 10.0, 5.0, 99.0],
+    })
+
+
+def _value(df, ticker, variable, dt='2024-01-01'):
+    return df.loc[(ticker, pd.Timestamp(dt)), variable]
+
+
+def test_snapshot_before_any_release_is_empty():
+    snap = AsOfStore(_stack()).snapshot('2024-01-02 23:59')
+    assert snap.empty
+
+
+def test_snapshot_includes_a_release_at_the_as_of_time():
+    store = AsOfStore(_stack())
+    snap = store.snapshot('2024-01-03')
+    assert _value(snap, '1301', 'sales') == 1.0
+    assert _value(snap, '1301', 'count') == 10.0
+    assert '7203' not in snap.index.get_level_values('TICKER')
+
+    snap = store.snapshot('2024-01-04')
+    assert _value(snap, '7203', 'sales') == 5.0
+
+
+def test_snapshot_follows_revisions():
+    store = AsOfStore(_stack())
+    assert _value(store.snapshot('2024-01-04 23:59'), '1301', 'sales') == 1.0
+    assert _value(store.snapshot('2024-01-05'), '1301', 'sales') == 2.0
+    pd.testing.assert_frame_equal(store.snapshot(None), format_pos(_stack()))
+
+
+def test_snapshots_match_snapshot():
+    store = AsOfStore(_stack())
+    as_ofs = pd.to_datetime(['2024-01-01', '2024-01-03', '2024-01-04', '2024-01-05', '2024-01-10'])
+    snaps = store.snapshots(as_ofs)
+    # 公表前の時点は行を持たない
+    assert pd.Timestamp('2024-01-01') not in snaps.index.get_level_values('AS_OF')
+    for as_of in as_ofs[1:]:
+        expected = store.snapshot(as_of)
+        result = snaps.xs(as_of, level='AS_OF').dropna(axis=1, how='all')
+        result = result.loc[result.notna().any(axis=1)]
+        pd.testing.assert_frame_equal(result, expected)
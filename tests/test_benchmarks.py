@@ -0,0 +1,23 @@
+import os
+import sys
+import json
+import subprocess
+
+RUN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks', 'run.py')
+
+
+def test_benchmarks_run_on_a_tiny_dataset(tmp_path):
+    # スタブの DAL を使うので pytest とは別プロセスで実行する
+    output = tmp_path / 'results.json'
+    subprocess.run(
+        [sys.executable, RUN, '--size', 'small', '--tickers', '5', '--days', '60',
+         '--repeat', '1', '--warmup', '0', '--output', str(output)],
+        check=True, capture_output=True,
+    )
+    with open(output) as f:
+        results = json.load(f)['results']
+    listed = subprocess.run([sys.executable, RUN, '--list'], check=True, capture_output=True, text=True)
+    assert [r['name'] for r in results] == listed.stdout.split()
+    for r in results:
+        assert r['rows_in'] > 0
+        assert r['seconds'] > 0
@@ -0,0 +1,126 @@
+import os
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from libs.cache import DiskCache
+
+
+def _frame(n=100, seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.MultiIndex.from_product(
+        [['1301', '7203'], pd.date_range('2024-01-01', periods=n // 2)], names=['TICKER', 'DATETIME'])
+    return pd.DataFrame({'returns': rng.normal(size=n), 'name': 'x'}, index=index)
+
+
+class Loader:
+    def __init__(self, obj):
+        self.obj = obj
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.obj
+
+
+def test_hit_after_miss_is_stored_as_parquet(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    loader = Loader(_frame())
+    first = cache.get('s3://b/k', {'etag': '1'}, loader)
+    second = cache.get('s3://b/k', {'etag': '1'}, loader)
+
+    assert loader.calls == 1
+    pd.testing.assert_frame_equal(second, first)
+    assert any(f.endswith('.parquet') for f in os.listdir(tmp_path))
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_new_version_reloads(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    cache.get('s3://b/k', {'etag': '1'}, Loader(_frame(seed=0)))
+    loader = Loader(_frame(seed=1))
+    out = cache.get('s3://b/k', {'etag': '2'}, loader)
+    assert loader.calls == 1
+    pd.testing.assert_frame_equal(out, _frame(seed=1))
+
+
+def test_other_objects_are_pickled(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    loader = Loader({'a': [1, 2]})
+    cache.get('k', {}, loader)
+    assert cache.get('k', {}, loader) == {'a': [1, 2]}
+    assert loader.calls == 1
+
+
+def test_corrupted_entry_is_reloaded(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    cache.get('k', {}, Loader(_frame()))
+    for f in os.listdir(tmp_path):
+        if f.endswith('.parquet'):
+            with open(os.path.join(tmp_path, f), 'wb') as fp:
+                fp.write(b'broken')
+    loader = Loader(_frame())
+    pd.testing.assert_frame_equal(cache.get('k', {}, loader), _frame())
+    assert loader.calls == 1
+
+
+def test_lru_eviction(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1)
+    cache.get('a', {}, Loader(_frame()))
+    cache.get('b', {}, Loader(_frame()))
+    assert cache.stats()['entries'] == 1
+    assert cache.evictions == 1
+    assert len([f for f in os.listdir(tmp_path) if f.endswith('.parquet')]) == 1
+
+
+def _fill(cache_dir, worker, n_keys):
+    cache = DiskCache(cache_dir)
+    for i in range(n_keys):
+        cache.get(f'{worker}/{i}', {'etag': str(i)}, lambda: _frame(10, seed=i))
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='fork')
+def test_concurrent_processes_keep_every_entry(tmp_path):
+    ctx = multiprocessing.get_context('fork')
+    procs = [ctx.Process(target=_fill, args=(str(tmp_path), w, 10)) for w in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert all(p.exitcode == 0 for p in procs)
+    # index の読み書きが排他されていれば、どのプロセスの登録も失われない
+    assert DiskCache(str(tmp_path)).stats()['entries'] == 40
+
+
+def test_read_s3_uses_the_cache(tmp_path, monkeypatch):
+    pytest.importorskip('boto3')
+    pytest.importorskip('asr_protected')
+    monkeypatch.setenv('AIQ_S3_CACHE', '1')
+    monkeypatch.setenv('AIQ_S3_CACHE_DIR', str(tmp_path))
+    from libs import s3
+
+    class StubClient:
+        def __init__(self):
+            self.etag = '"1"'
+
+        def head_object(self, Bucket, Key):
+            return {'ETag': self.etag, 'LastModified': '2024-01-01'}
+
+    reads = []
+
+    def read_s3_file(client, bucket, filename):
+        reads.append(filename)
+        return _frame()
+
+    monkeypatch.setattr(s3, 's3', StubClient())
+    monkeypatch.setattr(s3, 'read_s3_file', read_s3_file)
+    monkeypatch.setattr(s3, '_s3_cache', None)
+
+    s3.read_s3('bucket', 'common/market_return.parquet')
+    s3.read_s3('bucket', 'common/market_return.parquet')
+    assert reads == ['common/market_return.parquet']
+    s3.s3.etag = '"2"'
+    s3.read_s3('bucket', 'common/market_return.parquet')
+    assert len(reads) == 2
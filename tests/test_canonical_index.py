@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from libs.dataset.utils import canonical_index
+
+
+def _frame(tickers=('1301', '7203'), dates=None, names=('TICKER', 'DATETIME')):
+    dates = pd.date_range('2024-01-01', periods=3) if dates is None else dates
+    index = pd.MultiIndex.from_product([list(tickers), dates], names=list(names))
+    return pd.DataFrame({'sales': np.arange(len(index), dtype=float)}, index=index)
+
+
+def test_sorted_index_is_not_copied():
+    df = _frame()
+    out = canonical_index(df)
+    assert out.index.names == ['TICKER', 'DATETIME']
+    assert np.shares_memory(out['sales'].to_numpy(), df['sales'].to_numpy())
+
+
+def test_lower_case_and_reordered_levels():
+    df = _frame(names=('ticker', 'datetime'))
+    out = canonical_index(df)
+    assert out.index.names == ['TICKER', 'DATETIME']
+    # 入力は変更しない
+    assert df.index.names == ['ticker', 'datetime']
+
+    swapped = df.swaplevel().sort_index()
+    pd.testing.assert_frame_equal(canonical_index(swapped), out)
+
+
+def test_tz_aware_datetimes_become_naive_local_time():
+    dates = pd.date_range('2024-01-01 15:00', periods=3, tz='Japan')
+    out = canonical_index(_frame(dates=dates))
+    level = out.index.levels[1]
+    assert level.dtype == 'datetime64[ns]'
+    assert level[0] == pd.Timestamp('2024-01-01 15:00')
+
+
+def test_string_datetimes_and_unsorted_rows():
+    df = _frame().iloc[::-1]
+    df.index = df.index.set_levels(df.index.levels[1].strftime('%Y-%m-%d'), level=1)
+    out = canonical_index(df)
+    assert out.index.is_monotonic_increasing
+    pd.testing.assert_frame_equal(out, canonical_index(_frame()))
+
+
+def test_null_tickers_are_dropped_unless_asked():
+    df = _frame(tickers=('1301', None))
+    assert canonical_index(df).index.get_level_values('TICKER').unique().tolist() == ['1301']
+    assert len(canonical_index(df, drop_null_tickers=False)) == len(df)
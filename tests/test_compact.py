@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from libs.instrument import instrumented
+from libs.dataset.compact import compact_frame, maybe_compact, compact_report, clear_compact_report
+
+
+def _frame():
+    return pd.DataFrame({
+        'TICKER': ['1301', '1301', '7203'],
+        'COUNT': [1.0, 2.0, np.nan],
+        'PRICE': [1234.56, 2345.67, 3456.78],
+    })
+
+
+def test_only_lossless_columns_are_downcast():
+    df = _frame()
+    out = compact_frame(df)
+    assert out['COUNT'].dtype == np.float32
+    assert out['PRICE'].dtype == np.float64
+    assert isinstance(out['TICKER'].dtype, pd.CategoricalDtype)
+    # 元の frame は変更しない
+    assert df['COUNT'].dtype == np.float64
+    pd.testing.assert_series_equal(out['PRICE'], df['PRICE'])
+
+
+def test_tolerance_allows_lossy_downcast():
+    out = compact_frame(_frame(), tolerance=1e-6)
+    assert out['PRICE'].dtype == np.float32
+
+
+def test_maybe_compact_reports_through_event(monkeypatch, capsys):
+    clear_compact_report()
+    monkeypatch.delenv('AIQ_COMPACT_DTYPES', raising=False)
+    df = _frame()
+    assert maybe_compact(df, 'pos') is df
+    compact_frame(df, name='quiet')
+    assert capsys.readouterr().out == ''
+
+    monkeypatch.setenv('AIQ_COMPACT_DTYPES', '1')
+    with instrumented() as recs:
+        maybe_compact(df, 'pos')
+    assert 'pos:' in capsys.readouterr().out
+    events = [r for r in recs if r['kind'] == 'event']
+    assert events[0]['name'] == 'compact'
+    assert events[0]['dataset'] == 'pos'
+    assert events[0]['float32'] == 1
+    assert compact_report()['name'].tolist() == ['quiet', 'pos']
+    clear_compact_report()
+    assert compact_report().empty
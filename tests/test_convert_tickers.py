@@ -0,0 +1,51 @@
+import pandas as pd
+
+from libs.dataset.utils import convert_tickers
+
+
+def _frame():
+    index = pd.MultiIndex.from_product(
+        [['1301', '7203', '9984'], pd.date_range('2024-01-01', periods=3)], names=['TICKER', 'DATETIME'])
+    return pd.DataFrame({'sales': range(9)}, index=index, dtype=float)
+
+
+def _reference(df, f):
+    # 1行ずつ変換していた実装
+    df = df.copy()
+    df.index = pd.MultiIndex.from_tuples([(f(i[0]), i[1]) for i in df.index], names=df.index.names)
+    return df
+
+
+def test_callable_matches_per_row_conversion():
+    df = _frame()
+    f = lambda tk: f'{tk}0'
+    pd.testing.assert_frame_equal(convert_tickers(df, f), _reference(df, f))
+
+
+def test_mapping_keeps_unknown_tickers():
+    out = convert_tickers(_frame(), {'1301': '13010', '7203': '72030'})
+    assert out.index.get_level_values('TICKER').unique().tolist() == ['13010', '72030', '9984']
+
+
+def test_input_frame_is_not_modified():
+    df = _frame()
+    before = df.index.copy()
+    out = convert_tickers(df, lambda tk: f'{tk}0')
+    assert out is not df
+    assert df.index.equals(before)
+
+
+def test_callable_results_are_not_cached_across_calls():
+    table = {'1301': 'A'}
+    f = lambda tk: table.get(tk, tk)
+    df = _frame()
+    assert convert_tickers(df, f).index.get_level_values('TICKER')[0] == 'A'
+    table['1301'] = 'B'
+    assert convert_tickers(df, f).index.get_level_values('TICKER')[0] == 'B'
+
+
+def test_tickers_converted_to_none_become_null():
+    out = convert_tickers(_frame(), lambda tk: None if tk == '9984' else tk)
+    tickers = out.index.get_level_values('TICKER')
+    assert tickers.isna().sum() == 3
+    assert len(out) == 9
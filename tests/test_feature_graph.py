@@ -0,0 +1,79 @@
+from itertools import count
+
+from libs.dataset.feature_graph import FeatureGraph, feature_graph, step
+
+
+class _Result:
+    def __init__(self, variable_ids):
+        self.variable_ids = variable_ids
+
+
+class FakeTransform:
+    """Each call returns new variable IDs and is counted per method."""
+
+    def __init__(self):
+        self._ids = count(100)
+        self.calls = {}
+
+    def __getattr__(self, name):
+        def method(data_id=None, fields=None, **kwargs):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            n = len(fields) if isinstance(fields, list) else 1
+            return _Result([next(self._ids) for _ in range(n)])
+        return method
+
+    def clear(self):
+        pass
+
+
+class FakeHandler:
+    def __init__(self):
+        self._ids = count(1)
+        self.transform = FakeTransform()
+
+    def set_raw_data(self, dfraw=None, **kwargs):
+        return next(self._ids)
+
+
+CHAIN = (step('resample', rule='W-FRI', func='last'), step('log_diff', periods=1))
+
+
+def test_shared_prefixes_are_computed_once():
+    sdh = FakeHandler()
+    graph = FeatureGraph(sdh)
+    data_id = sdh.set_raw_data(None)
+
+    first = graph.evaluate(data_id, ['close'], CHAIN)
+    assert graph.evaluate(data_id, ['close'], CHAIN) == first
+    graph.evaluate(data_id, ['close'], CHAIN[:1] + (step('shift', periods=2),))
+    assert sdh.transform.calls == {'resample': 1, 'log_diff': 1, 'shift': 1}
+
+
+def test_memo_is_dropped_when_data_is_registered():
+    sdh = FakeHandler()
+    graph = feature_graph(sdh)
+    data_id = sdh.set_raw_data(None)
+    first = graph.evaluate(data_id, ['close'], CHAIN)
+
+    sdh.set_raw_data(None)
+    second = graph.evaluate(data_id, ['close'], CHAIN)
+    assert second != first
+    assert sdh.transform.calls == {'resample': 2, 'log_diff': 2}
+
+    sdh.transform.clear()
+    graph.evaluate(data_id, ['close'], CHAIN)
+    assert sdh.transform.calls == {'resample': 3, 'log_diff': 3}
+    # 同じ handler の graph は共有される
+    assert feature_graph(sdh) is graph
+
+
+def test_unwatchable_handler_is_evaluated_without_memo():
+    class Slotted:
+        __slots__ = ['transform']
+
+    sdh = Slotted()
+    sdh.transform = FakeTransform()
+    graph = FeatureGraph(sdh)
+    graph.evaluate(1, ['close'], CHAIN)
+    graph.evaluate(1, ['close'], CHAIN)
+    assert sdh.transform.calls == {'resample': 2, 'log_diff': 2}
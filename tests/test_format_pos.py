@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from libs.dataset.utils import format_pos
+
+
+def _reference(df):
+    # ベクトル化前の format_pos
+    df['DATETIME'] = pd.to_datetime(df['DATETIME'])
+    df['RELEASE_TIMESTAMP'] = pd.to_datetime(df['RELEASE_TIMESTAMP'])
+    df.set_index(['TICKER', 'DATETIME', 'VARIABLE', 'SMOOTH', 'RELEASE_TIMESTAMP'], inplace=True)
+    df = df.xs(0, level='SMOOTH').drop(['BACKFILL'], axis=1)
+    df = df.sort_index()
+    df.reset_index('RELEASE_TIMESTAMP', drop=False, inplace=True)
+    df = df.loc[~df.index.duplicated(keep='last')]
+    df.drop(['RELEASE_TIMESTAMP'], axis=1, inplace=True)
+    return df.unstack('VARIABLE')['VALUE'].sort_index()
+
+
+def _stack(seed=0, n_rows=400):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2024-01-01', periods=5, freq='D')
+    releases = pd.date_range('2024-01-02', periods=3, freq='D')
+    return pd.DataFrame({
+        'TICKER': rng.choice(['1301', '7203', '9984'], n_rows),
+        'DATETIME': rng.choice(dates.strftime('%Y-%m-%d'), n_rows),
+        'VARIABLE': rng.choice(['sales', 'count'], n_rows),
+        'SMOOTH': rng.choice([0, 7], n_rows),
+        # 同じキーに同じ RELEASE_TIMESTAMP が何度も現れる (同時刻の改訂)
+        'RELEASE_TIMESTAMP': rng.choice(releases, n_rows),
+        'BACKFILL': False,
+        'VALUE': rng.normal(size=n_rows),
+    })
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_format_pos_matches_reference(seed):
+    df = _stack(seed)
+    # 並び順はランダム (未ソート)
+    assert not df.sort_values(['TICKER', 'DATETIME']).index.equals(df.index)
+    result = format_pos(df)
+    pd.testing.assert_frame_equal(result, _reference(df.copy()))
+
+
+def test_format_pos_keeps_the_last_row_of_tied_releases():
+    df = pd.DataFrame({
+        'TICKER': ['1301'] * 4,
+        'DATETIME': pd.to_datetime(['2024-01-01'] * 4),
+        'VARIABLE': ['sales'] * 4,
+        'SMOOTH': [0, 0, 7, 0],
+        'RELEASE_TIMESTAMP': pd.to_datetime(['2024-01-03', '2024-01-03', '2024-01-05', '2024-01-02']),
+        'BACKFILL': False,
+        'VALUE': [1.0, 2.0, 3.0, 4.0],
+    })
+    result = format_pos(df)
+    assert result.loc[('1301', pd.Timestamp('2024-01-01')), 'sales'] == 2.0
+    pd.testing.assert_frame_equal(result, _reference(df.copy()))
+
+
+def test_format_pos_does_not_modify_input():
+    df = _stack()
+    before = df.copy()
+    format_pos(df)
+    pd.testing.assert_frame_equal(df, before)
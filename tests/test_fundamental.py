@@ -0,0 +1,87 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+
+from libs.downloader.fundamental import download_fundamental
+
+
+def _doc(ticker, date, sales, profit=1.0, **kwargs):
+    return {
+        'seccode': ticker, 'fiscal_quarter_last_date': date, 'sales': sales, 'profit': profit,
+        'fiscal_year': 2020, 'is_latest': 1, 'num_month': 3, 'consolidated_flag': 1, **kwargs,
+    }
+
+
+@pytest.fixture
+def client():
+    client = mongomock.MongoClient()
+    col = client['TRDB']['QUARTERLY_FIN_STMT']
+    docs = []
+    for i, ticker in enumerate(['1301', '1332', '7203', '9984']):
+        for q, date in enumerate(['20200331', '20200630', '20200930', '20201231']):
+            docs.append(_doc(ticker, date, float(100 * i + q), profit=q))
+    docs += [
+        _doc('7203', '20210331', 'n/a'),              # 数値でない
+        _doc('9984', 'unknown', 5.0),                 # 日付でない
+        _doc('9984', '20210331', None),               # 欠損 (数えない)
+        _doc('1301', '20070331', 1.0, fiscal_year=2007),
+        _doc('1301', '20210331', 1.0, is_latest=0),
+    ]
+    col.insert_many(docs)
+    return client
+
+
+def test_download_matches_a_single_query(client, caplog):
+    with caplog.at_level(logging.WARNING):
+        df = download_fundamental(
+            '', ['1301', '1332', '7203', '9984'], fields=['sales', 'profit'],
+            chunk_size=1, batch_size=3, max_workers=2, client=client, max_coerced_ratio=0.1)
+
+    assert df.index.names == ['ticker', 'datetime']
+    assert list(df.columns) == ['sales', 'profit']
+    assert df.dtypes.tolist() == [np.float64, np.float64]
+    assert len(df) == 16 + 3
+    assert df.loc[('7203', pd.Timestamp('2020-09-30')), 'sales'] == 202.0
+    assert np.isnan(df.loc[('7203', pd.Timestamp('2021-03-31')), 'sales'])
+    assert df.loc['9984'].index.isna().sum() == 1
+
+    # 変換できなかった値だけが数えられる
+    assert 'fiscal_quarter_last_date=1' in caplog.text
+    assert 'sales=1' in caplog.text
+    assert 'profit' not in caplog.text
+
+
+def test_output_path_streams_the_same_rows(client, tmp_path):
+    path = str(tmp_path / 'funda.parquet')
+    tickers = ['1301', '1332', '7203', '9984']
+    assert download_fundamental('', tickers, fields=['sales'], chunk_size=2, batch_size=2,
+                                output_path=path, client=client, max_coerced_ratio=None) is None
+    expected = download_fundamental('', tickers, fields=['sales'], client=client, max_coerced_ratio=None)
+    got = pd.read_parquet(path).set_index(['ticker', 'datetime'])
+    pd.testing.assert_frame_equal(got.sort_index(), expected.sort_index())
+
+
+def test_clean_download_logs_nothing(client, caplog):
+    with caplog.at_level(logging.WARNING):
+        df = download_fundamental('', ['1301', '1332'], fields=['sales'], client=client)
+    assert len(df) == 8
+    assert caplog.text == ''
+
+
+def test_non_numeric_field_fails_loudly_unless_typed(client):
+    col = client['TRDB']['QUARTERLY_FIN_STMT']
+    col.update_many({}, {'$set': {'accounting_standard': 'JGAAP'}})
+
+    with pytest.raises(ValueError, match='accounting_standard'):
+        download_fundamental('', ['1301', '1332'], fields=['sales', 'accounting_standard'], client=client)
+
+    df = download_fundamental(
+        '', ['1301', '1332'], fields=['sales', 'accounting_standard'], client=client,
+        field_types={'accounting_standard': pa.string()})
+    assert (df['accounting_standard'] == 'JGAAP').all()
+    assert df['sales'].dtype == np.float64
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('tqdm')
+
+from libs.analyze.grid_search import fit_lag_diff
+
+
+def _datasets(n_tickers=6, n_quarters=20, lags=range(0, 3), diffs=(True, False)):
+    rng = np.random.default_rng(0)
+    index = pd.MultiIndex.from_product(
+        [[str(1300 + i) for i in range(n_tickers)], pd.date_range('2015-03-31', periods=n_quarters, freq='QE')],
+        names=['TICKER', 'DATETIME'])
+    return {
+        (lag, diff): pd.DataFrame({'y': rng.normal(size=len(index)), 'X': rng.normal(size=len(index))}, index=index)
+        for lag in lags for diff in diffs
+    }
+
+
+def test_pool_matches_inline():
+    datasets = _datasets()
+    inline = fit_lag_diff(datasets, min_periods=5, n_jobs=1)
+    pool = fit_lag_diff(datasets, min_periods=5, n_jobs=2, n_shards=3)
+    assert inline.index.names == ['TICKER', 'datetime', 'lag', 'diff1']
+    assert len(inline) == 6 * 16 * 3 * 2
+    pd.testing.assert_frame_equal(inline.sort_index(), pool.sort_index())
+
+
+@pytest.mark.parametrize('datasets', [{}, {(0, True): _datasets()[0, True].iloc[:0]}])
+def test_empty_combinations(datasets):
+    out = fit_lag_diff(datasets, n_jobs=1)
+    assert out.empty
+    assert out.index.names == ['TICKER', 'datetime', 'lag', 'diff1']
+    assert list(out.columns) == ['t_val']
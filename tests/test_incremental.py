@@ -0,0 +1,153 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from libs.dataset.incremental import (
+    append_increment, write_base, stack_files, load_manifest, mark_reconciled, reconcile_due
+)
+
+
+TODAY = pd.Timestamp.now().normalize()
+
+
+def _days_ago(n):
+    return TODAY - pd.Timedelta(days=n)
+
+
+def _releases(dates, release_lag_days=3, value=1.0, tickers=('1301', '7203')):
+    dates = pd.DatetimeIndex(dates)
+    return pd.DataFrame({
+        'TICKER': np.repeat(list(tickers), len(dates)),
+        'DATETIME': np.tile(dates.values, len(tickers)),
+        'VARIABLE': 'sales',
+        'RELEASE_TIMESTAMP': np.tile((dates + pd.Timedelta(days=release_lag_days)).values, len(tickers)),
+        'VALUE': value,
+    })
+
+
+class Loader:
+    """Stand-in for the alternative data loaders: filters the source on DATETIME only (inclusive)."""
+
+    def __init__(self, source: pd.DataFrame, fail_on_call=None):
+        self.source = source
+        self.calls = []
+        self.fail_on_call = fail_on_call
+
+    def __call__(self, start, end):
+        self.calls.append((start, end))
+        if self.fail_on_call is not None and len(self.calls) == self.fail_on_call:
+            raise ConnectionError('loader interrupted')
+        df = self.source
+        if start is not None:
+            df = df.loc[df['DATETIME'] >= start]
+        if end is not None:
+            df = df.loc[df['DATETIME'] <= end]
+        return df.reset_index(drop=True)
+
+
+def _read(path):
+    return pd.read_parquet(stack_files(path)).sort_values(['TICKER', 'DATETIME', 'RELEASE_TIMESTAMP'], ignore_index=True)
+
+
+@pytest.fixture
+def stack(tmp_path):
+    path = str(tmp_path / 'x_stack.parquet')
+    base = _releases(pd.date_range(_days_ago(730), _days_ago(30), freq='D'))
+    write_base(base, path)
+    return path, base
+
+
+def test_appends_only_the_new_releases(stack):
+    path, base = stack
+    new = _releases(pd.date_range(_days_ago(29), _days_ago(20), freq='D'))
+    loader = Loader(pd.concat([base, new]))
+    out = append_increment(path, loader, reconcile_days=7)
+
+    assert len(out) == len(new)
+    assert len(loader.calls) == 1 and loader.calls[0] == (_days_ago(27 + 31), None)
+    assert len(_read(path)) == len(base) + len(new)
+    assert pd.Timestamp(load_manifest(path)['watermark']) == new['RELEASE_TIMESTAMP'].max()
+
+
+def test_revision_of_an_old_datetime_is_picked_up_by_the_reconcile(stack):
+    path, base = stack
+    # 700 日前の値が 10 日前に改訂された
+    revision = _releases([_days_ago(700)], value=2.0)
+    revision['RELEASE_TIMESTAMP'] = _days_ago(10)
+    loader = Loader(pd.concat([base, revision]))
+
+    assert not reconcile_due(path, 7)
+    assert append_increment(path, loader, reconcile_days=7).empty
+
+    mark_reconciled(path, pd.Timestamp.now() - pd.Timedelta(days=8))
+    assert reconcile_due(path, 7)
+    out = append_increment(path, loader, reconcile_days=7, window_days=180)
+    assert len(out) == len(revision)
+    assert (out['VALUE'] == 2.0).all()
+    # 全期間を window 毎に取得した
+    assert loader.calls[1][0] is None and loader.calls[-1][1] is None and len(loader.calls) > 3
+    assert not reconcile_due(path, 7)
+
+    df = _read(path)
+    assert len(df) == len(base) + len(revision)
+
+
+def test_interrupted_fetch_resumes_from_the_first_unwritten_window(stack):
+    path, base = stack
+    new = _releases(pd.date_range(_days_ago(600), _days_ago(20), freq='D'), value=3.0, release_lag_days=590)
+    source = pd.concat([base, new])
+    mark_reconciled(path, '2000-01-01')
+
+    loader = Loader(source, fail_on_call=3)
+    with pytest.raises(ConnectionError):
+        append_increment(path, loader, reconcile_days=7, window_days=180)
+    pending = load_manifest(path)['pending']
+    assert pending['done'] == 2
+
+    resumed = Loader(source)
+    append_increment(path, resumed, reconcile_days=7, window_days=180)
+    assert resumed.calls[0] == tuple(pd.Timestamp(b) for b in pending['windows'][2])
+    assert len(resumed.calls) == len(pending['windows']) - 2
+
+    manifest = load_manifest(path)
+    assert manifest['pending'] is None
+    df = _read(path)
+    assert len(df) == len(base) + len(new)
+    assert not df.duplicated(['TICKER', 'DATETIME', 'RELEASE_TIMESTAMP']).any()
+    assert pd.Timestamp(manifest['watermark']) == new['RELEASE_TIMESTAMP'].max()
+
+
+def test_crash_after_registering_a_part_does_not_duplicate_it(stack, monkeypatch):
+    from libs.dataset import incremental
+    from libs.dataset.universe import universe_tickers
+
+    path, base = stack
+    new = _releases(pd.date_range(_days_ago(29), _days_ago(20), freq='D'), tickers=('1301', '9984'))
+    source = pd.concat([base, new])
+
+    def crash(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(incremental, 'update_universe', crash)
+    with pytest.raises(KeyboardInterrupt):
+        append_increment(path, Loader(source), reconcile_days=7)
+    assert load_manifest(path)['pending']['done'] == 1
+    monkeypatch.undo()
+
+    resumed = Loader(source)
+    assert append_increment(path, resumed, reconcile_days=7).empty
+    assert resumed.calls == []
+    df = _read(path)
+    assert len(df) == len(base) + len(new)
+    assert not df.duplicated(['TICKER', 'DATETIME', 'RELEASE_TIMESTAMP']).any()
+    assert sorted(universe_tickers(path)) == ['1301', '7203', '9984']
+
+
+def test_reconcile_due_without_record(tmp_path):
+    path = str(tmp_path / 'x_stack.parquet')
+    _releases(pd.date_range(_days_ago(3), periods=3)).to_parquet(path)
+    assert reconcile_due(path, 7)
+    assert not reconcile_due(path, None)
+    assert os.path.exists(path)
@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from libs.downloader.market import download_market_from_influx
+from libs.storage import LAYOUT_FILE_NAME
+
+
+class FakeTRIN:
+    """TRINPriceLoader stand-in: a few daily bars per ticker, none for EMPTY*, raises for FAIL*."""
+
+    def __init__(self, conf):
+        self.conf = conf
+
+    def run(self, tickers, fields, switch_split=True):
+        if any(tk.startswith('FAIL') for tk in tickers):
+            raise RuntimeError('influx is down')
+        # 先頭のバッチほど遅く終わる
+        if tickers[0].startswith('SLOW'):
+            time.sleep(0.05 * (10 - int(tickers[0][4:])))
+        self.tickers = tickers
+
+    def retrieve(self, target, start, end, kind):
+        index = pd.date_range('2024-01-01', periods=5, freq='D', tz='Japan', name='datetime')
+        out = {}
+        for tk in self.tickers:
+            if tk.startswith('EMPTY'):
+                out[tk] = pd.DataFrame()
+                continue
+            out[tk] = pd.DataFrame({f: np.arange(5, dtype=float) for f in ['open', 'high', 'low', 'close', 'volume']},
+                                   index=index)
+        return out
+
+
+@pytest.fixture(autouse=True)
+def fake_trin(monkeypatch):
+    package = types.ModuleType('load_data_from_influxdb')
+    module = types.ModuleType('load_data_from_influxdb.TRIN_price_data_handler')
+    module.TRINPriceLoader = FakeTRIN
+    monkeypatch.setitem(sys.modules, 'load_data_from_influxdb', package)
+    monkeypatch.setitem(sys.modules, 'load_data_from_influxdb.TRIN_price_data_handler', module)
+
+
+def test_download_returns_frame_and_summary():
+    df, summary = download_market_from_influx(
+        'conf', ['A', 'B', 'EMPTY1', 'FAIL1'], batch_size=1, max_workers=2, return_summary=True)
+    assert sorted(df.index.get_level_values('TICKER').unique()) == ['A', 'B']
+    assert df.index.names == ['TICKER', 'DATETIME']
+    assert df.index.get_level_values('DATETIME').tz is None
+    assert summary['empty'] == ['EMPTY1']
+    assert list(summary['failed']) == ['FAIL1']
+    assert summary['rows'] == 10
+
+
+def test_failed_batch_is_retried_per_ticker():
+    df, summary = download_market_from_influx(
+        'conf', ['A', 'FAIL1', 'B'], batch_size=3, return_summary=True)
+    assert df.index.get_level_values('TICKER').unique().tolist() == ['A', 'B']
+    assert list(summary['failed']) == ['FAIL1']
+    assert summary['rows'] == 10
+
+
+def test_output_follows_the_ticker_order():
+    tickers = [f'SLOW{i}' for i in range(6)]
+    df = download_market_from_influx('conf', tickers, batch_size=1, max_workers=6)
+    assert df.index.get_level_values('TICKER').unique().tolist() == tickers
+
+
+def test_output_dir_is_replaced_only_at_the_end(tmp_path):
+    output_dir = str(tmp_path / 'prices')
+    assert download_market_from_influx('conf', ['A', 'B', 'C'], batch_size=1, output_dir=output_dir) is None
+    assert os.path.exists(os.path.join(output_dir, LAYOUT_FILE_NAME))
+    assert len(pd.read_parquet(output_dir)) == 15
+
+    # 再実行で置き換わり、作業ディレクトリは残らない
+    download_market_from_influx('conf', ['A'], output_dir=output_dir)
+    assert len(pd.read_parquet(output_dir)) == 5
+    assert sorted(os.listdir(tmp_path)) == ['prices']
+
+
+def test_output_dir_with_other_files_is_refused(tmp_path):
+    (tmp_path / 'notes.txt').write_text('keep me')
+    with pytest.raises(ValueError):
+        download_market_from_influx('conf', ['A'], output_dir=str(tmp_path))
+    assert (tmp_path / 'notes.txt').read_text() == 'keep me'
+
+
+def test_output_dir_is_kept_when_nothing_is_downloaded(tmp_path):
+    output_dir = str(tmp_path / 'prices')
+    download_market_from_influx('conf', ['A'], output_dir=output_dir)
+    download_market_from_influx('conf', ['FAIL1'], output_dir=output_dir)
+    assert len(pd.read_parquet(output_dir)) == 5
+    assert sorted(os.listdir(tmp_path)) == ['prices']
@@ -0,0 +1,31 @@
+from libs.instrument import event, instrumented, stage
+
+
+def test_event_prints_the_message_when_disabled(capsys, monkeypatch):
+    monkeypatch.delenv('AIQ_INSTRUMENT', raising=False)
+    event('loader_fallback', 'extract pos_elec_goods by loader..', dataset='pos_elec_goods')
+    assert capsys.readouterr().out == 'extract pos_elec_goods by loader..\n'
+
+
+def test_event_is_recorded_and_printed(capsys):
+    with instrumented() as recs:
+        with stage('register'):
+            event('loader_fallback', 'extract pos_elec_goods by loader..', dataset='pos_elec_goods')
+    assert capsys.readouterr().out == 'extract pos_elec_goods by loader..\n'
+    events = [r for r in recs if r['kind'] == 'event']
+    assert events[0]['stage'] == 'register'
+    assert events[0]['dataset'] == 'pos_elec_goods'
+    assert events[0]['message'] == 'extract pos_elec_goods by loader..'
+
+
+def test_session_records_are_bounded(monkeypatch):
+    from collections import deque
+    from libs import instrument
+
+    assert instrument._RECORDS.maxlen == instrument.MAX_RECORDS
+    monkeypatch.setattr(instrument, '_RECORDS', deque(maxlen=5))
+    monkeypatch.setenv('AIQ_INSTRUMENT', '1')
+    for i in range(12):
+        with stage(f'step{i}'):
+            pass
+    assert [r['stage'] for r in instrument.records()] == [f'step{i}' for i in range(7, 12)]
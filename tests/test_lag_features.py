@@ -0,0 +1,174 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from libs.dataset.utils import resample_weekly, shifted_resample_weekly
+from libs.dataset.lag_features import build_lag_features
+
+
+def _alt_frame(seed=0):
+    rng = np.random.default_rng(seed)
+    frames = []
+    for ticker in ['1301', '1332', '7203']:
+        dates = pd.date_range('2020-01-01', periods=int(rng.integers(60, 400)), freq='D')
+        dates = dates[rng.random(len(dates)) > 0.3]
+        frames.append(pd.DataFrame({
+            'TICKER': ticker,
+            'DATETIME': dates,
+            'sales': rng.lognormal(size=len(dates)),
+            'count': rng.lognormal(size=len(dates)),
+        }))
+    df = pd.concat(frames).set_index(['TICKER', 'DATETIME'])
+    df.iloc[::7, 0] = np.nan
+    return df
+
+
+@pytest.mark.parametrize('how', ['mean', 'sum'])
+def test_shifted_resample_weekly_matches_shift_then_resample(how):
+    df = _alt_frame()
+    lags = range(0, 10)
+    out = shifted_resample_weekly(df, lags, how=how, rule='W')
+    for lag in lags:
+        expected = df.groupby(level='TICKER').shift(lag).groupby(level='TICKER').resample(
+            'W', level='DATETIME').agg(how)
+        got = out[lag]
+        got.columns.name = None
+        pd.testing.assert_frame_equal(got, expected, check_freq=False, rtol=1e-10)
+
+
+def test_shifted_resample_weekly_lag0_is_resample_weekly():
+    df = _alt_frame(1)
+    out = shifted_resample_weekly(df, [0], rule='W-FRI')[0]
+    out.columns.name = None
+    pd.testing.assert_frame_equal(out, resample_weekly(df, 'mean', rule='W-FRI'), rtol=1e-10)
+
+
+def test_build_lag_features_matches_the_chains():
+    pytest.importorskip('aiq_strategy_robot')
+    from aiq_strategy_robot.data.data_accessor import DAL
+
+    sdh = DAL()
+    data_id = sdh.set_raw_data(_alt_frame())
+    shift_ids, logdiff_ids = build_lag_features(sdh, data_id, lags=range(0, 9), sma_periods=12, diff_periods=52)
+
+    # transform_mkt_vs_alt の元のチェーン
+    expected = {0: sdh.transform.resample(data_id=data_id, rule='W', func='mean').variable_ids}
+    for lag in range(1, 9):
+        expected[lag] = sdh.transform.shift(data_id=data_id, periods=lag).resample(
+            rule='W', func='mean').sma(periods=12).variable_ids
+    for lag in range(0, 9):
+        np.testing.assert_allclose(
+            sdh.get_variables(shift_ids[lag]).to_numpy(),
+            sdh.get_variables(expected[lag]).to_numpy(), rtol=1e-10)
+        np.testing.assert_allclose(
+            sdh.get_variables(logdiff_ids[lag]).to_numpy(),
+            sdh.get_variables(sdh.transform.log_diff(fields=expected[lag], periods=52).variable_ids).to_numpy(),
+            rtol=1e-10)
+
+
+class _Chain:
+    def __init__(self, transform, variable_ids):
+        self._transform = transform
+        self.variable_ids = variable_ids
+
+    def __getattr__(self, name):
+        method = getattr(self._transform, name)
+        return lambda *args, **kwargs: method(*args, fields=self.variable_ids, **kwargs)
+
+
+class FakeTransform:
+    """pandas version of the handler transforms used by build_lag_features, counting the calls."""
+
+    def __init__(self, sdh):
+        self.sdh = sdh
+        self.calls = {}
+
+    def _apply(self, name, f, data_id=None, fields=None):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if data_id is not None:
+            df = self.sdh.data[data_id]
+            columns = list(df.columns) if fields is None else list(fields)
+            series = [df[c] for c in columns]
+        else:
+            series = [self.sdh.variables[i] for i in fields]
+        ids = []
+        for s in series:
+            ids.append(len(self.sdh.variables))
+            self.sdh.variables.append(f(s).rename(s.name))
+        return _Chain(self, ids)
+
+    def raw(self, data_id=None, fields=None):
+        return self._apply('raw', lambda s: s, data_id, fields)
+
+    def shift(self, data_id=None, fields=None, periods=1):
+        return self._apply('shift', lambda s: s.groupby(level=0).shift(periods), data_id, fields)
+
+    def resample(self, data_id=None, fields=None, rule='W', func='mean'):
+        return self._apply(
+            'resample', lambda s: s.groupby(level=0).resample(rule, level=1).agg(func), data_id, fields)
+
+    def sma(self, data_id=None, fields=None, periods=1):
+        return self._apply(
+            'sma', lambda s: s.groupby(level=0).transform(lambda x: x.rolling(periods).mean()), data_id, fields)
+
+    def log_diff(self, data_id=None, fields=None, periods=1):
+        return self._apply(
+            'log_diff', lambda s: np.log(s).groupby(level=0).diff(periods), data_id, fields)
+
+
+class FakeHandler:
+    def __init__(self):
+        self.data = {}
+        self.variables = []
+        self.alias = {}
+        self.transform = FakeTransform(self)
+
+    def set_raw_data(self, dfraw=None, **kwargs):
+        data_id = len(self.data) + 1
+        self.data[data_id] = dfraw
+        return data_id
+
+    def set_alias(self, alias):
+        self.alias.update(alias)
+
+    def get_variables(self, ids):
+        return pd.concat([self.variables[i] for i in ids], axis=1)
+
+
+def _chain_ids(sdh, data_id, lag, func, sma_periods):
+    # transform_mkt_vs_alt の元のチェーン
+    if lag == 0:
+        return sdh.transform.resample(data_id=data_id, rule='W', func=func).variable_ids
+    return sdh.transform.shift(data_id=data_id, periods=lag).resample(
+        rule='W', func=func).sma(periods=sma_periods).variable_ids
+
+
+@pytest.mark.parametrize('func', ['mean', 'sum'])
+def test_build_lag_features_matches_the_chains_on_a_fake_handler(func):
+    lags = range(0, 5)
+    fast = FakeHandler()
+    shift_ids, logdiff_ids = build_lag_features(
+        fast, fast.set_raw_data(_alt_frame()), lags=lags, func=func, sma_periods=3, diff_periods=4)
+    assert 'shift' not in fast.transform.calls
+    # 一括計算のデータが1つ登録される (以降の data_id が1つずれる)
+    assert list(fast.data) == [1, 2]
+    assert fast.alias[2] == f'shift(1,2,3,4).resample(W, {func}) of 1'
+
+    chain = FakeHandler()
+    data_id = chain.set_raw_data(_alt_frame())
+    for lag in lags:
+        ids = _chain_ids(chain, data_id, lag, func, 3)
+        logdiff = chain.transform.log_diff(fields=ids, periods=4).variable_ids
+        for got, expected in zip(shift_ids[lag] + logdiff_ids[lag], ids + logdiff):
+            pd.testing.assert_series_equal(
+                fast.variables[got], chain.variables[expected],
+                check_names=False, check_freq=False, rtol=1e-10)
+
+
+def test_build_lag_features_runs_the_chains_for_other_rules():
+    sdh = FakeHandler()
+    shift_ids, logdiff_ids = build_lag_features(
+        sdh, sdh.set_raw_data(_alt_frame()), lags=range(0, 5), rule='7D', sma_periods=3, diff_periods=4)
+    assert sdh.transform.calls['shift'] == 4
+    assert list(sdh.data) == [1]
+    assert list(shift_ids) == list(logdiff_ids) == list(range(0, 5))
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('aiq_strategy_robot')
+pytest.importorskip('yfinance')
+
+from libs.dataset import common
+
+
+def _extract(tickers, dates, seed):
+    rng = np.random.default_rng(seed)
+    n = len(tickers) * len(dates)
+    return pd.DataFrame({
+        'Ticker': np.repeat([f'{tk} JT' for tk in tickers], len(dates)),
+        'DATE': np.tile(pd.DatetimeIndex(dates).values, len(tickers)),
+        'Open Price': rng.uniform(90, 110, n),
+        'High Price': rng.uniform(110, 120, n),
+        'Low Price': rng.uniform(80, 90, n),
+        'Close Price': rng.uniform(90, 110, n),
+        'Split Factor': 1.0,
+        'Div Factor': rng.choice([1.0, 0.98], n),
+        'Volume': rng.integers(0, 1000, n),
+    })
+
+
+@pytest.fixture
+def extract_dir(tmp_path):
+    first = _extract(['1301', '7203', '9984'], pd.date_range('2024-01-01', periods=5), 0)
+    # 日付の重複と欠損を含む
+    second = _extract(['1301', '7203'], pd.date_range('2024-01-05', periods=4), 1)
+    second.loc[3, 'DATE'] = pd.NaT
+    first.to_parquet(tmp_path / 'extract_2024_01.parquet')
+    second.to_parquet(tmp_path / 'extract_2024_02.parquet')
+    _extract(['1301'], pd.date_range('2024-01-01', periods=2), 2).to_parquet(tmp_path / 'extract_cae_2024.parquet')
+    return tmp_path
+
+
+def _reference(extract_dir, tickers):
+    # ストリーミング化する前の reload_market_to_s3 の読込部分
+    dfdata = pd.concat([
+        pd.read_parquet(extract_dir / name) for name in ['extract_2024_01.parquet', 'extract_2024_02.parquet']
+    ], axis=0, sort=False)
+    df_mkt_raw = common.get_adj_close(dfdata)
+    df_mkt_raw.index.names = ['TICKER', 'DATETIME']
+    df_mkt_raw = df_mkt_raw.loc[~df_mkt_raw.index.duplicated()]
+    df_mkt_raw = df_mkt_raw.loc[~df_mkt_raw.index.get_level_values('DATETIME').isnull()]
+    if tickers:
+        df_mkt_raw = df_mkt_raw.loc[df_mkt_raw.index.get_level_values('TICKER').isin(tickers)]
+    return dfdata, df_mkt_raw
+
+
+@pytest.mark.parametrize('tickers', [None, ['1301', '9984']])
+@pytest.mark.parametrize('batch_size', [4, 1_000_000])
+def test_scan_matches_the_full_read(extract_dir, tickers, batch_size):
+    dfdata, df_mkt_raw, _ = common.reload_market_to_s3(
+        str(extract_dir), tickers=tickers, upload_filename=False, return_raw=True, batch_size=batch_size)
+    ref_data, ref_mkt_raw = _reference(extract_dir, tickers)
+
+    pd.testing.assert_frame_equal(df_mkt_raw, ref_mkt_raw)
+    # raw データは銘柄で絞り込まない
+    pd.testing.assert_frame_equal(dfdata.reset_index(drop=True), ref_data.reset_index(drop=True))
+
+
+def test_raw_frame_is_not_kept_by_default(extract_dir):
+    dfdata, df_mkt_raw, _ = common.reload_market_to_s3(str(extract_dir), upload_filename=False)
+    assert dfdata is None
+    assert len(df_mkt_raw)
+
+
+def _adj_close():
+    rng = np.random.default_rng(3)
+    frames = []
+    # 7203 は日付が抜けており、9984 は1行のみ
+    for ticker, dates in [
+        ('1301', pd.date_range('2024-01-01', periods=6)),
+        ('7203', pd.DatetimeIndex(['2024-01-01', '2024-01-02', '2024-01-05', '2024-01-09'])),
+        ('9984', pd.DatetimeIndex(['2024-01-03'])),
+    ]:
+        index = pd.MultiIndex.from_product([[ticker], dates], names=['TICKER', 'DATETIME'])
+        frames.append(pd.DataFrame({
+            'adj_open': rng.uniform(90, 110, len(index)),
+            'adj_high': rng.uniform(110, 120, len(index)),
+            'adj_low': rng.uniform(80, 90, len(index)),
+            'adj_close': rng.uniform(90, 110, len(index)),
+        }, index=index))
+    return pd.concat(frames)
+
+
+def _returns_reference(df_mkt_raw):
+    # DAL の log / shift / log_diff / sub と同じく銘柄毎に1行前との差を取る
+    df = df_mkt_raw.sort_index()
+    log_close, log_open = np.log(df['adj_close']), np.log(df['adj_open'])
+    return pd.DataFrame({
+        'returns': log_close.groupby(level='TICKER').diff(),
+        'returns_oo': log_open.groupby(level='TICKER').diff(),
+        'returns_id': log_close - log_open,
+        'returns_on': log_open - log_close.groupby(level='TICKER').shift(1),
+    })
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_native_returns_match_the_grouped_reference(shuffle):
+    df_mkt_raw = _adj_close()
+    if shuffle:
+        df_mkt_raw = df_mkt_raw.sample(frac=1, random_state=0)
+    result = common.compute_market_returns(df_mkt_raw)
+    pd.testing.assert_frame_equal(result, _returns_reference(df_mkt_raw))
+    assert result.loc['9984'][['returns', 'returns_oo', 'returns_on']].isna().all().all()
@@ -0,0 +1,59 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+
+from libs.downloader.market import download_market_from_mongo, sync_market_from_mongo
+
+
+def _bar(ticker, day, close):
+    # 15:00 JST の日足 (DB 上は UTC)
+    return {'seccode': ticker, 'datetime': datetime.datetime.fromisoformat(f'{day}T06:00:00'), 'close': close}
+
+
+@pytest.fixture
+def client():
+    client = mongomock.MongoClient()
+    col = client['plugatrade']['market_data']
+    col.insert_many([
+        _bar(ticker, day, float(i))
+        for ticker in ['1301', '7203']
+        for i, day in enumerate(['2024-01-04', '2024-01-05', '2024-01-09', '2024-01-10'])
+    ])
+    return client
+
+
+def _jst(day):
+    return pd.Timestamp(f'{day} 15:00')
+
+
+def test_date_only_end_date_includes_the_bar_of_that_day(client):
+    df = download_market_from_mongo('', ['1301'], start_date='2024-01-05', end_date='2024-01-09', client=client)
+    assert df.index.get_level_values('datetime').tolist() == [_jst('2024-01-05'), _jst('2024-01-09')]
+
+
+def test_sync_merges_with_the_stored_file(client, tmp_path):
+    path = str(tmp_path / 'market.parquet')
+    old = pd.DataFrame(
+        {'close': [100.0, 101.0, 200.0]},
+        index=pd.MultiIndex.from_tuples(
+            [('1301', _jst('2024-01-04')), ('1301', _jst('2024-01-05')), ('9999', _jst('2024-01-05'))],
+            names=['ticker', 'datetime']))
+    old.to_parquet(path)
+
+    dfnew = sync_market_from_mongo('', ['1301', '7203'], path, end_date='2024-01-09', client=client)
+
+    # 1301 は保存済みの最終日から、7203 は最初から取得する
+    assert dfnew.loc['1301'].index.tolist() == [_jst('2024-01-05'), _jst('2024-01-09')]
+    assert dfnew.loc['7203'].index.tolist() == [_jst(d) for d in ['2024-01-04', '2024-01-05', '2024-01-09']]
+
+    dfall = pd.read_parquet(path)
+    assert dfall.index.is_monotonic_increasing and dfall.index.is_unique
+    # 保存済みの行はダウンロードした行で上書きされ、対象外の銘柄は残る
+    assert dfall.loc[('1301', _jst('2024-01-04')), 'close'] == 100.0
+    assert dfall.loc[('1301', _jst('2024-01-05')), 'close'] == 1.0
+    assert dfall.loc[('9999', _jst('2024-01-05')), 'close'] == 200.0
+    assert ('1301', _jst('2024-01-10')) not in dfall.index
+    assert len(dfall) == 3 + 1 + 3
@@ -0,0 +1,56 @@
+import os
+
+import pandas as pd
+
+from libs.dataset import materialize as materialize_module
+from libs.dataset.materialize import materialize, materialized_path
+
+
+def _write_source(path, value=1.0):
+    pd.DataFrame({
+        'TICKER': ['7203', '1301', '1301'],
+        'DATETIME': pd.to_datetime(['2024-01-01', '2024-01-02', '2024-01-01']),
+        'VALUE': [value, 2.0, 3.0],
+    }).to_parquet(path)
+
+
+class Build:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, files):
+        self.calls += 1
+        return pd.read_parquet(files).groupby(['TICKER', 'DATETIME'], as_index=False)['VALUE'].sum()
+
+
+def test_view_is_reused_until_the_source_changes(tmp_path):
+    path = str(tmp_path / 'x_stack.parquet')
+    _write_source(path)
+    build = Build()
+
+    mpath = materialize(path, 'agg', build, sort_by=['TICKER', 'DATETIME'])
+    assert mpath == materialized_path(path, 'agg')
+    assert materialize(path, 'agg', build, sort_by=['TICKER', 'DATETIME']) == mpath
+    assert build.calls == 1
+    assert list(pd.read_parquet(mpath)['TICKER']) == ['1301', '1301', '7203']
+
+    os.utime(path, ns=(0, 0))
+    materialize(path, 'agg', build)
+    assert build.calls == 2
+
+
+def test_write_failure_returns_the_built_frame(tmp_path, monkeypatch):
+    path = str(tmp_path / 'x_stack.parquet')
+    _write_source(path)
+
+    def fail(table, where, **kwargs):
+        with open(where, 'wb') as f:
+            f.write(b'partial')
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(materialize_module.pq, 'write_table', fail)
+    view = materialize(path, 'agg', Build(), sort_by=['TICKER', 'DATETIME'])
+    assert isinstance(view, pd.DataFrame)
+    assert list(view['TICKER']) == ['1301', '1301', '7203']
+    # 書きかけの一時ファイルは残らない
+    assert sorted(os.listdir(tmp_path)) == ['x_stack.parquet']
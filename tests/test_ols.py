@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+sm = pytest.importorskip('statsmodels.api')
+
+from libs.analyze.ols import expanding_ols
+
+
+def _data(seed=0):
+    rng = np.random.default_rng(seed)
+    frames = []
+    # 7203 は min_periods に届かない
+    for ticker, n in [('1301', 40), ('7203', 8), ('9984', 25)]:
+        dates = pd.date_range('2020-01-01', periods=n, freq='W')
+        x = rng.normal(size=n)
+        y = 0.5 * x + rng.normal(size=n)
+        df = pd.DataFrame({'y': y, 'X': x}, index=pd.MultiIndex.from_product(
+            [[ticker], dates], names=['TICKER', 'DATETIME']))
+        frames.append(df)
+    data = pd.concat(frames)
+    data.iloc[[3, 17, 50], 0] = np.nan
+    data.iloc[[5, 60], 1] = np.nan
+    return data
+
+
+def _reference(data, min_periods):
+    # ノートブックの statsmodels ループ
+    t_vals = {}
+    for ticker, _ in data.groupby('TICKER'):
+        for d in data.xs(ticker).expanding():
+            if len(d.dropna()) < min_periods:
+                continue
+            mdl = sm.OLS(d['y'], sm.add_constant(d['X'].values), missing='drop').fit()
+            t_vals[ticker, d.index[-1]] = mdl.tvalues['x1']
+    return pd.Series(t_vals, name='t_val').rename_axis(['TICKER', 'DATETIME'])
+
+
+@pytest.mark.parametrize('min_periods', [3, 10])
+def test_expanding_ols_matches_statsmodels(min_periods):
+    data = _data()
+    result = expanding_ols(data, min_periods=min_periods)['t_val'].sort_index()
+    expected = _reference(data, min_periods).sort_index()
+    pd.testing.assert_series_equal(result, expected, check_exact=False, rtol=1e-8)
+
+
+def test_expanding_ols_skips_short_groups():
+    result = expanding_ols(_data(), min_periods=10)
+    assert '7203' not in result.index.get_level_values('TICKER')
+    assert (result['nobs'] >= 10).all()
@@ -0,0 +1,41 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('aiq_strategy_robot')
+
+from libs.dataset import aiq_pos_csmr_goods, aiq_pos_elec_goods
+
+
+def _stack(dates):
+    return pd.DataFrame({
+        'TICKER': '1301',
+        'DATETIME': pd.to_datetime(dates),
+        'VARIABLE': 'SALES',
+        'SMOOTH': 0,
+        'RELEASE_TIMESTAMP': pd.to_datetime(dates),
+        'VALUE': 1.0,
+    })
+
+
+def test_csmr_gen2_is_not_start_filtered(tmp_path):
+    _stack(['2024-01-10', '2024-01-20']).to_parquet(tmp_path / aiq_pos_csmr_goods.FILE_NAME_GEN1)
+    _stack(['2023-12-01', '2024-01-10', '2024-02-01']).to_parquet(tmp_path / aiq_pos_csmr_goods.FILE_NAME_GEN2)
+
+    df_inc1, df_inc2 = aiq_pos_csmr_goods.read_file(
+        str(tmp_path), start_date='2024-01-05', end_date='2024-01-31', smooth=0)
+    assert df_inc1['DATETIME'].tolist() == list(pd.to_datetime(['2024-01-10', '2024-01-20']))
+    # gen1 より前の期間を埋める gen2 の行は残す
+    assert df_inc2['DATETIME'].tolist() == list(pd.to_datetime(['2023-12-01', '2024-01-10']))
+
+
+def test_register_does_not_fall_back_on_read_errors(tmp_path, monkeypatch):
+    def bad_read_file(*args, **kwargs):
+        raise ValueError('bad filter')
+
+    def loader(*args, **kwargs):
+        raise AssertionError('must not fall back to the loader')
+
+    monkeypatch.setattr(aiq_pos_elec_goods, 'read_file', bad_read_file)
+    monkeypatch.setattr(aiq_pos_elec_goods, 'read_by_laoder', loader)
+    with pytest.raises(ValueError):
+        aiq_pos_elec_goods.register_elec_goods_data(None, data_dir=str(tmp_path))
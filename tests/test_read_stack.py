@@ -0,0 +1,54 @@
+import pandas as pd
+import pytest
+
+from libs.dataset.utils import read_stack, filter_stack
+
+
+def _stack():
+    dates = pd.date_range('2024-01-01', periods=6, freq='D')
+    rows = [
+        (ticker, dt, variable, smooth, dt + pd.Timedelta(days=1), float(i))
+        for i, (ticker, dt, variable, smooth) in enumerate(
+            (t, d, v, s) for t in ['1301', '7203', '9984'] for d in dates
+            for v in ['SALES', 'COUNT'] for s in [0, 7])
+    ]
+    return pd.DataFrame(rows, columns=['TICKER', 'DATETIME', 'VARIABLE', 'SMOOTH', 'RELEASE_TIMESTAMP', 'VALUE'])
+
+
+FILTERS = [
+    dict(),
+    dict(tickers=['7203']),
+    dict(tickers=['1301', '9984'], variables=['SALES'], smooth=0),
+    dict(start_date='2024-01-02', end_date='2024-01-04'),
+    dict(tickers=['9984'], start_date='2024-01-05', smooth=[0, 7]),
+]
+
+
+@pytest.mark.parametrize('filters', FILTERS)
+@pytest.mark.parametrize('string_dates', [False, True])
+def test_read_stack_matches_filter_stack(tmp_path, filters, string_dates):
+    df = _stack()
+    if string_dates:
+        df['DATETIME'] = df['DATETIME'].dt.strftime('%Y-%m-%d')
+    path = str(tmp_path / 'stack.parquet')
+    df.to_parquet(path, row_group_size=8)
+
+    result = read_stack(path, **filters)
+    expected = filter_stack(df, **filters)
+    pd.testing.assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True))
+
+
+def test_read_stack_projects_columns(tmp_path):
+    df = _stack()
+    df['DATETIME'] = df['DATETIME'].dt.strftime('%Y-%m-%d')
+    path = str(tmp_path / 'stack.parquet')
+    df.to_parquet(path)
+
+    result = read_stack(path, start_date='2024-01-03', columns=['TICKER', 'VALUE'])
+    assert list(result.columns) == ['TICKER', 'VALUE']
+    assert len(result) == len(filter_stack(df, start_date='2024-01-03'))
+
+
+def test_read_stack_missing_file_raises_oserror(tmp_path):
+    with pytest.raises(OSError):
+        read_stack(str(tmp_path / 'missing.parquet'))
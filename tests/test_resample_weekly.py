@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from libs.dataset.utils import resample_weekly
+
+
+def _weekly_frame(seed=0):
+    rng = np.random.default_rng(seed)
+    frames = []
+    for ticker in ['7203', '1301', '1332']:
+        dates = pd.date_range('2020-01-01', periods=int(rng.integers(30, 200)), freq='D')
+        dates = dates[rng.random(len(dates)) > 0.6]
+        frames.append(pd.DataFrame({
+            'TICKER': ticker,
+            'DATETIME': dates,
+            'sales': rng.lognormal(size=len(dates)),
+            'count': rng.integers(0, 10, size=len(dates)),
+        }))
+    df = pd.concat(frames).set_index(['TICKER', 'DATETIME'])
+    df.iloc[::5, 0] = np.nan
+    return df
+
+
+def _expected(df, how, rule, closed='right', label='right'):
+    return df.groupby(level='TICKER').resample(rule, level='DATETIME', closed=closed, label=label).agg(how)
+
+
+@pytest.mark.parametrize('how', ['mean', 'sum', 'last'])
+def test_resample_weekly_matches_groupby_resample(how):
+    df = _weekly_frame()
+    out = resample_weekly(df, how)
+    out.columns.name = None
+    pd.testing.assert_frame_equal(out, _expected(df, how, 'W'), check_freq=False, check_exact=True)
+
+
+def test_resample_weekly_left_closed_bins():
+    df = _weekly_frame(1)
+    out = resample_weekly(df, 'mean', rule='W-FRI', closed='left', label='left')
+    out.columns.name = None
+    expected = _expected(df, 'mean', 'W-FRI', closed='left', label='left')
+    pd.testing.assert_frame_equal(out, expected, check_freq=False, check_exact=True)
+
+
+def test_resample_weekly_per_column_aggregation_and_unsorted_input():
+    df = _weekly_frame(2)
+    how = {'count': 'sum', 'sales': 'mean'}
+    out = resample_weekly(df.sample(frac=1, random_state=0), how)
+    out.columns.name = None
+    pd.testing.assert_frame_equal(out, _expected(df, how, 'W'), check_freq=False, check_exact=True)
+
+
+def test_resample_weekly_rejects_non_weekly_rules():
+    with pytest.raises(ValueError):
+        resample_weekly(_weekly_frame(), 'mean', rule='D')
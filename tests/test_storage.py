@@ -0,0 +1,58 @@
+import os
+
+import pandas as pd
+import pytest
+
+from libs.storage import partitioned_root, is_partitioned, write_partitioned, replace_dir
+from libs.dataset.incremental import write_base, stack_files
+
+
+def _stack(n_tickers=3, n_days=10, value=1.0):
+    dates = pd.date_range('2023-12-25', periods=n_days, freq='D')
+    return pd.DataFrame({
+        'TICKER': [str(1300 + i) for i in range(n_tickers) for _ in dates],
+        'DATETIME': list(dates) * n_tickers,
+        'RELEASE_TIMESTAMP': list(dates + pd.Timedelta(days=3)) * n_tickers,
+        'VALUE': value,
+    })
+
+
+def test_partitioned_root_expands_user(monkeypatch, tmp_path):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    assert partitioned_root('~/x_stack.parquet') == os.path.join(str(tmp_path), 'x_stack')
+    assert partitioned_root('~/x_stack') == os.path.join(str(tmp_path), 'x_stack.dataset')
+
+
+def test_write_partitioned_refuses_foreign_directory(tmp_path):
+    (tmp_path / 'notes.txt').write_text('keep me')
+    with pytest.raises(ValueError):
+        write_partitioned(_stack(), str(tmp_path))
+    assert (tmp_path / 'notes.txt').exists()
+
+
+def test_replace_dir(tmp_path):
+    root, tmp_root = str(tmp_path / 'root'), str(tmp_path / 'root.tmp')
+    write_partitioned(_stack(value=1.0), root)
+    write_partitioned(_stack(value=2.0), tmp_root)
+    replace_dir(tmp_root, root)
+    assert (pd.read_parquet(root)['VALUE'] == 2.0).all()
+    assert sorted(os.listdir(tmp_path)) == ['root']
+
+
+@pytest.mark.parametrize('partitioned', [False, True])
+def test_write_base_swaps_in_the_new_data(tmp_path, partitioned):
+    path = str(tmp_path / 'x_stack.parquet')
+    if partitioned:
+        write_partitioned(_stack(value=1.0), partitioned_root(path), n_buckets=4)
+    else:
+        _stack(value=1.0).to_parquet(path)
+
+    write_base(_stack(n_tickers=5, value=2.0), path)
+    assert is_partitioned(path) == partitioned
+    df = pd.read_parquet(stack_files(path))
+    assert len(df) == 50 and (df['VALUE'] == 2.0).all()
+    if partitioned:
+        assert not os.path.exists(partitioned_root(path) + '.tmp')
+        assert not os.path.exists(partitioned_root(path) + '.old')
+    else:
+        assert not os.path.exists(path + '.tmp')
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+from libs.analyze.training_set import build_training_sets
+
+
+def _make(n_tickers=6, seed=1):
+    rng = np.random.default_rng(seed)
+    tickers = [str(1000 + i) for i in range(n_tickers)]
+    dates = pd.date_range('2008-03-31', periods=60, freq='QE')
+    sales = pd.DataFrame(
+        {'sales': rng.uniform(50, 150, size=n_tickers * len(dates))},
+        index=pd.MultiIndex.from_product([tickers, dates], names=['TICKER', 'DATETIME']))
+
+    pos = {}
+    for lag in [-1, 0]:
+        for diff in [True, False]:
+            frames = []
+            for ticker in tickers:
+                start = rng.integers(0, 20)
+                n = rng.integers(15, len(dates) - start)
+                f = pd.DataFrame(
+                    {'y': rng.normal(size=n), 'X': rng.normal(size=n)},
+                    index=pd.MultiIndex.from_product(
+                        [[ticker], dates[start:start + n]], names=['TICKER', 'DATETIME']))
+                f.loc[f.sample(frac=0.05, random_state=int(rng.integers(1e6))).index, 'X'] = np.nan
+                frames.append(f)
+            pos[lag, diff] = pd.concat(frames)
+    pos_data = pd.concat(pos)
+    pos_data.index.names = ['lag', 'diff', 'TICKER', 'DATETIME']
+
+    corr = {
+        key: d.dropna().groupby(level=0).tail(40)[['y']].rename(columns={'y': 't_val'})
+        for key, d in pos.items()
+    }
+    corr = pd.concat(corr, names=['lag', 'diff1']).reorder_levels([2, 3, 0, 1])
+    corr.index.names = ['TICKER', 'datetime', 'lag', 'diff1']
+    best = corr.sort_values('t_val').groupby(['TICKER', 'datetime']).tail(1)
+    best = best.reset_index(['lag', 'diff1']).sort_index()
+
+    cons = sales.sample(frac=0.6, random_state=1).sort_index().rename(columns={'sales': 'consensus'})
+    cons['consensus'] *= rng.uniform(0.9, 1.1, size=len(cons))
+    cons.index.names = ['TICKER', 'fiscal_period_end_date']
+    return best, pos_data, cons, sales
+
+
+def _reference(best_correlations, pos_data, cons, sales):
+    # ノートブックのループ
+    best_correlations = best_correlations.copy()
+
+    def set_data(dic, d):
+        d = d.dropna().copy()
+        if len(d) <= 20:
+            return
+        d.index.names = ['DATETIME']
+        d['PRED_DATETIME'] = datetime
+        d['TICKER'] = ticker
+        d = d.reset_index().set_index(['PRED_DATETIME', 'TICKER', 'DATETIME'])
+        dic.append(d)
+
+    dataset_with_consensus = []
+    dataset_without_consensus = []
+    for (ticker, until), setting in best_correlations.iterrows():
+        lag, diff1 = setting['lag'], setting['diff1']
+        d = pos_data.xs(lag).xs(diff1).xs(ticker).loc[:until].copy()
+        try:
+            target = pos_data.xs(lag).xs(diff1).xs(ticker).loc[until:].iloc[1]
+        except IndexError:
+            continue
+        datetime = target.name
+        best_correlations.loc[(ticker, until), 'PRED_DATETIME'] = datetime
+
+        d = pd.concat([d, target.to_frame().T])
+        if (ticker, datetime) in cons.index:
+            con = cons.xs(ticker)[['consensus']]
+            con['pre'] = sales.xs(ticker).shift(4)['sales']
+            con['y'] = np.log(con['consensus'] / con['pre'])
+            if diff1:
+                con['y'] = con['y'].diff()
+            d['con_y'] = con['y']
+            set_data(dataset_with_consensus, d)
+        else:
+            set_data(dataset_without_consensus, d)
+
+    dfbest_correlations = best_correlations.reset_index().set_index(['TICKER', 'PRED_DATETIME'])
+    return dfbest_correlations, pd.concat(dataset_with_consensus), pd.concat(dataset_without_consensus)
+
+
+def test_build_training_sets_matches_notebook_loop():
+    best, pos_data, cons, sales = _make()
+    expected = _reference(best, pos_data, cons, sales)
+    result = build_training_sets(best, pos_data, cons, sales)
+    for r, e in zip(result, expected):
+        pd.testing.assert_frame_equal(r, e)
+    assert len(result[1]) and len(result[2])
@@ -0,0 +1,43 @@
+import pandas as pd
+
+from libs.dataset import universe
+from libs.dataset.incremental import write_base, append_increment
+from libs.dataset.universe import read_universe, universe_tickers
+
+
+def _stack(tickers, dates, release_lag_days=3):
+    dates = pd.DatetimeIndex(dates)
+    return pd.DataFrame({
+        'TICKER': [t for t in tickers for _ in dates],
+        'DATETIME': list(dates) * len(tickers),
+        'RELEASE_TIMESTAMP': list(dates + pd.Timedelta(days=release_lag_days)) * len(tickers),
+        'VALUE': 1.0,
+    })
+
+
+def test_index_follows_write_base_and_increments(tmp_path, monkeypatch):
+    path = str(tmp_path / 'x_stack.parquet')
+    today = pd.Timestamp.now().normalize()
+    base = _stack(['1301', '7203'], pd.date_range(today - pd.Timedelta(days=60), periods=30))
+    write_base(base, path)
+    assert read_universe(path)['ROWS'].to_dict() == {'1301': 30, '7203': 30}
+
+    # 差分は index を作り直さずに追加する
+    def fail(path):
+        raise AssertionError('rebuilt')
+    monkeypatch.setattr(universe, 'build_universe', fail)
+    new = _stack(['7203', '9984'], pd.date_range(today - pd.Timedelta(days=20), periods=5))
+    append_increment(path, lambda start, end: pd.concat([base, new]), reconcile_days=None)
+    summary = read_universe(path)
+    assert summary['ROWS'].to_dict() == {'1301': 30, '7203': 35, '9984': 5}
+    assert universe_tickers(path) == ['1301', '7203', '9984']
+
+
+def test_stale_index_is_not_used(tmp_path):
+    path = str(tmp_path / 'x_stack.parquet')
+    write_base(_stack(['1301', '7203'], pd.date_range('2024-01-01', periods=10)), path)
+
+    # index を更新せずに本体だけ書き換えられた
+    _stack(['6758'], pd.date_range('2024-01-01', periods=12)).to_parquet(path)
+    assert read_universe(path) is None
+    assert universe_tickers(path) == ['6758']
@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('aiq_strategy_robot')
+pytest.importorskip('yfinance')
+
+from libs.dataset import common
+
+
+class StubTicker:
+    """yf.Ticker stand-in: prices for 1301 / 7203, nothing for 9999, errors for 0000."""
+
+    calls = {}
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+
+    def history(self, start=None):
+        ticker = self.symbol.replace('.T', '')
+        StubTicker.calls[ticker] = StubTicker.calls.get(ticker, 0) + 1
+        if ticker == '0000':
+            raise ConnectionError('rate limited')
+        if ticker == '9999':
+            return pd.DataFrame(columns=common.YFINANCE_COLUMNS)
+        index = pd.date_range(start, periods=3, freq='B', tz='Asia/Tokyo', name='Date')
+        return pd.DataFrame({c: 1.0 for c in common.YFINANCE_COLUMNS}, index=index)
+
+
+@pytest.fixture(autouse=True)
+def stub_ticker(monkeypatch):
+    StubTicker.calls = {}
+    monkeypatch.setattr(common.yf, 'Ticker', StubTicker)
+
+
+def test_prices_and_failures():
+    df, failures = common.read_market_data_from_yfinance(
+        ['1301', '7203', '9999', '0000'], '2024-01-01', retries=2, backoff=0, return_failures=True)
+    assert df.index.names == ['TICKER', 'DATETIME']
+    assert sorted(df.index.get_level_values('TICKER').unique()) == ['1301', '7203']
+    assert df.index.get_level_values('DATETIME').tz is None
+    assert 'close' in df.columns
+    assert failures['9999'] == 'no data'
+    assert failures['0000'].startswith('ConnectionError')
+    assert StubTicker.calls['0000'] == 3
+
+
+def test_every_ticker_failing_returns_an_empty_frame():
+    df, failures = common.read_market_data_from_yfinance(
+        ['9999', '0000'], '2024-01-01', retries=0, backoff=0, return_failures=True)
+    assert df.empty
+    assert df.index.names == ['TICKER', 'DATETIME']
+    assert 'close' in df.columns
+    assert set(failures) == {'9999', '0000'}
+
+
+def test_reload_market_to_s3_rejects_unknown_engine(tmp_path):
+    with pytest.raises(ValueError, match='engine'):
+        common.reload_market_to_s3(extract_dir=str(tmp_path), engine='pandas')